@@ -0,0 +1,110 @@
+import os
+import sys
+import argparse
+from pathlib import Path
+
+import apk_zip
+import instrument
+
+def required_alignment(entry):
+    """エントリのデータに必要なアラインメント（圧縮されたエントリはNone）"""
+    if apk_zip.NATIVE_LIB_ENTRY.match(entry.filename):
+        return apk_zip.NATIVE_LIB_ALIGNMENT
+    if entry.method == apk_zip.STORED:
+        return apk_zip.DEFAULT_ALIGNMENT
+    return None
+
+def verify(apk_path):
+    """アラインメント違反のリストを返す（空なら問題なし）
+
+    ネイティブライブラリは無圧縮かつ16KiB境界、それ以外の無圧縮エントリは4バイト境界であること。
+    """
+    violations = []
+    with open(apk_path, 'rb') as f:
+        for entry in apk_zip.read_entries(f):
+            alignment = required_alignment(entry)
+            if alignment is None:
+                continue
+            if entry.method != apk_zip.STORED:
+                violations.append({"name": entry.filename, "offset": None, "alignment": alignment,
+                                   "problem": "compressed"})
+                continue
+            data_offset, _ = apk_zip.local_data_offset(f, entry)
+            if data_offset % alignment:
+                violations.append({"name": entry.filename, "offset": data_offset, "alignment": alignment,
+                                   "problem": "unaligned"})
+    return violations
+
+def format_violation(violation):
+    if violation["problem"] == "compressed":
+        return f"{violation['name']}: 圧縮されています（無圧縮・{violation['alignment']}バイト境界が必要）"
+    return (f"{violation['name']}: データの位置 {violation['offset']} が"
+            f"{violation['alignment']}バイト境界に揃っていません（{violation['offset'] % violation['alignment']}バイトずれ）")
+
+@instrument.traced()
+def align_apk(apk_path, output_path=None):
+    """エントリの順序を保ったまま、ネイティブライブラリを無圧縮・16KiB境界、その他を4バイト境界で書き直す
+
+    output_pathを省略すると元のファイルを置き換える。署名は無効になるため、署名の前に実行する。
+    """
+    apk_path = Path(apk_path)
+    output_path = Path(output_path or apk_path)
+    temp_output = output_path.with_name(output_path.name + ".align.tmp")
+    stored = 0
+    try:
+        with open(apk_path, 'rb') as src, open(temp_output, 'wb') as dst:
+            writer = apk_zip.RawZipWriter(dst)
+            for entry in apk_zip.read_entries(src):
+                alignment = required_alignment(entry) or apk_zip.DEFAULT_ALIGNMENT
+                if apk_zip.NATIVE_LIB_ENTRY.match(entry.filename) and entry.method != apk_zip.STORED:
+                    writer.store_entry(src, entry, alignment=alignment)
+                    stored += 1
+                else:
+                    writer.copy_entry(src, entry, alignment=alignment)
+            writer.close()
+        instrument.count("bytes_written", os.path.getsize(temp_output))
+    except BaseException:
+        temp_output.unlink(missing_ok=True)
+        raise
+    os.replace(temp_output, output_path)
+    print(f"アラインメントを修正しました: {output_path}（無圧縮に変換: {stored}個）")
+    return output_path
+
+def ensure_aligned(apk_path, output_path=None):
+    """違反がなければそのまま元のパスを返し、あればalign_apkで書き直したパスを返す"""
+    violations = verify(apk_path)
+    if not violations:
+        return Path(apk_path)
+    print(f"{apk_path}: アラインメント違反が{len(violations)}件あります")
+    for violation in violations[:10]:
+        print(f"  - {format_violation(violation)}")
+    if len(violations) > 10:
+        print(f"  ...ほか{len(violations) - 10}件")
+    return align_apk(apk_path, output_path)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="APK内のネイティブライブラリの格納方法とアラインメントの検証・修正")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    verify_parser = subparsers.add_parser("verify", help="アラインメント違反を表示する（違反があれば終了コード1）")
+    verify_parser.add_argument("apks", type=Path, nargs="+")
+    align_parser = subparsers.add_parser("align", help="アラインメントを修正する")
+    align_parser.add_argument("apk", type=Path)
+    align_parser.add_argument("-o", "--output", type=Path, default=None, help="出力先（既定: 元のファイルを置き換える）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "align":
+        align_apk(args.apk, args.output)
+        args.apks = [args.output or args.apk]
+    failed = False
+    for apk in args.apks:
+        violations = verify(apk)
+        for violation in violations:
+            print(f"{apk}: {format_violation(violation)}")
+        print(f"{apk}: {'違反はありません' if not violations else f'違反 {len(violations)}件'}")
+        failed = failed or bool(violations)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
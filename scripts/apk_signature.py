@@ -0,0 +1,283 @@
+import os
+import struct
+import hashlib
+
+APK_SIG_BLOCK_MAGIC = b"APK Sig Block 42"
+V2_BLOCK_ID = 0x7109871a
+V3_BLOCK_ID = 0xf05368c0
+STRIPPING_PROTECTION_ATTR_ID = 0xbeeff00d
+SIG_RSA_PKCS1_V1_5_SHA256 = 0x0103
+SIG_ECDSA_SHA256 = 0x0201
+DIGEST_CHUNK_SIZE = 1024 * 1024
+EOCD_MIN_SIZE = 22
+EOCD_SIGNATURE = b"PK\x05\x06"
+V3_MIN_SDK = 28
+V3_MAX_SDK = 0x7fffffff
+
+def _u32(value):
+    return struct.pack("<I", value)
+
+def _lp(data):
+    """uint32のリトルエンディアン長さプレフィックスを付ける"""
+    return _u32(len(data)) + data
+
+def _lp_seq(items):
+    return _lp(b"".join(_lp(item) for item in items))
+
+def find_eocd(f):
+    """End of Central Directoryの位置と内容を返す"""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    tail_size = min(size, EOCD_MIN_SIZE + 0xffff)
+    f.seek(size - tail_size)
+    tail = f.read(tail_size)
+    pos = tail.rfind(EOCD_SIGNATURE)
+    while pos >= 0:
+        comment_len = struct.unpack("<H", tail[pos + 20:pos + 22])[0]
+        if pos + EOCD_MIN_SIZE + comment_len == len(tail):
+            return size - tail_size + pos, tail[pos:]
+        pos = tail.rfind(EOCD_SIGNATURE, 0, pos)
+    raise ValueError("End of Central Directoryが見つかりません（ZIPファイルではありません）")
+
+def read_zip_sections(f):
+    """エントリ領域の終端（既存署名ブロックを除く）・中央ディレクトリ・EOCDを取得"""
+    eocd_offset, eocd = find_eocd(f)
+    cd_size, cd_offset = struct.unpack("<II", eocd[12:20])
+    if cd_offset == 0xffffffff or cd_offset + cd_size != eocd_offset:
+        raise ValueError("ZIP64または不正な中央ディレクトリには対応していません")
+    f.seek(cd_offset)
+    central_directory = f.read(cd_size)
+
+    entries_end = cd_offset
+    if cd_offset >= 24 + 8:
+        f.seek(cd_offset - 24)
+        footer = f.read(24)
+        if footer[8:] == APK_SIG_BLOCK_MAGIC:
+            block_size = struct.unpack("<Q", footer[:8])[0]
+            entries_end = cd_offset - block_size - 8
+    return entries_end, central_directory, eocd
+
+def content_fingerprint(apk_path):
+    """APK全体を読まずに内容を識別するハッシュ（サイズ・既存の署名ブロック・中央ディレクトリ・EOCDから計算）
+
+    中央ディレクトリには各エントリのCRC32とサイズが、v2/v3の署名ブロックにはAPK全体のダイジェストが含まれる。
+    """
+    with open(apk_path, 'rb') as f:
+        entries_end, central_directory, eocd = read_zip_sections(f)
+        cd_offset = struct.unpack("<I", eocd[16:20])[0]
+        f.seek(entries_end)
+        signing_block = f.read(cd_offset - entries_end)
+        size = f.seek(0, os.SEEK_END)
+    digest = hashlib.sha256(struct.pack("<Q", size))
+    for section in (signing_block, central_directory, eocd):
+        digest.update(struct.pack("<Q", len(section)) + section)
+    return digest.hexdigest()
+
+def _chunk_digest(chunk):
+    digest = hashlib.sha256(b"\xa5" + _u32(len(chunk)))
+    digest.update(chunk)
+    return digest.digest()
+
+def _top_level_digest(chunk_digests):
+    return hashlib.sha256(b"\x5a" + _u32(len(chunk_digests)) + b"".join(chunk_digests)).digest()
+
+def _bytes_chunk_digests(data):
+    return [_chunk_digest(data[i:i + DIGEST_CHUNK_SIZE]) for i in range(0, len(data), DIGEST_CHUNK_SIZE)]
+
+def _chunked_digest(sections):
+    """APK署名スキームv2/v3のチャンク化SHA-256ダイジェスト（sectionsは (ファイル, 開始, 終了) またはbytes）"""
+    chunk_digests = []
+    for section in sections:
+        if isinstance(section, bytes):
+            chunk_digests += _bytes_chunk_digests(section)
+        else:
+            chunk_digests += [_chunk_digest(chunk) for chunk in _iter_file_range(*section)]
+    return _top_level_digest(chunk_digests)
+
+class DigestingWriter:
+    """ファイル先頭から書き込んだエントリ領域のチャンクダイジェストを書き込みながら計算する
+
+    書き終えたあとに読み直さずにコンテンツダイジェストを求められる。
+    """
+
+    def __init__(self, fp):
+        if fp.tell() != 0:
+            raise ValueError("エントリ領域はファイルの先頭から書き込む必要があります")
+        self.fp = fp
+        self.pending = bytearray()
+        self.chunk_digests = []
+
+    def tell(self):
+        return self.fp.tell()
+
+    def write(self, data):
+        self.fp.write(data)
+        view = memoryview(data)
+        if self.pending:
+            needed = DIGEST_CHUNK_SIZE - len(self.pending)
+            self.pending += view[:needed]
+            view = view[needed:]
+            if len(self.pending) < DIGEST_CHUNK_SIZE:
+                return len(data)
+            self.chunk_digests.append(_chunk_digest(self.pending))
+            self.pending.clear()
+        while len(view) >= DIGEST_CHUNK_SIZE:
+            self.chunk_digests.append(_chunk_digest(view[:DIGEST_CHUNK_SIZE]))
+            view = view[DIGEST_CHUNK_SIZE:]
+        self.pending += view
+        return len(data)
+
+    def content_digest(self, central_directory, eocd):
+        """エントリ領域（書き込み済み）・中央ディレクトリ・EOCDのダイジェスト"""
+        chunk_digests = list(self.chunk_digests)
+        if self.pending:
+            chunk_digests.append(_chunk_digest(self.pending))
+        entries_end = self.fp.tell()
+        chunk_digests += _bytes_chunk_digests(central_directory)
+        chunk_digests += _bytes_chunk_digests(_eocd_with_cd_offset(eocd, entries_end))
+        return _top_level_digest(chunk_digests)
+
+def _iter_file_range(f, start, end):
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = f.read(min(DIGEST_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise ValueError("APKの読み取り中にファイル終端に達しました")
+        remaining -= len(chunk)
+        yield chunk
+
+def _eocd_with_cd_offset(eocd, cd_offset):
+    return eocd[:16] + _u32(cd_offset) + eocd[20:]
+
+class ApkSigner:
+    """純Pythonによる APK Signature Scheme v2/v3 署名（cryptographyパッケージが必要）"""
+
+    def __init__(self, private_key, certificate_der):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+        self.private_key = private_key
+        self.certificate_der = certificate_der
+        self.public_key_der = private_key.public_key().public_bytes(
+            serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+        if isinstance(private_key, rsa.RSAPrivateKey):
+            self.algorithm = SIG_RSA_PKCS1_V1_5_SHA256
+        elif isinstance(private_key, ec.EllipticCurvePrivateKey):
+            self.algorithm = SIG_ECDSA_SHA256
+        else:
+            raise ValueError("RSAまたはEC以外の鍵には対応していません")
+
+    @classmethod
+    def from_pkcs12(cls, path, password):
+        from cryptography.hazmat.primitives.serialization import pkcs12
+        from cryptography.hazmat.primitives import serialization
+
+        with open(path, 'rb') as f:
+            key, cert, _ = pkcs12.load_key_and_certificates(f.read(), password)
+        return cls(key, cert.public_bytes(serialization.Encoding.DER))
+
+    def _sign(self, data):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec, padding
+
+        if self.algorithm == SIG_RSA_PKCS1_V1_5_SHA256:
+            return self.private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+        return self.private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+
+    def _v2_signer(self, digest, v3):
+        attributes = []
+        if v3:
+            # v3署名を剥がしてv2だけで検証させる攻撃を防ぐ属性
+            attributes.append(_u32(STRIPPING_PROTECTION_ATTR_ID) + _u32(3))
+        signed_data = (_lp_seq([_u32(self.algorithm) + _lp(digest)])
+                       + _lp_seq([self.certificate_der])
+                       + _lp_seq(attributes))
+        signatures = _lp_seq([_u32(self.algorithm) + _lp(self._sign(signed_data))])
+        return _lp_seq([_lp(signed_data) + signatures + _lp(self.public_key_der)])
+
+    def _v3_signer(self, digest):
+        signed_data = (_lp_seq([_u32(self.algorithm) + _lp(digest)])
+                       + _lp_seq([self.certificate_der])
+                       + _u32(V3_MIN_SDK) + _u32(V3_MAX_SDK)
+                       + _lp_seq([]))
+        signatures = _lp_seq([_u32(self.algorithm) + _lp(self._sign(signed_data))])
+        return _lp_seq([_lp(signed_data) + _u32(V3_MIN_SDK) + _u32(V3_MAX_SDK)
+                        + signatures + _lp(self.public_key_der)])
+
+    def signing_block(self, digest, v3=True):
+        """計算済みのコンテンツダイジェストからAPK Signing Blockを組み立てる"""
+        pairs = [(V2_BLOCK_ID, self._v2_signer(digest, v3))]
+        if v3:
+            pairs.append((V3_BLOCK_ID, self._v3_signer(digest)))
+        body = b"".join(struct.pack("<QI", len(value) + 4, block_id) + value for block_id, value in pairs)
+        block_size = len(body) + 8 + len(APK_SIG_BLOCK_MAGIC)
+        return struct.pack("<Q", block_size) + body + struct.pack("<Q", block_size) + APK_SIG_BLOCK_MAGIC
+
+    def _write_tail(self, f, entries_end, digest, central_directory, eocd, v3):
+        block = self.signing_block(digest, v3=v3)
+        f.seek(entries_end)
+        f.write(block)
+        f.write(central_directory)
+        f.write(_eocd_with_cd_offset(eocd, entries_end + len(block)))
+        f.truncate()
+
+    def sign_in_place(self, apk_path, v3=True):
+        """エントリ領域はそのままに、署名ブロック・中央ディレクトリ・EOCDだけを書き直す"""
+        with open(apk_path, 'r+b') as f:
+            entries_end, central_directory, eocd = read_zip_sections(f)
+            digest = _chunked_digest([
+                (f, 0, entries_end),
+                central_directory,
+                _eocd_with_cd_offset(eocd, entries_end),
+            ])
+            self._write_tail(f, entries_end, digest, central_directory, eocd, v3)
+        return apk_path
+
+    def sign_copy(self, source, dest, v3=True):
+        """元のAPKのエントリ領域を書き写しながらダイジェストを計算し、続けて署名ブロックを書く
+
+        コピーしてから署名する場合と違い、出力を読み直さずに1回の書き込みで署名済みAPKを作る。
+        """
+        with open(source, 'rb') as src, open(dest, 'wb') as dst:
+            entries_end, central_directory, eocd = read_zip_sections(src)
+            writer = DigestingWriter(dst)
+            for chunk in _iter_file_range(src, 0, entries_end):
+                writer.write(chunk)
+            digest = writer.content_digest(central_directory, eocd)
+            self._write_tail(dst, entries_end, digest, central_directory, eocd, v3)
+        return dest
+
+def generate_debug_key(common_name="Android Debug"):
+    """keytoolが使えない環境向けに、デバッグ用のRSA鍵と自己署名証明書を生成"""
+    import datetime
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([
+        x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Android"),
+        x509.NameAttribute(NameOID.COUNTRY_NAME, "US"),
+    ])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=10000))
+            .sign(key, hashes.SHA256()))
+    return key, cert
+
+def write_pkcs12(path, key, cert, alias, password):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.serialization import pkcs12
+
+    data = pkcs12.serialize_key_and_certificates(
+        alias.encode("utf-8"), key, cert, None, serialization.BestAvailableEncryption(password))
+    with open(path, 'wb') as f:
+        f.write(data)
@@ -0,0 +1,245 @@
+import os
+import re
+import zlib
+import struct
+import shutil
+
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+CENTRAL_HEADER_SIGNATURE = 0x02014b50
+EOCD_SIGNATURE = 0x06054b50
+LOCAL_HEADER_SIZE = 30
+CENTRAL_HEADER_SIZE = 46
+STORED = 0
+DEFLATED = 8
+FLAG_DATA_DESCRIPTOR = 0x0008
+# DEFLATEの圧縮レベルを表すビット（無圧縮にした場合は落とす）
+FLAG_DEFLATE_OPTIONS = 0x0006
+# zipalign/apksignerが使うアラインメント用のextraフィールド
+ALIGNMENT_EXTRA_ID = 0xd935
+COPY_BLOCK_SIZE = 1024 * 1024
+# 4KiB・16KiBどちらのページサイズのデバイスでもAPKから直接mmapできるよう、ネイティブライブラリは16KiB境界に揃える
+NATIVE_LIB_ALIGNMENT = 16 * 1024
+DEFAULT_ALIGNMENT = 4
+NATIVE_LIB_ENTRY = re.compile(r"^lib/[^/]+/[^/]+\.so$")
+
+class ZipEntry:
+    """中央ディレクトリの1レコード（圧縮済みデータはそのまま扱う）"""
+
+    def __init__(self, name, method, crc, compressed_size, size, dos_time=0, dos_date=0x21,
+                 flags=0, extra=b"", comment=b"", internal_attr=0, external_attr=0,
+                 version_made=20, version_needed=20, local_offset=0):
+        self.name = name
+        self.method = method
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.size = size
+        self.dos_time = dos_time
+        self.dos_date = dos_date
+        self.flags = flags
+        self.extra = extra
+        self.comment = comment
+        self.internal_attr = internal_attr
+        self.external_attr = external_attr
+        self.version_made = version_made
+        self.version_needed = version_needed
+        self.local_offset = local_offset
+
+    @property
+    def filename(self):
+        return self.name.decode("utf-8", "replace")
+
+def read_entries(f):
+    """中央ディレクトリを読み、エントリを格納順で返す"""
+    from apk_signature import find_eocd
+
+    _, eocd = find_eocd(f)
+    count, cd_size, cd_offset = struct.unpack("<HII", eocd[10:20])
+    f.seek(cd_offset)
+    data = f.read(cd_size)
+    entries = []
+    pos = 0
+    for _ in range(count):
+        (signature, version_made, version_needed, flags, method, dos_time, dos_date, crc,
+         compressed_size, size, name_len, extra_len, comment_len, _, internal_attr,
+         external_attr, local_offset) = struct.unpack("<IHHHHHHIIIHHHHHII", data[pos:pos + CENTRAL_HEADER_SIZE])
+        if signature != CENTRAL_HEADER_SIGNATURE:
+            raise ValueError("中央ディレクトリのレコードが不正です")
+        pos += CENTRAL_HEADER_SIZE
+        name = data[pos:pos + name_len]
+        extra = data[pos + name_len:pos + name_len + extra_len]
+        comment = data[pos + name_len + extra_len:pos + name_len + extra_len + comment_len]
+        pos += name_len + extra_len + comment_len
+        entries.append(ZipEntry(name, method, crc, compressed_size, size, dos_time, dos_date, flags,
+                                extra, comment, internal_attr, external_attr, version_made,
+                                version_needed, local_offset))
+    return entries
+
+def local_data_offset(f, entry):
+    """ローカルヘッダーの後ろにある圧縮データの開始位置と、ローカルのextraを返す"""
+    f.seek(entry.local_offset)
+    header = f.read(LOCAL_HEADER_SIZE)
+    signature, = struct.unpack("<I", header[:4])
+    if signature != LOCAL_HEADER_SIGNATURE:
+        raise ValueError(f"ローカルヘッダーが不正です: {entry.filename}")
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    f.seek(entry.local_offset + LOCAL_HEADER_SIZE + name_len)
+    extra = f.read(extra_len)
+    return entry.local_offset + LOCAL_HEADER_SIZE + name_len + extra_len, extra
+
+def _strip_alignment_extra(extra):
+    """既存のアラインメント用extraを取り除く（再アラインメントのため）"""
+    result = b""
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, size = struct.unpack("<HH", extra[pos:pos + 4])
+        if pos + 4 + size > len(extra):
+            break
+        if header_id != ALIGNMENT_EXTRA_ID and header_id != 0:
+            result += extra[pos:pos + 4 + size]
+        pos += 4 + size
+    return result
+
+def _copy_range(src, dst, length):
+    remaining = length
+    while remaining > 0:
+        block = src.read(min(COPY_BLOCK_SIZE, remaining))
+        if not block:
+            raise ValueError("ZIPデータの読み取り中にファイル終端に達しました")
+        dst.write(block)
+        remaining -= len(block)
+
+class RawZipWriter:
+    """元のAPKのエントリを再圧縮せずにコピーし、新しいエントリを追加するZIPライター"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.entries = []
+        self.names = set()
+
+    def _write_local_header(self, entry, extra, alignment):
+        name_len = len(entry.name)
+        offset = self.fp.tell()
+        if alignment and entry.method == STORED:
+            data_start = offset + LOCAL_HEADER_SIZE + name_len + len(extra)
+            # 4バイトのヘッダー + 2バイトのアラインメント値 + パディング
+            padding = (-(data_start + 6)) % alignment
+            extra += struct.pack("<HHH", ALIGNMENT_EXTRA_ID, 2 + padding, alignment) + b"\0" * padding
+        entry.local_offset = offset
+        self.fp.write(struct.pack(
+            "<IHHHHHIIIHH", LOCAL_HEADER_SIGNATURE, entry.version_needed,
+            entry.flags & ~FLAG_DATA_DESCRIPTOR, entry.method, entry.dos_time, entry.dos_date,
+            entry.crc, entry.compressed_size, entry.size, name_len, len(extra)))
+        self.fp.write(entry.name)
+        self.fp.write(extra)
+
+    def _register(self, entry):
+        if entry.name in self.names:
+            raise ValueError(f"エントリが重複しています: {entry.filename}")
+        self.names.add(entry.name)
+        self.entries.append(entry)
+
+    def copy_entry(self, src, entry, alignment=DEFAULT_ALIGNMENT):
+        """圧縮済みデータをそのまま書き写す（データディスクリプタは中央ディレクトリの値で置き換え）"""
+        data_offset, local_extra = local_data_offset(src, entry)
+        copied = ZipEntry(entry.name, entry.method, entry.crc, entry.compressed_size, entry.size,
+                          entry.dos_time, entry.dos_date, entry.flags & ~FLAG_DATA_DESCRIPTOR,
+                          entry.extra, entry.comment, entry.internal_attr, entry.external_attr,
+                          entry.version_made, entry.version_needed)
+        self._write_local_header(copied, _strip_alignment_extra(local_extra), alignment)
+        src.seek(data_offset)
+        _copy_range(src, self.fp, entry.compressed_size)
+        self._register(copied)
+        return copied
+
+    def store_entry(self, src, entry, alignment=DEFAULT_ALIGNMENT):
+        """圧縮されたエントリを展開しながら無圧縮（STORED）で書き写す"""
+        if entry.method != DEFLATED:
+            raise ValueError(f"未対応の圧縮方式です: {entry.filename} (method {entry.method})")
+        data_offset, local_extra = local_data_offset(src, entry)
+        stored = ZipEntry(entry.name, STORED, entry.crc, entry.size, entry.size,
+                          entry.dos_time, entry.dos_date,
+                          entry.flags & ~(FLAG_DATA_DESCRIPTOR | FLAG_DEFLATE_OPTIONS),
+                          entry.extra, entry.comment, entry.internal_attr, entry.external_attr,
+                          entry.version_made, entry.version_needed)
+        self._write_local_header(stored, _strip_alignment_extra(local_extra), alignment)
+        src.seek(data_offset)
+        decompressor = zlib.decompressobj(-15)
+        crc = written = 0
+        remaining = entry.compressed_size
+        while remaining > 0 or decompressor.unconsumed_tail:
+            if decompressor.unconsumed_tail:
+                data = decompressor.unconsumed_tail
+            else:
+                data = src.read(min(COPY_BLOCK_SIZE, remaining))
+                if not data:
+                    raise ValueError("ZIPデータの読み取り中にファイル終端に達しました")
+                remaining -= len(data)
+            block = decompressor.decompress(data, COPY_BLOCK_SIZE)
+            self.fp.write(block)
+            crc = zlib.crc32(block, crc)
+            written += len(block)
+        block = decompressor.flush()
+        self.fp.write(block)
+        crc = zlib.crc32(block, crc)
+        written += len(block)
+        if written != entry.size or crc & 0xffffffff != entry.crc:
+            raise ValueError(f"展開したデータのサイズまたはCRCが一致しません: {entry.filename}")
+        self._register(stored)
+        return stored
+
+    def add_bytes(self, name, data, compress=True, alignment=DEFAULT_ALIGNMENT):
+        if isinstance(name, str):
+            name = name.encode("utf-8")
+        crc = zlib.crc32(data) & 0xffffffff
+        if compress:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+            payload = compressor.compress(data) + compressor.flush()
+            method = DEFLATED
+        else:
+            payload = data
+            method = STORED
+        entry = ZipEntry(name, method, crc, len(payload), len(data))
+        self._write_local_header(entry, b"", alignment)
+        self.fp.write(payload)
+        self._register(entry)
+        return entry
+
+    def add_file(self, name, path, compress=False, alignment=DEFAULT_ALIGNMENT):
+        """大きなファイル（.soなど）を追加する。無圧縮の場合はCRCを先に計算してストリームでコピー"""
+        if compress:
+            with open(path, 'rb') as f:
+                return self.add_bytes(name, f.read(), compress=True, alignment=alignment)
+        if isinstance(name, str):
+            name = name.encode("utf-8")
+        crc = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b""):
+                crc = zlib.crc32(block, crc)
+        size = os.path.getsize(path)
+        entry = ZipEntry(name, STORED, crc & 0xffffffff, size, size)
+        self._write_local_header(entry, b"", alignment)
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.fp, COPY_BLOCK_SIZE)
+        self._register(entry)
+        return entry
+
+    def central_directory(self):
+        records = []
+        for entry in self.entries:
+            records.append(struct.pack(
+                "<IHHHHHHIIIHHHHHII", CENTRAL_HEADER_SIGNATURE, entry.version_made,
+                entry.version_needed, entry.flags, entry.method, entry.dos_time, entry.dos_date,
+                entry.crc, entry.compressed_size, entry.size, len(entry.name), len(entry.extra),
+                len(entry.comment), 0, entry.internal_attr, entry.external_attr, entry.local_offset))
+            records.append(entry.name + entry.extra + entry.comment)
+        return b"".join(records)
+
+    def end_of_central_directory(self, cd_offset, cd_size):
+        count = len(self.entries)
+        return struct.pack("<IHHHHIIH", EOCD_SIGNATURE, 0, 0, count, count, cd_size, cd_offset, 0)
+
+    def close(self):
+        cd_offset = self.fp.tell()
+        central_directory = self.central_directory()
+        self.fp.write(central_directory)
+        self.fp.write(self.end_of_central_directory(cd_offset, len(central_directory)))
@@ -0,0 +1,333 @@
+import os
+import sys
+import time
+import atexit
+import shutil
+import zipfile
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+import instrument
+
+TOOLS_DIR = Path("../tools")
+DAEMON_DIR = TOOLS_DIR / "apktool-daemon"
+# 全ビルドで共有するフレームワークディレクトリ（apktoolの -p）
+FRAMEWORK_DIR = TOOLS_DIR / "apktool-framework"
+# apktool.jarに同梱されている既定のフレームワーク（apktoolは初回に 1.apk として書き出す）
+BUNDLED_FRAMEWORK_ENTRY = "brut/androlib/android-framework.jar"
+DAEMON_CLASS = "ApktoolDaemon"
+# 0にすると常駐JVMを使わず、毎回 java -jar apktool.jar で実行する
+ENABLED = os.environ.get("INJECT_APKTOOL_DAEMON", "1") != "0"
+START_TIMEOUT = 60
+# 値にパスを取るオプション（常駐JVMはカレントディレクトリが異なるため絶対パスにする）
+PATH_OPTIONS = {"-o", "--output", "-p", "--frame-path"}
+# パス以外の値を取るオプション
+VALUE_OPTIONS = {"-t", "--tag", "-api", "--api-level", "-j", "--jobs"}
+
+# 標準入力から1行1ジョブ（"<ID>\t<ログファイル>\t<apktoolの引数>..."）を受け取り、
+# apktoolのMainをリフレクションで呼び出して "DONE\t<ID>\t<終了コード>" を返す。
+# apktoolはエラー時にSystem.exitを呼ぶため、SecurityManagerで終了を例外に変えてJVMを生かしておく
+# （SecurityManagerが使えないJVMでは終了したJVMをPython側で起動し直す）。
+DAEMON_SOURCE = r"""
+import java.io.*;
+import java.lang.reflect.*;
+import java.nio.charset.StandardCharsets;
+import java.util.Arrays;
+
+public class ApktoolDaemon {
+    static final class ExitException extends SecurityException {
+        final int status;
+
+        ExitException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    static boolean installExitGuard() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(java.security.Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(java.security.Permission perm, Object context) {
+                }
+
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitException(status);
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException | SecurityException e) {
+            return false;
+        }
+    }
+
+    static int exitStatus(Throwable e) {
+        for (Throwable t = e; t != null; t = t.getCause()) {
+            if (t instanceof ExitException) {
+                return ((ExitException) t).status;
+            }
+        }
+        return -1;
+    }
+
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        PrintStream originalErr = System.err;
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        Method apktoolMain = Class.forName("brut.apktool.Main").getMethod("main", String[].class);
+        boolean guarded = installExitGuard();
+        protocol.println("READY\t" + (guarded ? "guarded" : "unguarded"));
+
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            String[] parts = line.split("\t", -1);
+            String[] jobArgs = Arrays.copyOfRange(parts, 2, parts.length);
+            int status = 0;
+            try (PrintStream log = new PrintStream(new FileOutputStream(parts[1], true), true, "UTF-8")) {
+                System.setOut(log);
+                System.setErr(log);
+                try {
+                    apktoolMain.invoke(null, (Object) jobArgs);
+                } catch (InvocationTargetException e) {
+                    status = exitStatus(e.getCause());
+                    if (status < 0) {
+                        e.getCause().printStackTrace(log);
+                        status = 1;
+                    }
+                } catch (ExitException e) {
+                    status = e.status;
+                } finally {
+                    System.out.flush();
+                    System.setOut(protocol);
+                    System.setErr(originalErr);
+                }
+            }
+            protocol.println("DONE\t" + parts[0] + "\t" + status);
+        }
+    }
+}
+"""
+
+class DaemonError(Exception):
+    pass
+
+def prepare_framework(apktool_jar, framework_dir=FRAMEWORK_DIR):
+    """apktool.jarに同梱のフレームワークを 1.apk として先に書き出しておく（JVMを起動せずに済む）"""
+    framework_dir = Path(framework_dir)
+    framework_apk = framework_dir / "1.apk"
+    if framework_apk.exists():
+        return framework_dir
+    framework_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        with zipfile.ZipFile(apktool_jar) as jar, jar.open(BUNDLED_FRAMEWORK_ENTRY) as src:
+            temp_path = framework_apk.with_name(f"1.apk.{os.getpid()}.tmp")
+            with open(temp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(temp_path, framework_apk)
+    except (KeyError, zipfile.BadZipFile, OSError) as e:
+        # 書き出せなくても、apktoolが初回に自分で書き出す
+        print(f"警告: apktoolのフレームワークを事前に展開できませんでした: {e}")
+    return framework_dir
+
+def _absolute_args(args):
+    """パスの引数を絶対パスにする（最初の引数はd/bなどのコマンド）"""
+    result = [str(args[0])]
+    expects = None
+    for arg in map(str, args[1:]):
+        if expects == "path":
+            result.append(os.path.abspath(arg))
+        elif expects == "value" or arg.startswith("-"):
+            result.append(arg)
+        else:
+            result.append(os.path.abspath(arg))
+        expects = "path" if arg in PATH_OPTIONS else "value" if arg in VALUE_OPTIONS else None
+    return result
+
+class ApktoolDaemon:
+    """apktoolを読み込んだまま待機するJVM（ジョブは1つずつ順番に処理する）"""
+
+    def __init__(self, apktool_jar, daemon_dir=DAEMON_DIR):
+        self.apktool_jar = Path(apktool_jar).resolve()
+        self.daemon_dir = Path(daemon_dir).resolve()
+        self.process = None
+        self.guarded = False
+        self.jobs = 0
+        self.restarts = 0
+        self._lock = threading.Lock()
+
+    def _write_source(self):
+        self.daemon_dir.mkdir(parents=True, exist_ok=True)
+        source = self.daemon_dir / f"{DAEMON_CLASS}.java"
+        if not source.exists() or source.read_text(encoding="utf-8") != DAEMON_SOURCE:
+            temp_path = source.with_name(f"{source.name}.{os.getpid()}.tmp")
+            temp_path.write_text(DAEMON_SOURCE, encoding="utf-8")
+            os.replace(temp_path, source)
+        return source
+
+    def _compile(self, source):
+        """javacがあれば一度だけコンパイルし、なければJava 11以降のソースファイル実行を使う"""
+        class_file = self.daemon_dir / f"{DAEMON_CLASS}.class"
+        if class_file.exists() and class_file.stat().st_mtime >= source.stat().st_mtime:
+            return True
+        if shutil.which("javac") is None:
+            return False
+        result = subprocess.run(["javac", "-nowarn", "-d", str(self.daemon_dir), str(source)],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result.returncode == 0
+
+    def _commands(self):
+        source = self._write_source()
+        if self._compile(source):
+            classpath = os.pathsep.join([str(self.apktool_jar), str(self.daemon_dir)])
+            launch = ["-cp", classpath, DAEMON_CLASS]
+        else:
+            launch = ["-cp", str(self.apktool_jar), str(source)]
+        # Java 18以降はSecurityManagerの許可が必要（Java 11ではこの指定を解釈できないため、失敗したら外す）
+        yield ["java", "-Djava.security.manager=allow", "-Xshare:auto"] + launch
+        yield ["java", "-Xshare:auto"] + launch
+
+    def start(self):
+        for attempt, command in enumerate(self._commands()):
+            if attempt:
+                print("常駐JVMの起動に失敗したため、オプションを変えて再試行します")
+            # stdoutはプロトコルに使う。ジョブ外の出力（起動エラーなど）はstderrにそのまま出す
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       encoding="utf-8", bufsize=1)
+            ready = self._read_line(process, START_TIMEOUT)
+            if ready and ready.startswith("READY"):
+                self.process = process
+                self.guarded = ready.rstrip("\n").split("\t")[1] == "guarded"
+                print(f"apktoolの常駐JVMを起動しました（pid {process.pid}"
+                      f"{'' if self.guarded else '、System.exitでJVMが終了するため失敗時は再起動します'}）")
+                return True
+            process.kill()
+            process.wait()
+        return False
+
+    @staticmethod
+    def _read_line(process, timeout):
+        result = []
+        reader = threading.Thread(target=lambda: result.append(process.stdout.readline()), daemon=True)
+        reader.start()
+        reader.join(timeout)
+        return result[0] if result else None
+
+    def run(self, args, log_path):
+        """1ジョブを実行して終了コードを返す（出力はlog_pathに追記される）"""
+        args = [str(arg) for arg in args]
+        if any("\t" in arg or "\n" in arg for arg in args + [str(log_path)]):
+            raise DaemonError("タブや改行を含む引数は常駐JVMに渡せません")
+        with self._lock:
+            if self.process is None or self.process.poll() is not None:
+                if not self.start():
+                    self.process = None
+                    raise DaemonError("apktoolの常駐JVMを起動できませんでした")
+            self.jobs += 1
+            try:
+                self.process.stdin.write("\t".join([str(self.jobs), str(log_path)] + args) + "\n")
+                self.process.stdin.flush()
+                line = self.process.stdout.readline()
+            except OSError:
+                line = ""
+            if not line:
+                # System.exitでJVMごと終了した（JVMの終了コードをジョブの終了コードとする）
+                status = self.process.wait()
+                self.process = None
+                self.restarts += 1
+                return status if status >= 0 else 1
+            _, _, status = line.rstrip("\n").split("\t")
+            return int(status)
+
+    def close(self):
+        with self._lock:
+            if self.process is not None and self.process.poll() is None:
+                self.process.stdin.close()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process = None
+
+_daemons = {}
+_daemons_lock = threading.Lock()
+
+def get_daemon(apktool_jar):
+    """プロセス内で共有する常駐JVM（バッチモードでは同じワーカーが処理するビルド間でも使い回す）"""
+    if not ENABLED or shutil.which("java") is None:
+        return None
+    key = str(Path(apktool_jar).resolve())
+    with _daemons_lock:
+        if key not in _daemons:
+            _daemons[key] = ApktoolDaemon(apktool_jar)
+        return _daemons[key]
+
+@atexit.register
+def shutdown():
+    with _daemons_lock:
+        for daemon in _daemons.values():
+            daemon.close()
+        _daemons.clear()
+
+def run(apktool, args, name=None, check=True):
+    """apktoolを実行する。常駐JVMが使えればそこで実行し、使えなければ従来どおりapktoolスクリプトを起動する
+
+    apktoolはラッパースクリプトのパス（同じディレクトリのapktool.jarを常駐JVMで読み込む）。
+    フレームワークは共有ディレクトリ（-p）を使う。
+    """
+    apktool = Path(apktool)
+    apktool_jar = apktool.with_name("apktool.jar")
+    framework_dir = prepare_framework(apktool_jar, apktool.parent / FRAMEWORK_DIR.name)
+    args = _absolute_args(args) + ["-p", str(framework_dir.resolve())]
+    name = name or f"apktool {args[0]}"
+    command = [str(apktool)] + args
+
+    daemon = get_daemon(apktool_jar)
+    if daemon is not None:
+        started = time.perf_counter()
+        # JVMがパスを開き直せるよう（Windowsでは開いたままのファイルを他から開けない）、ハンドルは閉じてから渡す
+        fd, log_path = tempfile.mkstemp(prefix="apktool-", suffix=".log")
+        os.close(fd)
+        try:
+            exit_code = daemon.run(args, log_path)
+        except DaemonError as e:
+            print(f"警告: {e}。java -jarで実行します")
+        else:
+            with open(log_path, 'r', encoding='utf-8', errors='replace') as log:
+                sys.stdout.write(log.read())
+            sys.stdout.flush()
+            instrument.record_subprocess(f"{name} [daemon]", command, started, exit_code)
+            if check and exit_code != 0:
+                raise subprocess.CalledProcessError(exit_code, command)
+            return exit_code
+        finally:
+            os.unlink(log_path)
+    return instrument.run(command, name=name, check=check).returncode
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="apktoolを常駐JVMで実行する（java -jar apktool.jarと同じ引数）")
+    parser.add_argument("--apktool", type=Path, default=TOOLS_DIR / ("apktool.bat" if sys.platform == "win32" else "apktool"),
+                        help="apktoolのラッパースクリプト")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="apktoolの引数（例: d app.apk -o out）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.args:
+        print("apktoolの引数を指定してください")
+        return 2
+    return run(args.apktool, args.args, check=False)
+
+if __name__ == "__main__":
+    sys.exit(main())
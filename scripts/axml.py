@@ -0,0 +1,398 @@
+import struct
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_TYPE = 0x0003
+RES_XML_START_NAMESPACE_TYPE = 0x0100
+RES_XML_END_NAMESPACE_TYPE = 0x0101
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_END_ELEMENT_TYPE = 0x0103
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+
+UTF8_FLAG = 0x100
+SORTED_FLAG = 0x1
+NO_INDEX = 0xffffffff
+
+TYPE_STRING = 0x03
+TYPE_INT_BOOLEAN = 0x12
+
+ANDROID_NS = "http://schemas.android.com/apk/res/android"
+ATTR_NAME = 0x01010003
+ATTR_DEBUGGABLE = 0x0101000f
+ATTR_EXTRACT_NATIVE_LIBS = 0x010104ea
+
+class AxmlError(ValueError):
+    pass
+
+def _decode_length8(data, pos):
+    length = data[pos]
+    if length & 0x80:
+        return ((length & 0x7f) << 8) | data[pos + 1], pos + 2
+    return length, pos + 1
+
+def _decode_length16(data, pos):
+    length, = struct.unpack_from("<H", data, pos)
+    if length & 0x8000:
+        low, = struct.unpack_from("<H", data, pos + 2)
+        return ((length & 0x7fff) << 16) | low, pos + 4
+    return length, pos + 2
+
+def _encode_length8(length):
+    if length > 0x7fff:
+        raise AxmlError("文字列が長すぎます")
+    return bytes([length]) if length < 0x80 else bytes([0x80 | (length >> 8), length & 0xff])
+
+def _encode_length16(length):
+    if length < 0x8000:
+        return struct.pack("<H", length)
+    return struct.pack("<HH", 0x8000 | (length >> 16), length & 0xffff)
+
+class StringPool:
+    """ResStringPoolチャンク（スタイル情報は元のバイト列のまま保持する）"""
+
+    def __init__(self, strings, flags, style_offsets=None, style_data=b"", raw=None):
+        self.strings = strings
+        self.flags = flags
+        self.style_offsets = style_offsets or []
+        self.style_data = style_data
+        self.raw = raw
+        self._lookup = None
+
+    @classmethod
+    def parse(cls, chunk):
+        _, header_size, size, count, style_count, flags, strings_start, styles_start = \
+            struct.unpack_from("<HHIIIIII", chunk, 0)
+        offsets = struct.unpack_from(f"<{count}I", chunk, header_size)
+        style_offsets = list(struct.unpack_from(f"<{style_count}I", chunk, header_size + count * 4))
+        utf8 = bool(flags & UTF8_FLAG)
+        strings = []
+        for offset in offsets:
+            pos = strings_start + offset
+            if utf8:
+                _, pos = _decode_length8(chunk, pos)
+                length, pos = _decode_length8(chunk, pos)
+                strings.append(bytes(chunk[pos:pos + length]).decode("utf-8", "surrogatepass"))
+            else:
+                length, pos = _decode_length16(chunk, pos)
+                strings.append(bytes(chunk[pos:pos + length * 2]).decode("utf-16-le", "surrogatepass"))
+        style_data = bytes(chunk[styles_start:size]) if style_count else b""
+        return cls(strings, flags, style_offsets, style_data, raw=chunk)
+
+    @property
+    def dirty(self):
+        return self.raw is None
+
+    def index(self, value):
+        if self._lookup is None:
+            self._lookup = {}
+            for i, s in enumerate(self.strings):
+                self._lookup.setdefault(s, i)
+        return self._lookup.get(value)
+
+    def get(self, index):
+        if index == NO_INDEX or index >= len(self.strings):
+            return None
+        return self.strings[index]
+
+    def add(self, value, force=False):
+        """末尾に文字列を追加する（既存のインデックスは変わらない）"""
+        existing = self.index(value)
+        if existing is not None and not force:
+            return existing
+        self.strings.append(value)
+        self._lookup.setdefault(value, len(self.strings) - 1)
+        self.raw = None
+        self.flags &= ~SORTED_FLAG
+        return len(self.strings) - 1
+
+    def serialize(self):
+        if self.raw is not None:
+            return self.raw
+        utf8 = bool(self.flags & UTF8_FLAG)
+        offsets = []
+        data = bytearray()
+        for s in self.strings:
+            offsets.append(len(data))
+            if utf8:
+                encoded = s.encode("utf-8", "surrogatepass")
+                data += _encode_length8(len(s.encode("utf-16-le", "surrogatepass")) // 2)
+                data += _encode_length8(len(encoded)) + encoded + b"\0"
+            else:
+                encoded = s.encode("utf-16-le", "surrogatepass")
+                data += _encode_length16(len(encoded) // 2) + encoded + b"\0\0"
+        data += b"\0" * (-len(data) % 4)
+        header_size = 28
+        strings_start = header_size + 4 * len(offsets) + 4 * len(self.style_offsets)
+        styles_start = strings_start + len(data) if self.style_offsets else 0
+        size = strings_start + len(data) + len(self.style_data)
+        header = struct.pack("<HHIIIIII", RES_STRING_POOL_TYPE, header_size, size, len(offsets),
+                             len(self.style_offsets), self.flags, strings_start, styles_start)
+        return (header + struct.pack(f"<{len(offsets)}I", *offsets)
+                + struct.pack(f"<{len(self.style_offsets)}I", *self.style_offsets)
+                + bytes(data) + self.style_data)
+
+class Attribute:
+    __slots__ = ("ns", "name", "raw_value", "value_type", "data")
+
+    def __init__(self, ns, name, raw_value, value_type, data):
+        self.ns = ns
+        self.name = name
+        self.raw_value = raw_value
+        self.value_type = value_type
+        self.data = data
+
+class StartElement:
+    """RES_XML_START_ELEMENT_TYPEチャンク"""
+
+    def __init__(self, line, comment, ns, name, attributes, id_index=0, class_index=0, style_index=0):
+        self.line = line
+        self.comment = comment
+        self.ns = ns
+        self.name = name
+        self.attributes = attributes
+        self.id_index = id_index
+        self.class_index = class_index
+        self.style_index = style_index
+
+    @classmethod
+    def parse(cls, chunk):
+        _, header_size, _, line, comment = struct.unpack_from("<HHIII", chunk, 0)
+        ns, name, attr_start, attr_size, attr_count, id_index, class_index, style_index = \
+            struct.unpack_from("<IIHHHHHH", chunk, header_size)
+        attributes = []
+        for i in range(attr_count):
+            a_ns, a_name, raw, _, _, value_type, data = struct.unpack_from(
+                "<IIIHBBI", chunk, header_size + attr_start + i * attr_size)
+            attributes.append(Attribute(a_ns, a_name, raw, value_type, data))
+        return cls(line, comment, ns, name, attributes, id_index, class_index, style_index)
+
+    def serialize(self):
+        body = struct.pack("<IIHHHHHH", self.ns, self.name, 20, 20, len(self.attributes),
+                           self.id_index, self.class_index, self.style_index)
+        body += b"".join(struct.pack("<IIIHBBI", a.ns, a.name, a.raw_value, 8, 0, a.value_type, a.data)
+                         for a in self.attributes)
+        return struct.pack("<HHIII", RES_XML_START_ELEMENT_TYPE, 16, 16 + len(body),
+                           self.line, self.comment) + body
+
+    def insert_attribute(self, position, attribute):
+        self.attributes.insert(position, attribute)
+        # id/class/style属性の位置（1始まり）を挿入に合わせてずらす
+        for field in ("id_index", "class_index", "style_index"):
+            value = getattr(self, field)
+            if value and value - 1 >= position:
+                setattr(self, field, value + 1)
+
+def iter_chunks(data):
+    """バイナリXMLのチャンクを (種類, オフセット, memoryview) で順に返すストリーミングパーサー"""
+    view = memoryview(data)
+    if len(view) < 8:
+        raise AxmlError("バイナリXMLが短すぎます")
+    chunk_type, header_size, size = struct.unpack_from("<HHI", view, 0)
+    if chunk_type != RES_XML_TYPE:
+        raise AxmlError("バイナリXMLではありません（テキスト形式のマニフェストの可能性があります）")
+    if size > len(view):
+        raise AxmlError("バイナリXMLのサイズが不正です")
+    yield RES_XML_TYPE, 0, view[:header_size]
+    pos = header_size
+    while pos < size:
+        c_type, _, c_size = struct.unpack_from("<HHI", view, pos)
+        if c_size < 8 or pos + c_size > size:
+            raise AxmlError(f"チャンクのサイズが不正です: offset={pos}")
+        yield c_type, pos, view[pos:pos + c_size]
+        pos += c_size
+
+class ResourceMap:
+    """文字列インデックス → 属性リソースIDの対応表"""
+
+    def __init__(self, ids, raw=None):
+        self.ids = ids
+        self.raw = raw
+
+    @classmethod
+    def parse(cls, chunk):
+        return cls(list(struct.unpack_from(f"<{(len(chunk) - 8) // 4}I", chunk, 8)), raw=chunk)
+
+    def get(self, index):
+        return self.ids[index] if index < len(self.ids) else None
+
+    def index_of(self, res_id):
+        for index, mapped in enumerate(self.ids):
+            if mapped == res_id:
+                return index
+        return None
+
+    def assign(self, index, res_id):
+        """indexまで表を伸ばして割り当てる（間の要素は0=リソースIDなし）"""
+        if index < len(self.ids):
+            raise AxmlError("既にリソースIDが割り当てられた位置には追加できません")
+        self.ids.extend([0] * (index - len(self.ids)))
+        self.ids.append(res_id)
+        self.raw = None
+
+    def serialize(self):
+        if self.raw is not None:
+            return self.raw
+        return struct.pack("<HHI", RES_XML_RESOURCE_MAP_TYPE, 8, 8 + 4 * len(self.ids)) + \
+            struct.pack(f"<{len(self.ids)}I", *self.ids)
+
+class AxmlDocument:
+    """Androidバイナリ XML。変更していないチャンクは元のバッファの切り出しをそのまま書き戻す"""
+
+    def __init__(self, data):
+        self.header = None
+        self.chunks = []
+        self.string_pool = None
+        self.resource_map = None
+        for chunk_type, _, chunk in iter_chunks(data):
+            if chunk_type == RES_XML_TYPE:
+                self.header = chunk
+            elif chunk_type == RES_STRING_POOL_TYPE and self.string_pool is None:
+                self.string_pool = StringPool.parse(chunk)
+                self.chunks.append(self.string_pool)
+            elif chunk_type == RES_XML_RESOURCE_MAP_TYPE and self.resource_map is None:
+                self.resource_map = ResourceMap.parse(chunk)
+                self.chunks.append(self.resource_map)
+            else:
+                self.chunks.append(chunk)
+        if self.string_pool is None:
+            raise AxmlError("文字列プールが見つかりません")
+        if self.resource_map is None:
+            # リソースマップは文字列プールの直後に置く
+            self.resource_map = ResourceMap([])
+            self.chunks.insert(self.chunks.index(self.string_pool) + 1, self.resource_map)
+
+    def _chunk_type(self, chunk):
+        if isinstance(chunk, StartElement):
+            return RES_XML_START_ELEMENT_TYPE
+        if isinstance(chunk, StringPool):
+            return RES_STRING_POOL_TYPE
+        if isinstance(chunk, ResourceMap):
+            return RES_XML_RESOURCE_MAP_TYPE
+        return struct.unpack_from("<H", chunk, 0)[0]
+
+    def find_element(self, name):
+        """最初に現れる指定名の開始タグを返す（編集用にパース済みオブジェクトへ置き換える）"""
+        for i, chunk in enumerate(self.chunks):
+            if self._chunk_type(chunk) != RES_XML_START_ELEMENT_TYPE:
+                continue
+            element = chunk if isinstance(chunk, StartElement) else None
+            if element is None:
+                c_header_size, = struct.unpack_from("<H", chunk, 2)
+                c_name, = struct.unpack_from("<I", chunk, c_header_size + 4)
+                if self.string_pool.get(c_name) != name:
+                    continue
+                element = StartElement.parse(chunk)
+                self.chunks[i] = element
+            elif self.string_pool.get(element.name) != name:
+                continue
+            return element
+        return None
+
+    def attribute_resource_id(self, attribute):
+        return self.resource_map.get(attribute.name) or None
+
+    def get_attribute(self, element, res_id=None, name=None):
+        for attribute in element.attributes:
+            if res_id is not None and self.attribute_resource_id(attribute) == res_id:
+                return attribute
+            if name is not None and attribute.ns == NO_INDEX and self.string_pool.get(attribute.name) == name:
+                return attribute
+        return None
+
+    def attribute_string(self, attribute):
+        if attribute is None:
+            return None
+        if attribute.value_type == TYPE_STRING:
+            return self.string_pool.get(attribute.data)
+        return self.string_pool.get(attribute.raw_value)
+
+    def _attribute_name_index(self, res_id, name):
+        index = self.resource_map.index_of(res_id)
+        if index is not None:
+            return index
+        if name is None:
+            raise AxmlError(f"属性名が文字列プールにありません: 0x{res_id:08x}")
+        # 既存の文字列インデックスをずらさないよう、末尾に追加してリソースマップを伸ばす
+        index = self.string_pool.add(name, force=True)
+        self.resource_map.assign(index, res_id)
+        return index
+
+    def set_attribute(self, element, res_id, name, value_type, data, raw_value=NO_INDEX):
+        """android名前空間の属性を設定し、以前の属性（なければNone）を返す"""
+        attribute = self.get_attribute(element, res_id=res_id)
+        if attribute is not None:
+            previous = Attribute(attribute.ns, attribute.name, attribute.raw_value,
+                                 attribute.value_type, attribute.data)
+            attribute.raw_value = raw_value
+            attribute.value_type = value_type
+            attribute.data = data
+            return previous
+
+        ns_index = self.string_pool.index(ANDROID_NS)
+        if ns_index is None:
+            raise AxmlError("android名前空間が見つかりません")
+        name_index = self._attribute_name_index(res_id, name)
+        # aapt2と同じくリソースID順に並ぶ位置へ挿入する
+        position = len(element.attributes)
+        for i, other in enumerate(element.attributes):
+            other_id = self.attribute_resource_id(other)
+            if other_id is None or other_id > res_id:
+                position = i
+                break
+        element.insert_attribute(position, Attribute(ns_index, name_index, raw_value, value_type, data))
+        return None
+
+    def set_string_attribute(self, element, res_id, value, name=None):
+        """文字列属性を設定し、以前の文字列値を返す"""
+        string_index = self.string_pool.add(value)
+        previous = self.set_attribute(element, res_id, name, TYPE_STRING, string_index, string_index)
+        return self.attribute_string(previous)
+
+    def set_boolean_attribute(self, element, res_id, name, value):
+        self.set_attribute(element, res_id, name, TYPE_INT_BOOLEAN, 0xffffffff if value else 0)
+
+    def serialize(self):
+        parts = []
+        for chunk in self.chunks:
+            if isinstance(chunk, (StringPool, ResourceMap, StartElement)):
+                parts.append(chunk.serialize())
+            else:
+                parts.append(chunk)
+        body_size = sum(len(p) for p in parts)
+        header = bytearray(self.header)
+        struct.pack_into("<I", header, 4, len(header) + body_size)
+        return bytes(header) + b"".join(bytes(p) for p in parts)
+
+def resolve_class_name(package, name):
+    if name and name.startswith("."):
+        return package + name
+    if name and "." not in name:
+        return f"{package}.{name}"
+    return name
+
+def patch_manifest(data, application_name=None, extract_native_libs=None, debuggable=None):
+    """<application>のandroid:name・extractNativeLibs・debuggableを書き換える
+
+    新しいマニフェストと、置き換える前のApplicationクラス名（完全修飾名、なければNone）を返す。
+    """
+    document = AxmlDocument(data)
+    manifest = document.find_element("manifest")
+    application = document.find_element("application")
+    if manifest is None or application is None:
+        raise AxmlError("<manifest>または<application>要素が見つかりません")
+    package = document.attribute_string(document.get_attribute(manifest, name="package"))
+
+    previous = None
+    if application_name is not None:
+        previous = document.set_string_attribute(application, ATTR_NAME, application_name, "name")
+        if previous == application_name:
+            previous = None
+    if extract_native_libs is not None:
+        document.set_boolean_attribute(application, ATTR_EXTRACT_NATIVE_LIBS, "extractNativeLibs",
+                                       extract_native_libs)
+    if debuggable is not None:
+        document.set_boolean_attribute(application, ATTR_DEBUGGABLE, "debuggable", debuggable)
+    return document.serialize(), resolve_class_name(package, previous)
+
+def patch_application_name(data, class_name):
+    """<application>のandroid:nameを置き換え、新しいマニフェストと元のApplicationクラス名を返す"""
+    return patch_manifest(data, application_name=class_name)
@@ -0,0 +1,252 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import apktool_daemon
+import cache
+import download_and_extract
+import downloader
+import generate_dump
+import inject_frida
+import instrument
+import resolver
+import signing
+import splits
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+# ビルドごとの作業ディレクトリ（<パッケージ>-<バージョン>/{run,temp,output,tools}）
+BUILDS_DIR = Path("../builds")
+TOOLS_DIR = Path("../tools")
+OUTPUT_DIR = Path("../output")
+BATCH_REPORT_NAME = "batch_report.json"
+DEFAULT_DOWNLOADS = 3
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+BUILD_LOG_NAME = "build.log"
+
+class BatchError(Exception):
+    pass
+
+def load_manifest(path):
+    """{"builds": [{"package", "version", "source", "sha256"(任意)}, ...]} またはそのリストを読む
+
+    sourceはXAPKのURLまたはローカルパス（マニフェストからの相対パス可）。versionとsourceを省略すると
+    resolverで最新のリリースを解決する（"resolve" に取得元を指定できる）。
+    """
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    entries = data["builds"] if isinstance(data, dict) else data
+    builds = []
+    seen = set()
+    for i, entry in enumerate(entries):
+        if entry.get("package") and not entry.get("version") and not entry.get("source"):
+            release = resolver.downloadable(resolver.resolve(entry["package"], entry.get("resolve")))
+            entry = dict(entry, version=release["version"], source=release["url"],
+                         sha256=entry.get("sha256") or release.get("sha256"))
+        missing = [key for key in ("package", "version", "source") if not entry.get(key)]
+        if missing:
+            raise BatchError(f"マニフェストの{i + 1}番目のエントリに {', '.join(missing)} がありません")
+        build = dict(entry)
+        if not re.match(r"^https?://", build["source"]):
+            build["source"] = str((path.parent / build["source"]).resolve())
+        build_id = workspace_name(build)
+        if build_id in seen:
+            raise BatchError(f"同じパッケージとバージョンが重複しています: {build_id}")
+        seen.add(build_id)
+        builds.append(build)
+    return builds
+
+def workspace_name(build):
+    return re.sub(r"[^\w.\-]", "_", f"{build['package']}-{build['version']}")
+
+def prepare_workspace(build, builds_dir=BUILDS_DIR, tools_dir=TOOLS_DIR):
+    """ビルド専用の作業ディレクトリを作る。ツールは共有ディレクトリへのリンクにする"""
+    workspace = (Path(builds_dir) / workspace_name(build)).resolve()
+    for name in ("run", "temp", "output"):
+        (workspace / name).mkdir(parents=True, exist_ok=True)
+    tools_link = workspace / "tools"
+    if tools_link.is_symlink() and not tools_link.exists():
+        tools_link.unlink()
+    if not tools_link.exists():
+        try:
+            os.symlink(Path(tools_dir).resolve(), tools_link, target_is_directory=True)
+        except OSError:
+            # シンボリックリンクを作れない環境（権限のないWindowsなど）ではコピーする
+            shutil.copytree(tools_dir, tools_link)
+    return workspace
+
+def fetch_build(build, workspace):
+    """XAPKを作業ディレクトリへ配置し、sha256を返す（URLは共有セッションで取得してキャッシュする）"""
+    xapk_path = workspace / "temp" / "app.xapk"
+    key = cache.cache_key("xapk", build["package"], build["version"])
+    store = cache.get_cache()
+    if re.match(r"^https?://", build["source"]):
+        downloader.download_cached(build["source"], xapk_path, key=key, sha256=build.get("sha256"), link=True,
+                                   headers={'Referer': 'https://apkpure.com/'})
+    elif not store.materialize(key, xapk_path, link=True):
+        store.put(key, build["source"], sha256=build.get("sha256"))
+        store.materialize(key, xapk_path, link=True)
+    return xapk_path, store.lookup(key)["sha256"]
+
+@contextlib.contextmanager
+def _redirect_output(log_path):
+    """子プロセスの出力（外部コマンドを含む）をビルドごとのログファイルへ送る"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    with open(log_path, 'a', encoding='utf-8') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+def process_build(build, workspace, xapk_sha256, options):
+    """ワーカープロセスで1ビルドを展開・ダンプ・インジェクトする
+
+    各モジュールは ../temp、../output などカレントディレクトリからの相対パスを使うため、
+    作業ディレクトリの run/ に移動してから実行する。
+    """
+    workspace = Path(workspace)
+    os.chdir(workspace / "run")
+    started = time.perf_counter()
+    result = {"package": build["package"], "version": build["version"], "workspace": str(workspace),
+              "log": str(workspace / "output" / BUILD_LOG_NAME)}
+    instrument.reset()
+    with _redirect_output(workspace / "output" / BUILD_LOG_NAME):
+        try:
+            xapk_path = download_and_extract.TEMP_DIR / "app.xapk"
+            download_and_extract.extract_xapk(xapk_path, download_and_extract.TEMP_DIR / "xapk_extracted", xapk_sha256)
+            il2cpp_so, global_metadata = download_and_extract.extract_il2cpp(
+                xapk_path, xapk_sha256, stream=options["stream"])
+            outputs = {"il2cpp_so": str(il2cpp_so), "global_metadata": str(global_metadata)}
+            if options["dump"]:
+                dump_cs, db_path = generate_dump.generate_dump()
+                outputs.update({"dump_cs": str(dump_cs), "dump_db": str(db_path)})
+            if options["inject"]:
+                device = options["device"]
+                split_set = inject_frida.find_apks(device=device)
+                main_apk, config_apks = split_set.base.path, split_set.paths()
+                abis, abi_splits = inject_frida.detect_abis(split_set, device and device["abis"])
+                gadgets = inject_frida.download_frida_gadgets(abis)
+                modified_apk, injected_splits = inject_frida.inject_apks(
+                    main_apk, gadgets, abi_splits, engine=options["engine"])
+                modified_apk, injected_splits = inject_frida.align_outputs(modified_apk, config_apks, injected_splits)
+                signed_main, signed_splits = inject_frida.sign_outputs(
+                    modified_apk, config_apks, injected_splits, abis, split_set.split_abis(),
+                    backend=options["sign_backend"], workers=options["sign_workers"])
+                outputs.update({"apk": str(signed_main), "splits": [str(p) for p in signed_splits]})
+            result.update({"status": "ok", "outputs": {k: str(Path(v).resolve()) if isinstance(v, str) else
+                                                       [str(Path(p).resolve()) for p in v]
+                                                       for k, v in outputs.items()}})
+        except Exception as e:
+            print(f"エラー: {type(e).__name__}: {e}")
+            result.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+        finally:
+            instrument.save("build")
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+def _prefetch_tools(options):
+    """共有ツールはワーカーが同時に展開しないよう、先に親プロセスで用意する"""
+    if options["dump"]:
+        download_and_extract.fetch_il2cpp_dumper()
+    if options["inject"] and options["engine"] == "apktool":
+        apktool = inject_frida.ensure_apktool()
+        apktool_daemon.prepare_framework(apktool.with_name("apktool.jar"), apktool.parent / apktool_daemon.FRAMEWORK_DIR.name)
+
+def run_batch(builds, options, downloads=DEFAULT_DOWNLOADS, workers=DEFAULT_WORKERS, builds_dir=BUILDS_DIR):
+    """ダウンロードはスレッド（共有の接続プール）、展開以降はプロセスプールで並行に実行する
+
+    ダウンロードが終わったビルドから順に処理を始める。
+    """
+    _prefetch_tools(options)
+    # 同時ダウンロード数 × Rangeの並列数の接続を使い回せるようにする
+    downloader.configure_pool(max(downloader.DEFAULT_POOL_SIZE, downloads * downloader.DEFAULT_WORKERS))
+    # ワーカーは作業ディレクトリへ移動するため、キャッシュの場所を絶対パスで渡す
+    os.environ["INJECT_CACHE_DIR"] = str(cache.get_cache().root.resolve())
+    context = multiprocessing.get_context("spawn")
+
+    results = []
+    print(f"{len(builds)}ビルドを処理します（同時ダウンロード {downloads}、ワーカー {workers}）")
+    with ThreadPoolExecutor(max_workers=downloads) as fetch_pool, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context) as build_pool:
+        fetches = {}
+        for build in builds:
+            workspace = prepare_workspace(build, builds_dir)
+            fetches[fetch_pool.submit(instrument.bind(fetch_build), build, workspace)] = (build, workspace)
+        processing = {}
+        for future in as_completed(fetches):
+            build, workspace = fetches[future]
+            label = workspace_name(build)
+            try:
+                _, xapk_sha256 = future.result()
+            except Exception as e:
+                print(f"[{label}] ダウンロードに失敗しました: {e}")
+                results.append({"package": build["package"], "version": build["version"],
+                                "workspace": str(workspace), "status": "error", "error": f"download: {e}"})
+                continue
+            print(f"[{label}] ダウンロード完了、処理を開始します")
+            processing[build_pool.submit(process_build, build, str(workspace), xapk_sha256, options)] = label
+        for future in as_completed(processing):
+            result = future.result()
+            results.append(result)
+            status = "完了" if result["status"] == "ok" else f"失敗（{result['error']}）"
+            print(f"[{processing[future]}] {status} {result['seconds']:.1f}秒 ログ: {result['log']}")
+    order = {workspace_name(build): i for i, build in enumerate(builds)}
+    return sorted(results, key=lambda r: order[workspace_name(r)])
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="マニフェストに記載した複数パッケージ・複数バージョンをまとめて処理する")
+    parser.add_argument("manifest", type=Path, help="ビルドの一覧（JSON）")
+    parser.add_argument("--downloads", type=int, default=DEFAULT_DOWNLOADS, help="同時に行うダウンロードの数")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="同時に展開・ダンプ・インジェクトするビルド数")
+    parser.add_argument("--builds-dir", type=Path, default=BUILDS_DIR, help="ビルドごとの作業ディレクトリの置き場所")
+    parser.add_argument("--no-dump", action="store_true", help="ダンプを行わない")
+    parser.add_argument("--no-inject", action="store_true", help="インジェクトと署名を行わない")
+    parser.add_argument("--stream", action="store_true", help="Il2Cppファイルをストリーム抽出する")
+    parser.add_argument("--engine", choices=inject_frida.ENGINES, default="zip", help="インジェクト方法")
+    parser.add_argument("--sign-backend", choices=signing.BACKENDS, default=signing.DEFAULT_BACKEND, help="署名方法")
+    parser.add_argument("--sign-workers", type=int, default=1, help="ビルドごとに並列で署名するプロセス数")
+    splits.add_device_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    os.chdir(SCRIPTS_DIR)
+    args = parse_args(argv)
+    builds = load_manifest(args.manifest)
+    download_and_extract.setup_directories()
+    options = {"dump": not args.no_dump, "inject": not args.no_inject, "stream": args.stream,
+               "engine": args.engine, "sign_backend": args.sign_backend, "sign_workers": args.sign_workers,
+               "device": splits.device_from_args(args)}
+    started = time.perf_counter()
+    try:
+        results = run_batch(builds, options, downloads=args.downloads, workers=args.workers,
+                            builds_dir=args.builds_dir)
+    finally:
+        instrument.save("batch")
+    report_path = OUTPUT_DIR / BATCH_REPORT_NAME
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({"wall_seconds": time.perf_counter() - started, "options": options, "builds": results},
+                  f, indent=2, ensure_ascii=False)
+    failed = [r for r in results if r["status"] != "ok"]
+    print(f"\n{len(results) - len(failed)}/{len(results)}ビルドが完了しました（{time.perf_counter() - started:.1f}秒）。"
+          f"結果: {report_path}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,482 @@
+import os
+import re
+import sys
+import json
+import lzma
+import time
+import random
+import struct
+import hashlib
+import zipfile
+import argparse
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import apk_align
+import axml
+import download_and_extract
+import downloader
+import il2cpp_inspect
+import inject_frida
+import instrument
+import signing
+
+TEMP_DIR = Path("../temp")
+OUTPUT_DIR = Path("../output")
+WORKSPACE_DIR = TEMP_DIR / "benchmark"
+RESULTS_PATH = OUTPUT_DIR / "benchmarks" / "results.jsonl"
+
+PACKAGE_NAME = "com.example.benchmark"
+FIXTURE_ABI = "arm64-v8a"
+# ABIスプリットの次に作るスプリット名（足りない分は config.assetsN）
+SPLIT_NAMES = ["xxhdpi", "ja", "en", "xhdpi", "ko", "zh"]
+DEFAULT_SPLITS = 3
+DEFAULT_SO_MB = 32
+DEFAULT_METADATA_MB = 8
+DEFAULT_ASSETS = 2000
+DEFAULT_ASSET_KB = 16
+DEFAULT_GADGET_MB = 4
+GENERATE_BLOCK_SIZE = 1024 * 1024
+IL2CPP_METADATA_MAGIC = 0xFAB11BAF
+IL2CPP_METADATA_VERSION = 29
+METADATA_SECTIONS = 31
+ELF_MACHINE_AARCH64 = 183
+
+STAGES = ["download", "download_decompressed", "extract_zip", "extract_il2cpp_files",
+          "stream_extract_il2cpp_files", "inject", "align", "sign"]
+
+# ---- 合成フィクスチャ ----
+
+def build_manifest(package=PACKAGE_NAME, application=None):
+    """<manifest package=...><application android:name=...><activity/></application></manifest> のバイナリXML"""
+    strings = ["name", "package", "manifest", "application", "activity", "android", axml.ANDROID_NS,
+               package, ".MainActivity"]
+    resource_ids = [axml.ATTR_NAME]
+    if application:
+        strings.append(application)
+    pool = axml.StringPool(strings, axml.UTF8_FLAG).serialize()
+    resource_map = struct.pack("<HHI", axml.RES_XML_RESOURCE_MAP_TYPE, 8, 8 + 4 * len(resource_ids)) \
+        + struct.pack(f"<{len(resource_ids)}I", *resource_ids)
+    ns_index, uri_index = strings.index("android"), strings.index(axml.ANDROID_NS)
+
+    def start(name, attributes):
+        return axml.StartElement(1, axml.NO_INDEX, axml.NO_INDEX, strings.index(name), attributes).serialize()
+
+    def end(name):
+        return struct.pack("<HHIIIII", axml.RES_XML_END_ELEMENT_TYPE, 16, 24, 1, axml.NO_INDEX,
+                           axml.NO_INDEX, strings.index(name))
+
+    def string_attr(ns, name, value):
+        index = strings.index(value)
+        return axml.Attribute(ns, strings.index(name), index, axml.TYPE_STRING, index)
+
+    application_attrs = [string_attr(uri_index, "name", application)] if application else []
+    chunks = [
+        pool, resource_map,
+        struct.pack("<HHIIIII", axml.RES_XML_START_NAMESPACE_TYPE, 16, 24, 1, axml.NO_INDEX, ns_index, uri_index),
+        start("manifest", [string_attr(axml.NO_INDEX, "package", package)]),
+        start("application", application_attrs),
+        start("activity", [string_attr(uri_index, "name", ".MainActivity")]),
+        end("activity"), end("application"), end("manifest"),
+        struct.pack("<HHIIIII", axml.RES_XML_END_NAMESPACE_TYPE, 16, 24, 1, axml.NO_INDEX, ns_index, uri_index),
+    ]
+    body = b"".join(chunks)
+    return struct.pack("<HHI", axml.RES_XML_TYPE, 8, 8 + len(body)) + body
+
+def _fake_elf(size, rng):
+    """ELF64ヘッダーだけが正しい、中身はランダムな共有ライブラリ"""
+    header = struct.pack("<4sBBBBB7xHHIQQQIHHHHHH", b"\x7fELF", 2, 1, 1, 0, 0,
+                         3, ELF_MACHINE_AARCH64, 1, 0, 0, 0, 0, 64, 0, 0, 64, 0, 0)
+    return header + rng.randbytes(max(0, size - len(header)))
+
+def _fake_metadata(size, rng):
+    """v29形式のヘッダー（各セクションのオフセットとサイズ）と、識別子や小さな整数が並ぶ本体"""
+    count = len(il2cpp_inspect.metadata_section_names(IL2CPP_METADATA_VERSION, METADATA_SECTIONS))
+    header_size = 8 + count * 8
+    section_size = max(0, size - header_size) // count
+    pairs = []
+    for i in range(count):
+        pairs += [header_size + i * section_size, section_size]
+    header = struct.pack(f"<Ii{count * 2}i", IL2CPP_METADATA_MAGIC, IL2CPP_METADATA_VERSION, *pairs)
+    # 実際のメタデータと同程度のエントロピーにする（ランダムだと暗号化されていると判定される）
+    words = [f"{rng.choice(['Get', 'Set', 'On', 'Update', 'Create'])}{rng.choice(['Card', 'Live', 'Member', 'Stage'])}"
+             f"{rng.randrange(1000)}\0".encode() for _ in range(1024)]
+    block = b"".join(words) + struct.pack("<4096H", *(rng.randrange(512) for _ in range(4096)))
+    body_size = max(0, size - len(header))
+    return header + (block * (body_size // len(block) + 1))[:body_size]
+
+def _fake_asset(index, size, rng):
+    """圧縮の効く/効かないアセットを半分ずつ作る"""
+    if index % 2:
+        return rng.randbytes(size)
+    line = f"asset {index} " .encode() + rng.randbytes(16).hex().encode() + b"\n"
+    return (line * (size // len(line) + 1))[:size]
+
+def _write_apk(path, entries):
+    """entriesは (名前, データ, 圧縮するか) のリスト"""
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, data, compress in entries:
+            zf.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+
+def fixture_id(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+def generate_fixture(fixture_dir, splits=DEFAULT_SPLITS, so_mb=DEFAULT_SO_MB, metadata_mb=DEFAULT_METADATA_MB,
+                     assets=DEFAULT_ASSETS, asset_kb=DEFAULT_ASSET_KB, gadget_mb=DEFAULT_GADGET_MB, seed=0):
+    """ベースAPK・ABIスプリット・その他のスプリットを含む合成XAPKと、xz圧縮した偽Gadgetを生成する
+
+    同じパラメータで生成済みであれば再利用する。
+    """
+    fixture_dir = Path(fixture_dir)
+    marker = fixture_dir / "fixture.json"
+    params = {"splits": splits, "so_mb": so_mb, "metadata_mb": metadata_mb, "assets": assets,
+              "asset_kb": asset_kb, "gadget_mb": gadget_mb, "seed": seed}
+    if marker.exists():
+        with open(marker, 'r', encoding='utf-8') as f:
+            if json.load(f)["params"] == params:
+                print(f"生成済みのフィクスチャを使用します: {fixture_dir}")
+                return fixture_dir
+    print(f"合成フィクスチャを生成中: {fixture_dir} {params}")
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    apk_dir = fixture_dir / "apks"
+    apk_dir.mkdir(parents=True, exist_ok=True)
+
+    abi_dir = FIXTURE_ABI.replace("-", "_")
+    other_splits = [SPLIT_NAMES[i] if i < len(SPLIT_NAMES) else f"assets{i}" for i in range(max(0, splits - 1))]
+    # アセットはベースAPKとABI以外のスプリットに振り分ける
+    buckets = [[] for _ in range(len(other_splits) + 1)]
+    for i in range(assets):
+        buckets[i % len(buckets)].append(
+            (f"assets/bin/Data/{i // 256:03d}/asset{i:06d}.bytes", _fake_asset(i, asset_kb * 1024, rng), True))
+
+    apks = {"base.apk": [
+        ("AndroidManifest.xml", build_manifest(), True),
+        ("classes.dex", b"dex\n035\0" + rng.randbytes(64 * 1024), True),
+        ("resources.arsc", rng.randbytes(256 * 1024), False),
+        (download_and_extract.GLOBAL_METADATA_ENTRY, _fake_metadata(metadata_mb * 1024 * 1024, rng), True),
+    ] + buckets[0]}
+    if splits > 0:
+        apks[f"config.{abi_dir}.apk"] = [
+            ("AndroidManifest.xml", build_manifest(), True),
+            (f"lib/{FIXTURE_ABI}/libil2cpp.so", _fake_elf(so_mb * 1024 * 1024, rng), False),
+            (f"lib/{FIXTURE_ABI}/libunity.so", _fake_elf(so_mb * 1024 * 1024 // 4, rng), False),
+        ]
+    for name, bucket in zip(other_splits, buckets[1:]):
+        apks[f"config.{name}.apk"] = [("AndroidManifest.xml", build_manifest(), True)] + bucket
+    for name, entries in apks.items():
+        _write_apk(apk_dir / name, entries)
+
+    xapk_manifest = {
+        "package_name": PACKAGE_NAME,
+        "version_name": "1.0.0",
+        "split_apks": [{"file": name, "id": "base" if name == "base.apk" else name[:-len(".apk")]}
+                       for name in apks],
+    }
+    with zipfile.ZipFile(fixture_dir / "app.xapk", 'w') as zf:
+        zf.writestr("manifest.json", json.dumps(xapk_manifest, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+        for name in apks:
+            zf.write(apk_dir / name, name, compress_type=zipfile.ZIP_STORED)
+
+    gadget = _fake_elf(gadget_mb * 1024 * 1024, rng)
+    (fixture_dir / "gadget.so").write_bytes(gadget)
+    (fixture_dir / "gadget.so.xz").write_bytes(lzma.compress(gadget))
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump({"params": params, "apks": list(apks)}, f, indent=2)
+    print(f"フィクスチャの生成が完了しました（{time.perf_counter() - started:.2f}秒）")
+    return fixture_dir
+
+# ---- ローカルHTTPサーバー ----
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Range・条件付きリクエストに対応した静的ファイルサーバー（ダウンロード処理の計測、resolverのミラーの模擬用）"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        mtime = os.path.getmtime(path)
+        etag = f'"{int(mtime)}-{size}"'
+        last_modified = self.date_time_string(int(mtime))
+        if (self.headers.get("If-None-Match") == etag
+                or (not self.headers.get("If-None-Match") and self.headers.get("If-Modified-Since") == last_modified)):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+        f = open(path, 'rb')
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            start, end = 0, size - 1
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        f.seek(start)
+        self._remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, "_remaining", None)
+        while remaining is None or remaining > 0:
+            block = source.read(GENERATE_BLOCK_SIZE if remaining is None else min(GENERATE_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            outputfile.write(block)
+            if remaining is not None:
+                remaining -= len(block)
+
+@contextlib.contextmanager
+def serve_directory(directory):
+    """ディレクトリを127.0.0.1の空きポートで配信し、ベースURLを返す"""
+    # プロキシ設定があってもローカルサーバーへ直接つなぐ
+    os.environ["NO_PROXY"] = ",".join(filter(None, [os.environ.get("NO_PROXY"), "127.0.0.1"]))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(RangeRequestHandler, directory=str(directory)))
+    thread = threading.Thread(target=server.serve_forever, name="benchmark-http", daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+# ---- 各ステージ（計測は子プロセスで行う） ----
+
+def _stage_download(ctx):
+    dest = downloader.download(f"{ctx['base_url']}/app.xapk", TEMP_DIR / "app.xapk", workers=ctx["workers"])
+    return os.path.getsize(dest)
+
+def _stage_download_decompressed(ctx):
+    dest, _ = downloader.download_decompressed(f"{ctx['base_url']}/gadget.so.xz", TEMP_DIR / "gadget.so")
+    return os.path.getsize(dest)
+
+def _stage_extract_zip(ctx):
+    download_and_extract.extract_zip(ctx["xapk"], TEMP_DIR / "xapk_extracted")
+    with zipfile.ZipFile(ctx["xapk"]) as zf:
+        return sum(info.file_size for info in zf.infolist())
+
+def _stage_extract_il2cpp_files(ctx):
+    il2cpp_so, global_metadata = download_and_extract.extract_il2cpp_files(TEMP_DIR / "xapk_extracted")
+    return os.path.getsize(il2cpp_so) + os.path.getsize(global_metadata)
+
+def _stage_stream_extract_il2cpp_files(ctx):
+    il2cpp_so, global_metadata, _ = download_and_extract.stream_extract_il2cpp_files(
+        ctx["xapk"], output_dir=OUTPUT_DIR / "stream")
+    return os.path.getsize(il2cpp_so) + os.path.getsize(global_metadata)
+
+def _stage_inject(ctx):
+    apk_dir = TEMP_DIR / "xapk_extracted"
+    gadgets = {FIXTURE_ABI: ctx["gadget"]}
+    modified_apk = inject_frida.inject_frida_gadget(apk_dir / "base.apk", engine=ctx["engine"],
+                                                    gadgets=gadgets)
+    abi_split = apk_dir / f"config.{FIXTURE_ABI.replace('-', '_')}.apk"
+    injected = inject_frida.inject_split_gadgets({FIXTURE_ABI: abi_split}, gadgets)
+    return os.path.getsize(modified_apk) + sum(os.path.getsize(p) for p in injected.values())
+
+def _stage_align(ctx):
+    """インジェクト結果を常に書き直してアラインメント処理のスループットを測る"""
+    apks = [OUTPUT_DIR / "injected.apk"] + sorted(OUTPUT_DIR.glob("injected-config.*.apk"))
+    aligned = [apk_align.align_apk(apk, OUTPUT_DIR / f"aligned-{apk.name}") for apk in apks]
+    violations = sum(len(apk_align.verify(p)) for p in aligned)
+    if violations:
+        raise RuntimeError(f"アラインメント後に違反が{violations}件残っています")
+    return sum(os.path.getsize(p) for p in aligned)
+
+def _stage_sign(ctx):
+    apks = [OUTPUT_DIR / "injected.apk"] + sorted(OUTPUT_DIR.glob("injected-config.*.apk"))
+    jobs = [(apk, OUTPUT_DIR / f"signed-{apk.name}") for apk in apks]
+    signed = signing.sign_apks(jobs, backend=ctx["sign_backend"], workers=ctx["sign_workers"])
+    return sum(os.path.getsize(p) for p in signed)
+
+def _proc_status(field):
+    """/proc/self/status の値（kB）をバイトで返す（Linux以外ではNone）"""
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def _reset_peak_rss():
+    """LinuxのVmHWMをリセットする。ru_maxrssはexec後も親の値を引き継ぐため、ステージ単位の計測には使えない"""
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _run_stage(name, run_dir, ctx):
+    """子プロセス内で1ステージを実行し、所要時間・処理バイト数・メモリを返す"""
+    os.chdir(run_dir)
+    func = globals()[f"_stage_{name}"]
+    reset = _reset_peak_rss()
+    rss_started = _proc_status("VmRSS")
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    children_cpu_started = instrument.children_cpu()
+    processed = func(ctx)
+    wall = time.perf_counter() - started
+    report = instrument.recorder.report(name)
+    peak_rss = _proc_status("VmHWM") if reset else report["peak_rss"]
+    return {
+        "wall_seconds": wall,
+        "cpu_seconds": time.process_time() - cpu_started,
+        "children_cpu_seconds": instrument.children_cpu() - children_cpu_started,
+        "bytes": processed,
+        "mib_per_second": processed / 1024 / 1024 / max(wall, 1e-6),
+        "rss_started": rss_started,
+        "peak_rss": peak_rss,
+        "peak_rss_delta": peak_rss - rss_started if peak_rss and rss_started else None,
+        "children_peak_rss": report["children_peak_rss"],
+        "counters": report["counters"],
+    }
+
+def run_stage(name, run_dir, ctx):
+    """ステージごとに新しいプロセスを起動し、他のステージのメモリ使用量の影響を受けないようにする"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(_run_stage, name, str(run_dir), ctx).result()
+
+def run_benchmark(fixture_dir, workspace, stages=STAGES, repeat=1, workers=downloader.DEFAULT_WORKERS,
+                  engine="zip", sign_backend="python", sign_workers=None):
+    """各ステージをrepeat回実行し、最短の所要時間と最大のメモリ使用量を記録する"""
+    workspace = Path(workspace).resolve()
+    fixture_dir = Path(fixture_dir).resolve()
+    run_dir = workspace / "run"
+    for name in ("run", "temp", "output", "tools"):
+        (workspace / name).mkdir(parents=True, exist_ok=True)
+
+    # 鍵の生成時間を署名ステージに含めない
+    signing.ensure_keystore(workspace / "output")
+    results = {}
+    with serve_directory(fixture_dir) as base_url:
+        ctx = {"base_url": base_url, "xapk": str(fixture_dir / "app.xapk"), "gadget": str(fixture_dir / "gadget.so"),
+               "workers": workers, "engine": engine, "sign_backend": sign_backend, "sign_workers": sign_workers}
+        for name in stages:
+            runs = []
+            for i in range(repeat):
+                # 前回の出力が残っているとキャッシュ・再開処理が働くため毎回消す
+                for leftover in (workspace / "temp" / "app.xapk", workspace / "temp" / "gadget.so"):
+                    leftover.unlink(missing_ok=True)
+                runs.append(run_stage(name, run_dir, ctx))
+            best = min(runs, key=lambda r: r["wall_seconds"])
+            for key in ("peak_rss", "peak_rss_delta"):
+                best[key] = max(r[key] or 0 for r in runs) or None
+            best["runs"] = [r["wall_seconds"] for r in runs]
+            results[name] = best
+    return {"stages": results}
+
+# ---- 結果の保存と比較 ----
+
+def load_previous(results_path, fixture):
+    """同じフィクスチャで実行した直近の結果を返す"""
+    previous = None
+    if Path(results_path).exists():
+        with open(results_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry.get("fixture_id") == fixture:
+                    previous = entry
+    return previous
+
+def compare_results(old, new, threshold=instrument.DEFAULT_THRESHOLD, min_seconds=instrument.MIN_COMPARE_SECONDS):
+    """所要時間とメモリ使用量がthreshold倍以上に増えたステージを返す"""
+    def as_report(entry):
+        return {"steps": {name: {"wall_seconds": stage["wall_seconds"]} for name, stage in entry["stages"].items()}}
+    regressions = [dict(r, metric="wall_seconds") for r in
+                   instrument.compare(as_report(old), as_report(new), threshold, min_seconds)]
+    for name, stage in new["stages"].items():
+        old_stage = old["stages"].get(name)
+        old_rss = old_stage and old_stage.get("peak_rss_delta")
+        new_rss = stage.get("peak_rss_delta")
+        if old_rss and new_rss and new_rss / old_rss >= threshold:
+            regressions.append({"step": name, "metric": "peak_rss_delta", "old": old_rss,
+                                "new": new_rss, "ratio": new_rss / old_rss})
+    return regressions
+
+def _format_bytes(num_bytes):
+    return "-" if num_bytes is None else f"{num_bytes / 1024 / 1024:.1f}MiB"
+
+def print_results(entry):
+    print(f"\nベンチマーク結果（フィクスチャ {entry['fixture_id']}）:")
+    for name, stage in entry["stages"].items():
+        print(f"  {name:28s} {stage['wall_seconds']:7.2f}秒 {stage['mib_per_second']:8.1f}MiB/s "
+              f"最大メモリ {_format_bytes(stage['peak_rss'])}（開始時から+{_format_bytes(stage['peak_rss_delta'])}）")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="合成XAPKを使った抽出・インジェクト・署名・ダウンロードのベンチマーク")
+    parser.add_argument("--splits", type=int, default=DEFAULT_SPLITS, help="スプリットAPKの数（ABIスプリットを含む）")
+    parser.add_argument("--so-mb", type=int, default=DEFAULT_SO_MB, help="libil2cpp.soのサイズ（MiB）")
+    parser.add_argument("--metadata-mb", type=int, default=DEFAULT_METADATA_MB, help="global-metadata.datのサイズ（MiB）")
+    parser.add_argument("--assets", type=int, default=DEFAULT_ASSETS, help="アセットファイルの数")
+    parser.add_argument("--asset-kb", type=int, default=DEFAULT_ASSET_KB, help="アセット1つあたりのサイズ（KiB）")
+    parser.add_argument("--gadget-mb", type=int, default=DEFAULT_GADGET_MB, help="偽Frida Gadgetのサイズ（MiB）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stage", action="append", choices=STAGES, help="実行するステージ（複数指定可、既定はすべて）")
+    parser.add_argument("--repeat", type=int, default=1, help="各ステージの実行回数（最短時間を採用）")
+    parser.add_argument("--workers", type=int, default=downloader.DEFAULT_WORKERS, help="ダウンロードの並列数")
+    parser.add_argument("--engine", choices=inject_frida.ENGINES, default="zip")
+    parser.add_argument("--sign-backend", choices=signing.BACKENDS, default="python")
+    parser.add_argument("--sign-workers", type=int, default=None)
+    parser.add_argument("--workspace", type=Path, default=WORKSPACE_DIR)
+    parser.add_argument("--results", type=Path, default=RESULTS_PATH, help="結果を追記するJSONLファイル")
+    parser.add_argument("--threshold", type=float, default=instrument.DEFAULT_THRESHOLD,
+                        help="前回よりこの倍率以上遅く（または大きく）なったら終了コード1")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = {"splits": args.splits, "so_mb": args.so_mb, "metadata_mb": args.metadata_mb, "assets": args.assets,
+              "asset_kb": args.asset_kb, "gadget_mb": args.gadget_mb, "seed": args.seed}
+    fixture = fixture_id(params)
+    fixture_dir = generate_fixture(args.workspace / f"fixture-{fixture}", **params)
+    measured = run_benchmark(fixture_dir, args.workspace, stages=args.stage or STAGES, repeat=args.repeat,
+                             workers=args.workers, engine=args.engine, sign_backend=args.sign_backend,
+                             sign_workers=args.sign_workers)
+    entry = {"started_at": time.time(), "fixture_id": fixture, "fixture": params,
+             "options": {"engine": args.engine, "sign_backend": args.sign_backend, "workers": args.workers},
+             "python": sys.version.split()[0], "cpu_count": os.cpu_count(), **measured}
+    print_results(entry)
+
+    previous = load_previous(args.results, fixture)
+    args.results.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    print(f"結果を保存しました: {args.results}")
+
+    if previous is None:
+        print("同じフィクスチャでの過去の結果がないため、比較をスキップします")
+        return 0
+    regressions = compare_results(previous, entry, args.threshold)
+    if not regressions:
+        print("前回の結果から悪化したステージはありません")
+        return 0
+    print(f"前回より{args.threshold}倍以上悪化したステージ:")
+    for r in regressions:
+        if r["metric"] == "wall_seconds":
+            print(f"  {r['step']}: {r['old_seconds']:.2f}秒 → {r['new_seconds']:.2f}秒（{r['ratio']:.1f}倍）")
+        else:
+            print(f"  {r['step']}: メモリ {_format_bytes(r['old'])} → {_format_bytes(r['new'])}（{r['ratio']:.1f}倍）")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
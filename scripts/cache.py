@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import contextlib
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CACHE_DIR = Path(os.environ.get("INJECT_CACHE_DIR", "../cache"))
+# 既定の上限は20GiB（環境変数で変更可能）
+DEFAULT_MAX_BYTES = int(os.environ.get("INJECT_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+HASH_BLOCK_SIZE = 1024 * 1024
+# linux/fs.h の FICLONE（btrfs・XFSなどでデータブロックを共有するコピー）
+FICLONE = 0x40049409
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def clone_file(src, dest):
+    """reflinkでデータブロックを共有するコピーを作る。対応していないファイルシステムではFalseを返す"""
+    if fcntl is None:
+        return False
+    try:
+        with open(src, 'rb') as s, open(dest, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        Path(dest).unlink(missing_ok=True)
+        return False
+
+def copy_file(src, dest):
+    """後で書き換えるファイルのコピー（reflinkを優先し、できなければ通常のコピー）"""
+    if not clone_file(src, dest):
+        shutil.copyfile(src, dest)
+    return Path(dest)
+
+def link_or_copy(src, dest):
+    """書き換えないファイルの配置（ハードリンク → reflink → 通常のコピーの順に試す）"""
+    dest = Path(dest)
+    if dest.exists() or dest.is_symlink():
+        dest.unlink()
+    try:
+        os.link(src, dest)
+        return dest
+    except OSError:
+        return copy_file(src, dest)
+
+def cache_key(kind, *parts):
+    """入力（URL・バージョン・ハッシュなど）から決定的なキャッシュキーを作る"""
+    digest = hashlib.sha256("\0".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return f"{kind}:{digest}"
+
+class ArtifactCache:
+    """内容アドレス方式のローカルキャッシュ（サイズ上限付きLRU削除）"""
+
+    def __init__(self, root=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.objects_dir = self.root / "objects"
+        self.index_path = self.root / "index.json"
+        self.lock_path = self.root / "index.lock"
+        self._lock = threading.Lock()
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("keys", {})
+        index.setdefault("objects", {})
+        return index
+
+    def _save_index(self):
+        temp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.index_path)
+
+    @contextlib.contextmanager
+    def _locked_index(self):
+        """インデックスを排他的に更新する（バッチモードでは複数プロセスが同じキャッシュを使う）"""
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # 他のプロセスが追加したエントリを失わないよう、読み直してから変更する
+            self._index = self._load_index()
+            yield self._index
+            self._save_index()
+
+    def _object_path(self, sha256):
+        return self.objects_dir / sha256[:2] / sha256
+
+    def lookup(self, key):
+        """キーに対応するエントリ（sha256・サイズ）を返す。オブジェクトが消えていればNone"""
+        with self._locked_index() as index:
+            entry = index["keys"].get(key)
+            if entry is None:
+                return None
+            obj = index["objects"].get(entry["sha256"])
+            if obj is None or not self._object_path(entry["sha256"]).exists():
+                del index["keys"][key]
+                return None
+            obj["last_used"] = time.time()
+            return dict(entry)
+
+    def get(self, key):
+        entry = self.lookup(key)
+        return self._object_path(entry["sha256"]) if entry else None
+
+    def put(self, key, path, move=False, sha256=None):
+        """ファイルを内容ハッシュで格納し、キーを関連付ける（計算済みのsha256があれば再読み込みしない）"""
+        path = Path(path)
+        sha256 = sha256 or file_sha256(path)
+        object_path = self._object_path(sha256)
+        if not object_path.exists():
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = object_path.with_name(object_path.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+            if move:
+                shutil.move(str(path), temp_path)
+            else:
+                copy_file(path, temp_path)
+            # ハードリンクで取り出したファイルが書き換えられないよう読み取り専用にする
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, object_path)
+        elif move:
+            path.unlink()
+
+        with self._locked_index() as index:
+            size = object_path.stat().st_size
+            index["objects"][sha256] = {"size": size, "last_used": time.time()}
+            index["keys"][key] = {"sha256": sha256, "size": size, "name": path.name}
+            self._evict(keep=sha256)
+        return object_path
+
+    def materialize(self, key, dest, link=False):
+        """キャッシュ済みの内容を dest に配置する（link=Trueならハードリンクを優先）"""
+        source = self.get(key)
+        if source is None:
+            return None
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if link:
+            return link_or_copy(source, dest)
+        if dest.exists() or dest.is_symlink():
+            dest.unlink()
+        return copy_file(source, dest)
+
+    def _evict(self, keep=None):
+        """合計サイズが上限を超えた分だけ、最後に使われた時刻の古い順に削除"""
+        objects = self._index["objects"]
+        total = sum(obj["size"] for obj in objects.values())
+        if total <= self.max_bytes:
+            return
+        for sha256, obj in sorted(objects.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if sha256 == keep:
+                continue
+            try:
+                os.chmod(self._object_path(sha256), 0o644)
+                self._object_path(sha256).unlink()
+            except FileNotFoundError:
+                pass
+            total -= obj["size"]
+            del objects[sha256]
+            print(f"キャッシュから削除しました: {sha256[:12]} ({obj['size']}バイト)")
+        for key in [k for k, e in self._index["keys"].items() if e["sha256"] not in objects]:
+            del self._index["keys"][key]
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(obj["size"] for obj in self._load_index()["objects"].values())
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ArtifactCache()
+        return _default_cache
@@ -1,44 +1,71 @@
 import os
-import requests
+import re
+import sys
+import time
+import struct
+import argparse
 import zipfile
 import shutil
 from pathlib import Path
 
-XAPK_URL = "https://apkcombo.com/r2?u=https%3A%2F%2Fapks.39b7cb94d40914bac590886981b0ed6e.r2.cloudflarestorage.com%2Fcom.oddno.lovelive%2F4.2.0%2F87744.4bc51e66f378c00f15b398876d5de4a0841fe53a.apks%3Fresponse-content-disposition%3Dattachment%253B%2520filename%253D%2522Link%25EF%25BC%2581Like%25EF%25BC%2581%25E3%2583%25A9%25E3%2583%2596%25E3%2583%25A9%25E3%2582%25A4%25E3%2583%2596%25EF%25BC%2581%25E8%2593%25AE%25E3%2583%258E%25E7%25A9%25BA%25E3%2582%25B9%25E3%2582%25AF%25E3%2583%25BC%25E3%2583%25AB%25E3%2582%25A2%25E3%2582%25A4%25E3%2583%2589%25E3%2583%25AB%25E3%2582%25AF%25E3%2583%25A9%25E3%2583%2596_4.2.0_apkcombo.com.xapk%2522%26response-content-type%3Dapplication%252Fxapk-package-archive%26X-Amz-Algorithm%3DAWS4-HMAC-SHA256%26X-Amz-Date%3D20250629T025416Z%26X-Amz-SignedHeaders%3Dhost%26X-Amz-Expires%3D14400%26X-Amz-Credential%3D3cb727b4cd4780c410b780ac7caa4da3%252F20250629%252Fauto%252Fs3%252Faws4_request%26X-Amz-Signature%3Db23f6be0c32b9898d386a6bb110aa0a776aee05b43080bbe3f22f7a4eb942f4d&fp=df425fcee0565cf6d4561887ea1a35ed&ip=36.12.137.12&package_name=com.oddno.lovelive&lang=en"
+import cache
+import downloader
+import il2cpp_inspect
+import instrument
+import resolver
+
 IL2CPP_DUMPER_URL = "https://github.com/Perfare/Il2CppDumper/releases/download/v6.7.46/Il2CppDumper-win-v6.7.46.zip"
+# Linux/Macでは.NET版（dotnet Il2CppDumper.dll で実行）を使う
+IL2CPP_DUMPER_NET_URL = "https://github.com/Perfare/Il2CppDumper/releases/download/v6.7.46/Il2CppDumper-net6-v6.7.46.zip"
+PACKAGE_NAME = "com.oddno.lovelive"
 TEMP_DIR = Path("../temp")
 TOOLS_DIR = Path("../tools")
 OUTPUT_DIR = Path("../output")
 
-session = requests.Session()
+IL2CPP_SO_ENTRY = re.compile(r"^lib/([^/]+)/libil2cpp\.so$")
+GLOBAL_METADATA_ENTRY = "assets/bin/Data/Managed/Metadata/global-metadata.dat"
+# 複数ABIが含まれる場合の優先順位
+ABI_PRIORITY = ["arm64-v8a", "armeabi-v7a", "x86_64", "x86"]
+STREAM_CHUNK_SIZE = 1024 * 1024
 
 def setup_directories():
     for dir_path in [TEMP_DIR, TOOLS_DIR, OUTPUT_DIR]:
         dir_path.mkdir(exist_ok=True, parents=True)
 
-def download_file(url, save_path):
-    """ファイルをダウンロードして保存"""
-    print(f"ダウンロード中: {url}")
-    
+def download_file(url, save_path, sha256=None, key=None, link=False):
+    """ファイルをダウンロードして保存（並列Range・再開・SHA-256検証・キャッシュ対応）"""
     headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
         'Referer': 'https://apkpure.com/',
     }
-    
-    response = session.get(url, stream=True, headers=headers,allow_redirects=True)
-    response.raise_for_status()
-    
-    with open(save_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-    
-    return save_path
+    return downloader.download_cached(url, save_path, key=key, sha256=sha256, link=link, headers=headers)
+
+def xapk_cache_key(url, package=PACKAGE_NAME):
+    """署名付きURLは毎回変わるため、URL内のパッケージ名とバージョンからキーを作る"""
+    version = resolver.version_from_url(url, package)
+    if version:
+        return cache.cache_key("xapk", package, version)
+    return cache.cache_key("xapk", url)
 
+@instrument.traced()
 def extract_zip(zip_path, extract_to):
     print(f"解凍中: {zip_path} → {extract_to}")
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
         zip_ref.extractall(extract_to)
+        instrument.count("bytes_written", sum(info.file_size for info in zip_ref.infolist()))
 
+@instrument.traced()
+def extract_xapk(xapk_path, extract_to, xapk_sha256):
+    """同じXAPKを展開済みであれば再展開しない"""
+    marker = Path(extract_to) / ".xapk-sha256"
+    if marker.exists() and marker.read_text().strip() == xapk_sha256:
+        print(f"展開済みのXAPKを使用します: {extract_to}")
+        return
+    if Path(extract_to).exists():
+        shutil.rmtree(extract_to)
+    extract_zip(xapk_path, extract_to)
+    marker.write_text(xapk_sha256)
+
+@instrument.traced()
 def extract_il2cpp_files(xapk_dir):
     """XAPKからil2cpp.soとglobal-metadata.datを抽出"""
     print("il2cpp.soとglobal-metadata.datを探索中...")
@@ -108,8 +135,8 @@ def extract_il2cpp_files(xapk_dir):
         
         raise FileNotFoundError("libil2cpp.so または global-metadata.dat が見つかりませんでした")
     
-    shutil.copy(il2cpp_so, OUTPUT_DIR)
-    shutil.copy(global_metadata, OUTPUT_DIR)
+    cache.link_or_copy(il2cpp_so, OUTPUT_DIR / os.path.basename(il2cpp_so))
+    cache.link_or_copy(global_metadata, OUTPUT_DIR / os.path.basename(global_metadata))
     
     il2cpp_dest = OUTPUT_DIR / "libil2cpp.so"
     metadata_dest = OUTPUT_DIR / "global-metadata.dat"
@@ -123,23 +150,252 @@ def extract_il2cpp_files(xapk_dir):
     print(f"抽出完了: {il2cpp_dest}, {metadata_dest}")
     return il2cpp_dest, metadata_dest
 
-def main():
-    setup_directories()
+class _SubFile:
+    """外側ZIP内の無圧縮メンバーを、展開せずに読み取るためのファイルウィンドウ"""
     
-    xapk_path = TEMP_DIR / "lovelive.xapk"
-    download_file(XAPK_URL, xapk_path)
-    xapk_extract_dir = TEMP_DIR / "xapk_extracted"
-    extract_zip(xapk_path, xapk_extract_dir)
+    def __init__(self, fp, start, size):
+        self._fp = fp
+        self._start = start
+        self._size = size
+        self._pos = 0
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self._pos
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._pos = offset
+        elif whence == os.SEEK_CUR:
+            self._pos += offset
+        elif whence == os.SEEK_END:
+            self._pos = self._size + offset
+        self._pos = max(0, min(self._pos, self._size))
+        return self._pos
+    
+    def read(self, n=-1):
+        remaining = self._size - self._pos
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        if n <= 0:
+            return b""
+        self._fp.seek(self._start + self._pos)
+        data = self._fp.read(n)
+        self._pos += len(data)
+        return data
+
+def _open_nested_member(outer_zip, outer_fp, info):
+    """XAPK内のAPKを展開せずに開く（無圧縮ならオフセット参照、圧縮済みならストリーム）"""
+    if info.compress_type != zipfile.ZIP_STORED:
+        return outer_zip.open(info)
+    
+    outer_fp.seek(info.header_offset)
+    header = outer_fp.read(30)
+    if len(header) != 30 or header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"ローカルヘッダーが不正です: {info.filename}")
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    data_start = info.header_offset + 30 + name_len + extra_len
+    return _SubFile(outer_fp, data_start, info.file_size)
+
+def _iter_apks(source):
+    """XAPKファイルまたは展開済みディレクトリからAPKを (名前, ファイルオブジェクト) で列挙"""
+    source = Path(source)
+    if source.is_dir():
+        for root, dirs, files in os.walk(source):
+            for file in sorted(files):
+                if file.endswith('.apk'):
+                    apk_path = os.path.join(root, file)
+                    with open(apk_path, 'rb') as fp:
+                        yield apk_path, fp
+        return
+    
+    with zipfile.ZipFile(source, 'r') as outer_zip, open(source, 'rb') as outer_fp:
+        for info in outer_zip.infolist():
+            if info.filename.endswith('.apk'):
+                member = _open_nested_member(outer_zip, outer_fp, info)
+                try:
+                    yield f"{source}!{info.filename}", member
+                finally:
+                    if hasattr(member, "close"):
+                        member.close()
+
+def _abi_rank(abi):
+    return ABI_PRIORITY.index(abi) if abi in ABI_PRIORITY else len(ABI_PRIORITY)
+
+def _stream_member(apk_zip, info, dest):
+    """ZIPメンバーを一時ファイル経由で出力先へストリーム書き込み"""
+    temp_dest = dest.with_name(dest.name + ".part")
+    with apk_zip.open(info) as src, open(temp_dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst, STREAM_CHUNK_SIZE)
+    os.replace(temp_dest, dest)
+    instrument.count("bytes_written", info.file_size)
+    return info.file_size
+
+def _format_size(num_bytes):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if num_bytes < 1024 or unit == "GiB":
+            return f"{num_bytes:.1f}{unit}" if unit != "B" else f"{num_bytes}B"
+        num_bytes /= 1024
+
+@instrument.traced()
+def stream_extract_il2cpp_files(source, output_dir=OUTPUT_DIR):
+    """APKを展開せずに中央ディレクトリを読み、il2cpp.soとglobal-metadata.datだけを出力先へストリーム抽出"""
+    print(f"ストリーミング抽出モードで探索中: {source}")
+    started = time.perf_counter()
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True, parents=True)
     
+    # 1パス目: 各APKの中央ディレクトリだけを読んで抽出対象を決定
+    il2cpp_so = None
+    global_metadata = None
+    fallback_so = None
+    fallback_metadata = None
+    apk_count = 0
+    total_entry_bytes = 0
+    
+    for apk_name, apk_fp in _iter_apks(source):
+        try:
+            apk_zip = zipfile.ZipFile(apk_fp, 'r')
+        except zipfile.BadZipFile:
+            print(f"警告: {apk_name} は有効なZIPファイルではありません。スキップします。")
+            continue
+        
+        apk_count += 1
+        with apk_zip:
+            for info in apk_zip.infolist():
+                total_entry_bytes += info.file_size
+                name = info.filename
+                match = IL2CPP_SO_ENTRY.match(name)
+                if match:
+                    if il2cpp_so is None or _abi_rank(match.group(1)) < _abi_rank(il2cpp_so[2]):
+                        il2cpp_so = (apk_name, name, match.group(1))
+                elif name == GLOBAL_METADATA_ENTRY:
+                    if global_metadata is None:
+                        global_metadata = (apk_name, name)
+                else:
+                    base = os.path.basename(name).lower()
+                    if fallback_so is None and "il2cpp" in base and base.endswith(".so"):
+                        fallback_so = (apk_name, name)
+                    elif fallback_metadata is None and "global-metadata" in base:
+                        fallback_metadata = (apk_name, name)
+    
+    if apk_count == 0:
+        raise FileNotFoundError(f"APKファイルが見つかりませんでした: {source}")
+    
+    if not il2cpp_so or not global_metadata:
+        print("標準の場所で見つからないため、代替候補を使用します...")
+    targets = {}
+    so_target = il2cpp_so[:2] if il2cpp_so else fallback_so
+    metadata_target = global_metadata or fallback_metadata
+    if not so_target or not metadata_target:
+        raise FileNotFoundError("libil2cpp.so または global-metadata.dat が見つかりませんでした")
+    
+    il2cpp_dest = output_dir / "libil2cpp.so"
+    metadata_dest = output_dir / "global-metadata.dat"
+    targets.setdefault(so_target[0], []).append((so_target[1], il2cpp_dest))
+    targets.setdefault(metadata_target[0], []).append((metadata_target[1], metadata_dest))
+    
+    # 2パス目: 対象を含むAPKだけを開き直してストリーム書き込み
+    written_bytes = 0
+    write_seconds = 0.0
+    for apk_name, apk_fp in _iter_apks(source):
+        if apk_name not in targets:
+            continue
+        with zipfile.ZipFile(apk_fp, 'r') as apk_zip:
+            for entry_name, dest in targets[apk_name]:
+                print(f"抽出中: {apk_name}!{entry_name} → {dest}")
+                write_started = time.perf_counter()
+                written_bytes += _stream_member(apk_zip, apk_zip.getinfo(entry_name), dest)
+                write_seconds += time.perf_counter() - write_started
+    
+    elapsed = time.perf_counter() - started
+    saved_bytes = max(0, total_entry_bytes - written_bytes)
+    # 実測した書き込みスループットから全展開時の所要時間を推定
+    throughput = written_bytes / write_seconds if write_seconds > 0 else 0
+    estimated_full_seconds = total_entry_bytes / throughput if throughput else elapsed
+    stats = {
+        "apk_count": apk_count,
+        "written_bytes": written_bytes,
+        "full_extract_bytes": total_entry_bytes,
+        "saved_bytes": saved_bytes,
+        "elapsed_seconds": elapsed,
+        "estimated_full_extract_seconds": estimated_full_seconds,
+        "estimated_saved_seconds": max(0.0, estimated_full_seconds - elapsed),
+    }
+    
+    print(f"抽出完了: {il2cpp_dest}, {metadata_dest}")
+    print(f"{apk_count}個のAPKから{_format_size(written_bytes)}を書き込みました"
+          f"（全展開では{_format_size(total_entry_bytes)}、{_format_size(saved_bytes)}を削減）")
+    print(f"所要時間: {elapsed:.2f}秒（全展開の推定: {estimated_full_seconds:.2f}秒、"
+          f"約{stats['estimated_saved_seconds']:.2f}秒短縮）")
+    return il2cpp_dest, metadata_dest, stats
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="XAPKのダウンロードとIl2Cppファイルの抽出")
+    parser.add_argument("--stream", action="store_true",
+                        help="APKを全展開せず、必要なファイルだけをストリーム抽出する")
+    parser.add_argument("--source", default=None,
+                        help=f"XAPKの取得元（apkcombo またはミラーのURL、既定: {resolver.DEFAULT_SOURCE}）")
+    return parser.parse_args(argv)
+
+@instrument.traced()
+def fetch_xapk(release=None, source=None):
+    """最新のリリースを解決し、XAPKをダウンロード（キャッシュ）して展開する。(XAPKのパス, sha256) を返す
+
+    リリースに変更がなくキャッシュにもあれば、ネットワークアクセスは解決時の1リクエストだけになる。
+    """
+    store = cache.get_cache()
+    xapk_path = TEMP_DIR / "lovelive.xapk"
+    release = resolver.downloadable(release or resolver.resolve(PACKAGE_NAME, source))
+    xapk_key = resolver.release_cache_key(release)
+    download_file(release["url"], xapk_path, sha256=release.get("sha256"), key=xapk_key, link=True)
+    xapk_sha256 = store.lookup(xapk_key)["sha256"]
+    extract_xapk(xapk_path, TEMP_DIR / "xapk_extracted", xapk_sha256)
+    return xapk_path, xapk_sha256
+
+@instrument.traced()
+def fetch_il2cpp_dumper():
     il2cpp_dumper_path = TEMP_DIR / "Il2CppDumper.zip"
-    download_file(IL2CPP_DUMPER_URL, il2cpp_dumper_path)
+    download_file(IL2CPP_DUMPER_URL if sys.platform == "win32" else IL2CPP_DUMPER_NET_URL, il2cpp_dumper_path)
     extract_zip(il2cpp_dumper_path, TOOLS_DIR / "Il2CppDumper")
+    return TOOLS_DIR / "Il2CppDumper"
+
+@instrument.traced()
+def extract_il2cpp(xapk_path, xapk_sha256, stream=False):
+    """同じXAPKから抽出済みであればキャッシュから取り出す"""
+    store = cache.get_cache()
+    il2cpp_so = OUTPUT_DIR / "libil2cpp.so"
+    global_metadata = OUTPUT_DIR / "global-metadata.dat"
+    so_key = cache.cache_key("il2cpp-so", xapk_sha256)
+    metadata_key = cache.cache_key("global-metadata", xapk_sha256)
+    if store.materialize(so_key, il2cpp_so) and store.materialize(metadata_key, global_metadata):
+        print("キャッシュ済みのIl2Cppファイルを使用します")
+    else:
+        if stream:
+            il2cpp_so, global_metadata, _ = stream_extract_il2cpp_files(xapk_path)
+        else:
+            il2cpp_so, global_metadata = extract_il2cpp_files(TEMP_DIR / "xapk_extracted")
+        store.put(so_key, il2cpp_so)
+        store.put(metadata_key, global_metadata)
+    il2cpp_inspect.check(il2cpp_so, global_metadata)
+    return il2cpp_so, global_metadata
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_directories()
     
-    il2cpp_so, global_metadata = extract_il2cpp_files(xapk_extract_dir)
+    try:
+        xapk_path, xapk_sha256 = fetch_xapk(source=args.source)
+        il2cpp_dumper_dir = fetch_il2cpp_dumper()
+        il2cpp_so, global_metadata = extract_il2cpp(xapk_path, xapk_sha256, stream=args.stream)
+    finally:
+        instrument.save("download_and_extract")
     
     print("ダウンロードと抽出が完了しました。")
     print(f"Il2Cppファイル：{il2cpp_so}, {global_metadata}")
-    print(f"Il2CppDumper：{TOOLS_DIR / 'Il2CppDumper'}")
+    print(f"Il2CppDumper：{il2cpp_dumper_dir}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,383 @@
+import os
+import json
+import lzma
+import time
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cache
+import instrument
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+}
+DEFAULT_WORKERS = 4
+MIN_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 32 * 1024 * 1024
+# 1リクエストあたりこの秒数程度で終わるようにチャンクサイズを調整する
+TARGET_CHUNK_SECONDS = 2.0
+STREAM_BLOCK_SIZE = 256 * 1024
+MAX_RETRIES = 3
+STATE_SUFFIX = ".download.json"
+
+DEFAULT_POOL_SIZE = 16
+
+session = requests.Session()
+
+def configure_pool(size=DEFAULT_POOL_SIZE):
+    """共有セッションの接続プールの大きさを設定する（同時に行うダウンロード数 × 並列数以上にする）"""
+    adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+configure_pool()
+
+class DownloadError(Exception):
+    pass
+
+def _state_path(dest):
+    return Path(str(dest) + STATE_SUFFIX)
+
+def _probe(http, url, headers):
+    """サイズ・Range対応・ETagを確認（HEADが使えない場合は1バイトのRange GETで代用）"""
+    try:
+        response = http.head(url, headers=headers, allow_redirects=True, timeout=30)
+        if response.ok and response.headers.get("Content-Length"):
+            accepts = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+            return (response.url, int(response.headers["Content-Length"]), accepts,
+                    response.headers.get("ETag"))
+    except requests.RequestException:
+        pass
+
+    probe_headers = dict(headers, Range="bytes=0-0")
+    with http.get(url, headers=probe_headers, stream=True, allow_redirects=True, timeout=30) as response:
+        response.raise_for_status()
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            size = int(total) if total.isdigit() else None
+            return response.url, size, size is not None, response.headers.get("ETag")
+        length = response.headers.get("Content-Length")
+        return response.url, int(length) if length else None, False, response.headers.get("ETag")
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def _missing_ranges(done, size):
+    holes = []
+    cursor = 0
+    for start, end in _merge_ranges(done):
+        if start > cursor:
+            holes.append([cursor, start])
+        cursor = max(cursor, end)
+    if cursor < size:
+        holes.append([cursor, size])
+    return holes
+
+def _load_state(dest, url, size, etag):
+    """中断時のサイドカー状態を読み込み、同じファイルであれば完了済み範囲を返す"""
+    state_path = _state_path(dest)
+    if not state_path.exists() or not Path(dest).exists():
+        return None
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("size") != size or os.path.getsize(dest) != size:
+        return None
+    # 署名付きURLはクエリが毎回変わるため、ETagがあればそちらを優先して同一性を判定
+    if etag and state.get("etag"):
+        if state["etag"] != etag:
+            return None
+    elif state.get("url") != url:
+        return None
+    return state.get("done", [])
+
+def _preallocate(dest, size):
+    with open(dest, 'wb') as f:
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        f.truncate(size)
+
+def sha256_file(path, block_size=MIN_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class _RangeDownload:
+    """事前確保したファイルへ複数のRangeリクエストで並列に書き込む"""
+
+    def __init__(self, http, url, fetch_url, dest, size, etag, headers, done):
+        self.http = http
+        self.url = url
+        self.fetch_url = fetch_url
+        self.dest = Path(dest)
+        self.size = size
+        self.etag = etag
+        self.headers = headers
+        self.done = [list(r) for r in done]
+        self.holes = _missing_ranges(self.done, size)
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self.fd = os.open(self.dest, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+
+    def _claim(self, chunk_size):
+        with self.lock:
+            if not self.holes:
+                return None
+            hole = self.holes[0]
+            start = hole[0]
+            end = min(hole[1], start + chunk_size)
+            if end == hole[1]:
+                self.holes.pop(0)
+            else:
+                hole[0] = end
+            return start, end
+
+    def _release(self, start, end):
+        with self.lock:
+            self.holes.append([start, end])
+            self.holes.sort()
+
+    def _write(self, offset, data):
+        if hasattr(os, "pwrite"):
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            with self.lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                os.write(self.fd, data)
+
+    def _mark_done(self, start, end):
+        with self.lock:
+            self.done = _merge_ranges(self.done + [[start, end]])
+            self.downloaded += end - start
+            self._save_state()
+
+    def _save_state(self):
+        state = {"url": self.url, "size": self.size, "etag": self.etag, "done": self.done}
+        state_path = _state_path(self.dest)
+        temp_path = state_path.with_name(state_path.name + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp_path, state_path)
+
+    def _fetch(self, start, end):
+        """1つの範囲を取得し、書き込めたバイト数を返す（途中で切れても書けた分は完了扱い）"""
+        headers = dict(self.headers, Range=f"bytes={start}-{end - 1}")
+        position = start
+        try:
+            with self.http.get(self.fetch_url, headers=headers, stream=True, timeout=60) as response:
+                if response.status_code != 206:
+                    raise DownloadError(f"Rangeリクエストが拒否されました: HTTP {response.status_code}")
+                for block in response.iter_content(chunk_size=STREAM_BLOCK_SIZE):
+                    block = block[:end - position]
+                    if not block:
+                        break
+                    self._write(position, block)
+                    position += len(block)
+                    instrument.count("bytes_downloaded", len(block))
+        finally:
+            if position > start:
+                self._mark_done(start, position)
+            if position < end:
+                self._release(position, end)
+        if position < end:
+            raise DownloadError(f"範囲 {start}-{end} の取得が途中で終了しました")
+        return end - start
+
+    def _worker(self):
+        chunk_size = MIN_CHUNK_SIZE
+        failures = 0
+        while True:
+            claimed = self._claim(chunk_size)
+            if claimed is None:
+                return
+            started = time.perf_counter()
+            try:
+                fetched = self._fetch(*claimed)
+            except (requests.RequestException, DownloadError):
+                failures += 1
+                if failures > MAX_RETRIES:
+                    raise
+                chunk_size = MIN_CHUNK_SIZE
+                time.sleep(min(2 ** failures, 10))
+                continue
+            failures = 0
+            # 実測スループットに合わせてチャンクサイズを適応的に変更
+            elapsed = max(time.perf_counter() - started, 1e-3)
+            chunk_size = int(min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, fetched / elapsed * TARGET_CHUNK_SECONDS)))
+
+    def run(self, workers):
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(instrument.bind(self._worker)) for _ in range(workers)]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(self.fd)
+        if _missing_ranges(self.done, self.size):
+            raise DownloadError(f"ダウンロードが完了しませんでした: {self.dest}")
+
+def _download_stream(http, url, dest, headers):
+    """Range非対応サーバー向けの単一ストリームダウンロード（SHA-256を同時に計算）"""
+    digest = hashlib.sha256()
+    total = 0
+    temp_dest = Path(str(dest) + ".part")
+    with http.get(url, headers=headers, stream=True, allow_redirects=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(temp_dest, 'wb') as f:
+            for block in response.iter_content(chunk_size=MIN_CHUNK_SIZE):
+                f.write(block)
+                digest.update(block)
+                total += len(block)
+                instrument.count("bytes_downloaded", len(block))
+    os.replace(temp_dest, dest)
+    return total, digest.hexdigest()
+
+def _write_decompressed(decompressor, data, f, digest):
+    """展開結果をSTREAM_BLOCK_SIZEずつ取り出して書き込む（展開後のデータを溜め込まない）"""
+    written = 0
+    while True:
+        block = decompressor.decompress(data, max_length=STREAM_BLOCK_SIZE)
+        data = b""
+        f.write(block)
+        digest.update(block)
+        written += len(block)
+        if decompressor.eof or decompressor.needs_input:
+            return written
+
+@instrument.traced()
+def download_decompressed(url, dest, decompressor=None, headers=None, http=None):
+    """圧縮ファイル（既定はxz）をHTTPストリームから直接展開して保存し、(保存先, 展開後のSHA-256) を返す
+
+    圧縮ファイルはディスクに書かず、外部コマンドも使わない。接続が切れた場合は受信済みの位置から
+    Rangeで取り直し、展開器の状態をそのまま引き継ぐ。
+    """
+    http = http or session
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    headers = dict(DEFAULT_HEADERS, **(headers or {}))
+    decompressor = decompressor or lzma.LZMADecompressor()
+    print(f"ダウンロード・展開中: {url}")
+    started = time.perf_counter()
+
+    digest = hashlib.sha256()
+    received = written = 0
+    failures = 0
+    temp_dest = Path(str(dest) + ".part")
+    try:
+        with open(temp_dest, 'wb') as f:
+            while True:
+                request_headers = dict(headers)
+                if received:
+                    request_headers["Range"] = f"bytes={received}-"
+                try:
+                    with http.get(url, headers=request_headers, stream=True, allow_redirects=True, timeout=60) as response:
+                        response.raise_for_status()
+                        if received and response.status_code != 206:
+                            raise DownloadError(f"サーバーがRangeに対応していないため再開できません: {url}")
+                        for block in response.iter_content(chunk_size=STREAM_BLOCK_SIZE):
+                            received += len(block)
+                            instrument.count("bytes_downloaded", len(block))
+                            written += _write_decompressed(decompressor, block, f, digest)
+                            if decompressor.eof:
+                                break
+                    if decompressor.eof:
+                        break
+                    error = DownloadError(f"圧縮データの途中で接続が終了しました（{received}バイト受信）")
+                except requests.RequestException as e:
+                    error = e
+                failures += 1
+                if failures > MAX_RETRIES:
+                    raise DownloadError(f"ダウンロードに失敗しました: {url}: {error}")
+                print(f"警告: {error} — {received}バイト目から再開します")
+                time.sleep(min(2 ** failures, 10))
+    except BaseException:
+        temp_dest.unlink(missing_ok=True)
+        raise
+    os.replace(temp_dest, dest)
+    instrument.count("bytes_written", written)
+
+    elapsed = max(time.perf_counter() - started, 1e-3)
+    print(f"展開完了: {dest} ({received / 1024 / 1024:.1f}MiB → {written / 1024 / 1024:.1f}MiB, {elapsed:.2f}秒)")
+    return dest, digest.hexdigest()
+
+@instrument.traced()
+def download(url, dest, sha256=None, workers=DEFAULT_WORKERS, headers=None, http=None):
+    """Rangeリクエストによる並列・再開可能なダウンロード（SHA-256検証付き）"""
+    http = http or session
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    headers = dict(DEFAULT_HEADERS, **(headers or {}))
+    print(f"ダウンロード中: {url}")
+    started = time.perf_counter()
+
+    final_url, size, accepts_ranges, etag = _probe(http, url, headers)
+    if accepts_ranges and size:
+        # destはキャッシュの読み取り専用オブジェクトへのハードリンクのことがあるため、直接書き込まず
+        # .part に取得してから置き換える（中断時の状態も .part に対して保存する）
+        temp_dest = Path(str(dest) + ".part")
+        done = _load_state(temp_dest, url, size, etag)
+        if done is None:
+            _preallocate(temp_dest, size)
+            done = []
+        else:
+            print(f"前回の続きから再開します: {sum(e - s for s, e in done)}/{size}バイト取得済み")
+        job = _RangeDownload(http, url, final_url, temp_dest, size, etag, headers, done)
+        job._save_state()
+        job.run(max(1, workers))
+        total = job.downloaded
+        actual_sha256 = sha256_file(temp_dest) if sha256 else None
+        if sha256 and actual_sha256.lower() != sha256.lower():
+            temp_dest.unlink()
+            _state_path(temp_dest).unlink(missing_ok=True)
+            raise DownloadError(f"SHA-256が一致しません: {dest} (期待値 {sha256}, 実際 {actual_sha256})")
+        os.replace(temp_dest, dest)
+        _state_path(temp_dest).unlink(missing_ok=True)
+    else:
+        total, actual_sha256 = _download_stream(http, url, dest, headers)
+        if sha256 and actual_sha256.lower() != sha256.lower():
+            dest.unlink()
+            raise DownloadError(f"SHA-256が一致しません: {dest} (期待値 {sha256}, 実際 {actual_sha256})")
+    instrument.count("bytes_written", total)
+
+    elapsed = max(time.perf_counter() - started, 1e-3)
+    print(f"ダウンロード完了: {dest} ({total / 1024 / 1024:.1f}MiB, {total / 1024 / 1024 / elapsed:.1f}MiB/s)")
+    return dest
+
+def download_cached(url, dest, key=None, sha256=None, link=False, **kwargs):
+    """キャッシュにあればネットワークを使わずに配置し、なければダウンロードしてキャッシュへ格納"""
+    store = cache.get_cache()
+    key = key or cache.cache_key("url", url)
+    if store.materialize(key, dest, link=link):
+        print(f"キャッシュを使用します: {dest}")
+        return Path(dest)
+    download(url, dest, sha256=sha256, **kwargs)
+    if link:
+        # 大きなファイルはキャッシュへ移動してハードリンクで戻し、二重に保存しない
+        store.put(key, dest, move=True)
+        store.materialize(key, dest, link=True)
+    else:
+        store.put(key, dest)
+    return Path(dest)
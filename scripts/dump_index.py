@@ -0,0 +1,312 @@
+import os
+import re
+import json
+import time
+import bisect
+import sqlite3
+import argparse
+from pathlib import Path
+
+import cache
+import instrument
+
+OUTPUT_DIR = Path("../output")
+INDEX_NAME = "dump.db"
+PREVIOUS_INDEX_NAME = "dump.prev.db"
+DIFF_NAME = "dump_diff.jsonl"
+SCHEMA_VERSION = 1
+INSERT_BATCH_SIZE = 10000
+
+# ファイル先頭のイメージ一覧（「// Image 0: mscorlib.dll - 0」、末尾は最初のTypeDefIndex）
+IMAGE_LINE = re.compile(r"^// Image \d+: (?P<name>.+) - (?P<start>\d+)$")
+NAMESPACE_LINE = re.compile(r"^// Namespace: ?(.*)$")
+TYPE_LINE = re.compile(r"^(?P<modifiers>.*?)\b(?P<kind>class|struct|enum|interface) (?P<name>.+?)"
+                       r"(?: : (?P<base>.+?))? // TypeDefIndex: (?P<index>\d+)$")
+# RVA: 0x1234 Offset: 0x1234 VA: 0x1234 Slot: 4 / RVA: -1 Offset: -1
+METHOD_ADDRESS_LINE = re.compile(r"^\t// RVA: (?P<rva>0x[0-9A-Fa-f]+|-1) Offset: (?P<offset>0x[0-9A-Fa-f]+|-1)"
+                                 r"(?: VA: (?P<va>0x[0-9A-Fa-f]+|-1))?(?: Slot: (?P<slot>\d+))?")
+METHOD_NAME = re.compile(r"([^\s(]+)\(")
+FIELD_OFFSET = re.compile(r"; // 0x([0-9A-Fa-f]+)$")
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE types (
+    id INTEGER PRIMARY KEY, full_name TEXT NOT NULL, namespace TEXT, name TEXT NOT NULL,
+    kind TEXT NOT NULL, base TEXT, type_def_index INTEGER, image TEXT);
+CREATE TABLE fields (
+    type_id INTEGER NOT NULL, name TEXT NOT NULL, declaration TEXT NOT NULL,
+    offset INTEGER, is_static INTEGER NOT NULL, is_const INTEGER NOT NULL);
+CREATE TABLE methods (
+    type_id INTEGER NOT NULL, name TEXT NOT NULL, signature TEXT NOT NULL,
+    rva INTEGER, offset INTEGER, va INTEGER, slot INTEGER);
+"""
+INDEXES = """
+CREATE INDEX types_full_name ON types (full_name);
+CREATE INDEX fields_key ON fields (type_id, name);
+CREATE INDEX methods_key ON methods (type_id, signature);
+CREATE INDEX methods_name ON methods (name);
+CREATE INDEX methods_rva ON methods (rva);
+"""
+
+def _address(value):
+    if value is None or value == "-1":
+        return None
+    return int(value, 16)
+
+def _field_name(declaration):
+    """「public static int count; // 0x10」「public const int A = 1;」からフィールド名を取り出す"""
+    body = declaration.split(" = ", 1)[0] if " = " in declaration else declaration.split(";", 1)[0]
+    return body.rstrip(";").split()[-1]
+
+def iter_symbols(dump_cs):
+    """dump.csを1行ずつ読み、("type"|"field"|"method", 値...) を順に返す（ファイル全体は読み込まない）"""
+    namespace = ""
+    image_starts = []
+    image_names = []
+    type_id = 0
+    in_type = False
+    section = None
+    address = None
+    in_comment = False
+    with open(dump_cs, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if in_comment:
+                in_comment = "*/" not in line
+                continue
+            stripped = line.strip()
+            if stripped.startswith("/*"):
+                in_comment = "*/" not in stripped
+                continue
+            if not in_type:
+                match = IMAGE_LINE.match(line)
+                if match:
+                    image_starts.append(int(match.group("start")))
+                    image_names.append(match.group("name"))
+                    continue
+                match = NAMESPACE_LINE.match(line)
+                if match:
+                    namespace = match.group(1).strip()
+                    continue
+                match = TYPE_LINE.match(line)
+                if match:
+                    type_id += 1
+                    name = match.group("name")
+                    full_name = f"{namespace}.{name}" if namespace else name
+                    type_def_index = int(match.group("index"))
+                    position = bisect.bisect_right(image_starts, type_def_index) - 1
+                    image = image_names[position] if position >= 0 else None
+                    yield ("type", type_id, full_name, namespace, name, match.group("kind"),
+                           match.group("base"), type_def_index, image)
+                    in_type = True
+                    section = None
+                    address = None
+                continue
+            if line == "}":
+                in_type = False
+                continue
+            if stripped in ("// Fields", "// Properties", "// Methods"):
+                section = stripped[3:]
+                continue
+            if not stripped or stripped.startswith("[") or stripped == "{":
+                continue
+            if section == "Fields":
+                match = FIELD_OFFSET.search(stripped)
+                declaration = stripped[:match.start() + 1] if match else stripped
+                words = declaration.split(" = ", 1)[0].split()
+                yield ("field", type_id, _field_name(declaration), declaration,
+                       int(match.group(1), 16) if match else None,
+                       int("static" in words), int("const" in words))
+            elif section == "Methods":
+                match = METHOD_ADDRESS_LINE.match(line)
+                if match:
+                    address = match
+                    continue
+                if stripped.startswith("//"):
+                    continue
+                signature = stripped[:-4] if stripped.endswith(" { }") else stripped
+                name_match = METHOD_NAME.search(signature)
+                if address is not None:
+                    rva, offset, va, slot = (_address(address.group("rva")), _address(address.group("offset")),
+                                             _address(address.group("va")), address.group("slot"))
+                else:
+                    rva = offset = va = slot = None
+                yield ("method", type_id, name_match.group(1) if name_match else signature, signature,
+                       rva, offset, va, int(slot) if slot is not None else None)
+                address = None
+
+def _flush(conn, batches):
+    conn.executemany("INSERT INTO types VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batches["type"])
+    conn.executemany("INSERT INTO fields VALUES (?, ?, ?, ?, ?, ?)", batches["field"])
+    conn.executemany("INSERT INTO methods VALUES (?, ?, ?, ?, ?, ?, ?)", batches["method"])
+    for batch in batches.values():
+        batch.clear()
+
+@instrument.traced()
+def build_index(dump_cs, db_path, source_sha256=None):
+    """dump.csをストリームで解析し、SQLiteのシンボルテーブルを作成する"""
+    dump_cs = Path(dump_cs)
+    db_path = Path(db_path)
+    print(f"シンボルテーブルを作成中: {dump_cs} → {db_path}")
+    started = time.perf_counter()
+    temp_path = db_path.with_name(db_path.name + ".tmp")
+    if temp_path.exists():
+        temp_path.unlink()
+
+    conn = sqlite3.connect(temp_path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.executescript(SCHEMA)
+        batches = {"type": [], "field": [], "method": []}
+        counts = {"type": 0, "field": 0, "method": 0}
+        pending = 0
+        for symbol in iter_symbols(dump_cs):
+            batches[symbol[0]].append(symbol[1:])
+            counts[symbol[0]] += 1
+            pending += 1
+            if pending >= INSERT_BATCH_SIZE:
+                _flush(conn, batches)
+                pending = 0
+        _flush(conn, batches)
+        conn.executescript(INDEXES)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("schema_version", str(SCHEMA_VERSION)),
+            ("source", str(dump_cs)),
+            ("source_sha256", source_sha256 or cache.file_sha256(dump_cs)),
+            ("created_at", str(int(time.time()))),
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(temp_path, db_path)
+    print(f"シンボルテーブルを作成しました: 型{counts['type']}件, フィールド{counts['field']}件, "
+          f"メソッド{counts['method']}件（{time.perf_counter() - started:.2f}秒）")
+    return counts
+
+def read_meta(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return dict(conn.execute("SELECT key, value FROM meta"))
+    except sqlite3.DatabaseError:
+        return {}
+    finally:
+        conn.close()
+
+# 差分の種類ごとのクエリ（old/newはATTACHしたデータベース）
+DIFF_QUERIES = {
+    "type_added": """
+        SELECT n.full_name, n.kind, n.type_def_index FROM new.types n
+        WHERE NOT EXISTS (SELECT 1 FROM old.types o WHERE o.full_name = n.full_name)""",
+    "type_removed": """
+        SELECT o.full_name, o.kind, o.type_def_index FROM old.types o
+        WHERE NOT EXISTS (SELECT 1 FROM new.types n WHERE n.full_name = o.full_name)""",
+    "method_added": """
+        SELECT t.full_name, m.signature, m.rva, m.offset FROM new.methods m
+        JOIN new.types t ON t.id = m.type_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM old.types ot JOIN old.methods om ON om.type_id = ot.id
+            WHERE ot.full_name = t.full_name AND om.signature = m.signature)""",
+    "method_removed": """
+        SELECT t.full_name, m.signature, m.rva, m.offset FROM old.methods m
+        JOIN old.types t ON t.id = m.type_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM new.types nt JOIN new.methods nm ON nm.type_id = nt.id
+            WHERE nt.full_name = t.full_name AND nm.signature = m.signature)""",
+    "method_moved": """
+        SELECT nt.full_name, nm.signature, om.rva, nm.rva, om.offset, nm.offset
+        FROM new.types nt
+        JOIN old.types ot ON ot.full_name = nt.full_name
+        JOIN new.methods nm ON nm.type_id = nt.id
+        JOIN old.methods om ON om.type_id = ot.id AND om.signature = nm.signature
+        WHERE om.rva IS NOT nm.rva""",
+    "field_offset_changed": """
+        SELECT nt.full_name, nf.name, oldf.offset, nf.offset
+        FROM new.types nt
+        JOIN old.types ot ON ot.full_name = nt.full_name
+        JOIN new.fields nf ON nf.type_id = nt.id
+        JOIN old.fields oldf ON oldf.type_id = ot.id AND oldf.name = nf.name
+        WHERE oldf.offset IS NOT nf.offset""",
+}
+
+def _diff_record(change, row):
+    if change in ("type_added", "type_removed"):
+        return {"change": change, "type": row[0], "kind": row[1], "type_def_index": row[2]}
+    if change in ("method_added", "method_removed"):
+        return {"change": change, "type": row[0], "method": row[1],
+                "rva": format_address(row[2]), "offset": format_address(row[3])}
+    if change == "method_moved":
+        return {"change": change, "type": row[0], "method": row[1],
+                "old_rva": format_address(row[2]), "new_rva": format_address(row[3]),
+                "old_offset": format_address(row[4]), "new_offset": format_address(row[5])}
+    return {"change": change, "type": row[0], "field": row[1],
+            "old_offset": format_address(row[2]), "new_offset": format_address(row[3])}
+
+def format_address(value):
+    return None if value is None else f"0x{value:X}"
+
+@instrument.traced()
+def diff_indexes(old_db, new_db, output_path):
+    """2つのシンボルテーブルを比較し、差分を1行1件のJSONで書き出す。種類ごとの件数を返す"""
+    print(f"シンボルテーブルの差分を計算中: {old_db} → {new_db}")
+    started = time.perf_counter()
+    output_path = Path(output_path)
+    temp_path = output_path.with_name(output_path.name + ".tmp")
+    conn = sqlite3.connect(":memory:")
+    summary = {}
+    try:
+        conn.execute("ATTACH DATABASE ? AS old", (str(old_db),))
+        conn.execute("ATTACH DATABASE ? AS new", (str(new_db),))
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for change, query in DIFF_QUERIES.items():
+                count = 0
+                for row in conn.execute(query):
+                    f.write(json.dumps(_diff_record(change, row), ensure_ascii=False) + "\n")
+                    count += 1
+                summary[change] = count
+    finally:
+        conn.close()
+    os.replace(temp_path, output_path)
+
+    print(f"差分を保存しました: {output_path}（{time.perf_counter() - started:.2f}秒）")
+    for change, count in summary.items():
+        print(f"  {change}: {count}件")
+    return summary
+
+def update_index(dump_cs, output_dir=OUTPUT_DIR):
+    """dump.csのシンボルテーブルを更新し、前回のテーブルがあれば差分を出力する"""
+    output_dir = Path(output_dir)
+    db_path = output_dir / INDEX_NAME
+    previous_path = output_dir / PREVIOUS_INDEX_NAME
+    source_sha256 = cache.file_sha256(dump_cs)
+    if db_path.exists():
+        if read_meta(db_path).get("source_sha256") == source_sha256:
+            print(f"シンボルテーブルは最新です: {db_path}")
+            return db_path, None
+        os.replace(db_path, previous_path)
+    build_index(dump_cs, db_path, source_sha256)
+    if not previous_path.exists():
+        return db_path, None
+    return db_path, diff_indexes(previous_path, db_path, output_dir / DIFF_NAME)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="dump.csのシンボルテーブル作成とバージョン間の差分")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="dump.csからシンボルテーブルを作成する")
+    build.add_argument("dump_cs", type=Path)
+    build.add_argument("db", type=Path, nargs="?", default=OUTPUT_DIR / INDEX_NAME)
+    diff = subparsers.add_parser("diff", help="2つのシンボルテーブルの差分を出力する")
+    diff.add_argument("old_db", type=Path)
+    diff.add_argument("new_db", type=Path)
+    diff.add_argument("-o", "--output", type=Path, default=OUTPUT_DIR / DIFF_NAME)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "build":
+        build_index(args.dump_cs, args.db)
+    else:
+        diff_indexes(args.old_db, args.new_db, args.output)
+
+if __name__ == "__main__":
+    main()
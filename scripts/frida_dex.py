@@ -0,0 +1,185 @@
+import struct
+import zlib
+import hashlib
+
+FRIDA_APPLICATION_CLASS = "io.frida.FridaApplication"
+DEFAULT_SUPERCLASS = "android.app.Application"
+GADGET_LIBRARY = "frida-gadget"
+
+DEX_MAGIC = b"dex\n035\0"
+HEADER_SIZE = 0x70
+ENDIAN_CONSTANT = 0x12345678
+NO_INDEX = 0xffffffff
+
+ACC_PUBLIC = 0x0001
+ACC_CONSTRUCTOR = 0x10000
+
+TYPE_HEADER_ITEM = 0x0000
+TYPE_STRING_ID_ITEM = 0x0001
+TYPE_TYPE_ID_ITEM = 0x0002
+TYPE_PROTO_ID_ITEM = 0x0003
+TYPE_METHOD_ID_ITEM = 0x0005
+TYPE_CLASS_DEF_ITEM = 0x0006
+TYPE_MAP_LIST = 0x1000
+TYPE_TYPE_LIST = 0x1001
+TYPE_CLASS_DATA_ITEM = 0x2000
+TYPE_CODE_ITEM = 0x2001
+TYPE_STRING_DATA_ITEM = 0x2002
+
+def _uleb128(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _descriptor(class_name):
+    return "L" + class_name.replace(".", "/") + ";"
+
+def _mutf8(value):
+    """DEXのMUTF-8（NUL と補助文字をエンコードし直したUTF-8）"""
+    out = bytearray()
+    for unit in struct.unpack(f"<{len(value.encode('utf-16-le')) // 2}H", value.encode("utf-16-le")):
+        if unit != 0 and unit < 0x80:
+            out.append(unit)
+        elif unit < 0x800:
+            out += bytes([0xc0 | (unit >> 6), 0x80 | (unit & 0x3f)])
+        else:
+            out += bytes([0xe0 | (unit >> 12), 0x80 | ((unit >> 6) & 0x3f), 0x80 | (unit & 0x3f)])
+    return bytes(out)
+
+def _utf16_sort_key(value):
+    return value.encode("utf-16-be")
+
+def _align(buffer, alignment=4):
+    buffer += b"\0" * (-len(buffer) % alignment)
+
+def build_frida_application_dex(superclass=None, class_name=FRIDA_APPLICATION_CLASS, library=GADGET_LIBRARY):
+    """attachBaseContextでFrida Gadgetを読み込むApplicationクラスだけを含むDEXを生成
+
+    元のマニフェストに独自のApplicationクラスがある場合は、それを継承させて元の初期化処理を保つ。
+    """
+    this_type = _descriptor(class_name)
+    super_type = _descriptor(superclass or DEFAULT_SUPERCLASS)
+    context_type = "Landroid/content/Context;"
+    string_type = "Ljava/lang/String;"
+    system_type = "Ljava/lang/System;"
+
+    strings = sorted({
+        "<init>", "attachBaseContext", "loadLibrary", library, "V", "VL",
+        this_type, super_type, context_type, string_type, system_type,
+    }, key=_utf16_sort_key)
+    string_index = {s: i for i, s in enumerate(strings)}
+
+    types = sorted([this_type, super_type, context_type, string_type, system_type, "V"],
+                   key=lambda t: string_index[t])
+    type_index = {t: i for i, t in enumerate(types)}
+
+    # (shorty, 戻り値, 引数) — 戻り値の型、引数リストの順に並べる
+    protos = sorted([("V", "V", ()), ("VL", "V", (context_type,)), ("VL", "V", (string_type,))],
+                    key=lambda p: (type_index[p[1]], [type_index[t] for t in p[2]]))
+    proto_index = {p[2]: i for i, p in enumerate(protos)}
+
+    methods = sorted([
+        (this_type, "<init>", ()),
+        (this_type, "attachBaseContext", (context_type,)),
+        (super_type, "<init>", ()),
+        (super_type, "attachBaseContext", (context_type,)),
+        (system_type, "loadLibrary", (string_type,)),
+    ], key=lambda m: (type_index[m[0]], string_index[m[1]], proto_index[m[2]]))
+    method_index = {m: i for i, m in enumerate(methods)}
+
+    # コードアイテム
+    init_insns = struct.pack("<HHHH",
+                             0x1070, method_index[(super_type, "<init>", ())], 0x0000,  # invoke-direct {v0}
+                             0x000e)  # return-void
+    init_code = struct.pack("<HHHHII", 1, 1, 1, 0, 0, len(init_insns) // 2) + init_insns
+    attach_insns = struct.pack(
+        "<HHHHHHHHH",
+        0x206f, method_index[(super_type, "attachBaseContext", (context_type,))], 0x0021,  # invoke-super {v1, v2}
+        0x001a, string_index[library],  # const-string v0, library
+        0x1071, method_index[(system_type, "loadLibrary", (string_type,))], 0x0000,  # invoke-static {v0}
+        0x000e)  # return-void
+    attach_code = struct.pack("<HHHHII", 3, 2, 2, 0, 0, len(attach_insns) // 2) + attach_insns
+
+    string_ids_off = HEADER_SIZE
+    type_ids_off = string_ids_off + 4 * len(strings)
+    proto_ids_off = type_ids_off + 4 * len(types)
+    method_ids_off = proto_ids_off + 12 * len(protos)
+    class_defs_off = method_ids_off + 8 * len(methods)
+    data_off = class_defs_off + 32
+
+    data = bytearray()
+    code_offsets = []
+    for code in (init_code, attach_code):
+        _align(data)
+        code_offsets.append(data_off + len(data))
+        data += code
+    code_count = len(code_offsets)
+
+    _align(data)
+    type_list_start = data_off + len(data)
+    type_list_offsets = {}
+    for params in sorted({p[2] for p in protos if p[2]}, key=lambda ps: [type_index[t] for t in ps]):
+        _align(data)
+        type_list_offsets[params] = data_off + len(data)
+        data += struct.pack("<I", len(params)) + b"".join(struct.pack("<H", type_index[t]) for t in params)
+
+    string_data_start = data_off + len(data)
+    string_data_offsets = []
+    for s in strings:
+        string_data_offsets.append(data_off + len(data))
+        data += _uleb128(len(s.encode("utf-16-le")) // 2) + _mutf8(s) + b"\0"
+
+    class_data_off = data_off + len(data)
+    init_idx = method_index[(this_type, "<init>", ())]
+    attach_idx = method_index[(this_type, "attachBaseContext", (context_type,))]
+    data += (_uleb128(0) + _uleb128(0) + _uleb128(1) + _uleb128(1)
+             + _uleb128(init_idx) + _uleb128(ACC_PUBLIC | ACC_CONSTRUCTOR) + _uleb128(code_offsets[0])
+             + _uleb128(attach_idx) + _uleb128(ACC_PUBLIC) + _uleb128(code_offsets[1]))
+
+    _align(data)
+    map_off = data_off + len(data)
+    map_items = [
+        (TYPE_HEADER_ITEM, 1, 0),
+        (TYPE_STRING_ID_ITEM, len(strings), string_ids_off),
+        (TYPE_TYPE_ID_ITEM, len(types), type_ids_off),
+        (TYPE_PROTO_ID_ITEM, len(protos), proto_ids_off),
+        (TYPE_METHOD_ID_ITEM, len(methods), method_ids_off),
+        (TYPE_CLASS_DEF_ITEM, 1, class_defs_off),
+        (TYPE_CODE_ITEM, code_count, code_offsets[0]),
+        (TYPE_TYPE_LIST, len(type_list_offsets), type_list_start),
+        (TYPE_STRING_DATA_ITEM, len(strings), string_data_start),
+        (TYPE_CLASS_DATA_ITEM, 1, class_data_off),
+        (TYPE_MAP_LIST, 1, map_off),
+    ]
+    data += struct.pack("<I", len(map_items))
+    data += b"".join(struct.pack("<HHII", t, 0, size, offset) for t, size, offset in map_items)
+
+    ids = bytearray()
+    ids += b"".join(struct.pack("<I", off) for off in string_data_offsets)
+    ids += b"".join(struct.pack("<I", string_index[t]) for t in types)
+    ids += b"".join(struct.pack("<III", string_index[shorty], type_index[ret], type_list_offsets.get(params, 0))
+                    for shorty, ret, params in protos)
+    ids += b"".join(struct.pack("<HHI", type_index[cls], proto_index[params], string_index[name])
+                    for cls, name, params in methods)
+    ids += struct.pack("<IIIIIIII", type_index[this_type], ACC_PUBLIC, type_index[super_type],
+                       0, NO_INDEX, 0, class_data_off, 0)
+
+    file_size = data_off + len(data)
+    header = bytearray(HEADER_SIZE)
+    header[0:8] = DEX_MAGIC
+    struct.pack_into("<IIIIII", header, 32, file_size, HEADER_SIZE, ENDIAN_CONSTANT, 0, 0, map_off)
+    struct.pack_into("<IIIIIIIIIIIIII", header, 56,
+                     len(strings), string_ids_off, len(types), type_ids_off,
+                     len(protos), proto_ids_off, 0, 0, len(methods), method_ids_off,
+                     1, class_defs_off, len(data), data_off)
+
+    dex = header + ids + data
+    dex[12:32] = hashlib.sha1(bytes(dex[32:])).digest()
+    struct.pack_into("<I", dex, 8, zlib.adler32(bytes(dex[12:])) & 0xffffffff)
+    return bytes(dex)
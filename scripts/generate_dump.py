@@ -1,12 +1,111 @@
 import os
+import sys
+import json
+import time
+import argparse
+import threading
 import subprocess
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
+import cache
+import instrument
+import dump_index
+import il2cpp_inspect
+import metadata_guard
+import symbol_lookup
+
 OUTPUT_DIR = Path("../output")
 TOOLS_DIR = Path("../tools")
 IL2CPP_DUMPER_DIR = TOOLS_DIR / "Il2CppDumper"
+IL2CPP_DUMPER_VERSION = "v6.7.46"
+DUMPS_DIR = OUTPUT_DIR / "dumps"
+DEFAULT_WORKERS = 2
+
+_print_lock = threading.Lock()
+_config_lock = threading.Lock()
+
+def _log(label, stream_name, line):
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    with _print_lock:
+        print(f"[{timestamp}] [{label}] {stream_name}: {line}", flush=True)
+
+def dumper_command(dumper_dir=IL2CPP_DUMPER_DIR):
+    """Windowsではexe、それ以外では.NET版のIl2CppDumper.dllをdotnetで実行するコマンドを返す"""
+    dumper_exe = dumper_dir / "Il2CppDumper.exe"
+    dumper_dll = dumper_dir / "Il2CppDumper.dll"
+    if sys.platform == "win32" and dumper_exe.exists():
+        return [str(dumper_exe)]
+    if dumper_dll.exists():
+        if shutil.which("dotnet") is None:
+            raise FileNotFoundError("dotnetが見つかりません。.NETランタイムをインストールしてください")
+        return ["dotnet", str(dumper_dll)]
+    if dumper_exe.exists():
+        return [str(dumper_exe)]
+    raise FileNotFoundError(f"Il2CppDumperが見つかりません: {dumper_dir}")
+
+def _disable_key_prompt(dumper_dir=IL2CPP_DUMPER_DIR):
+    """終了時の「Press any key」待ちは標準入力がパイプだと失敗するため無効にする"""
+    config_path = dumper_dir / "config.json"
+    with _config_lock:
+        if not config_path.exists():
+            return
+        with open(config_path, 'r', encoding='utf-8-sig') as f:
+            config = json.load(f)
+        if config.get("RequireAnyKey") is False:
+            return
+        config["RequireAnyKey"] = False
+        # バッチモードでは別プロセスのダンパーが同時に読むため、書き換えはos.replaceで行う
+        temp_path = config_path.with_name(f"config.json.{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2)
+        os.replace(temp_path, config_path)
 
+def _pump(pipe, label, stream_name):
+    for line in iter(pipe.readline, ""):
+        _log(label, stream_name, line.rstrip("\r\n"))
+    pipe.close()
+
+def _find_dump_cs(output_dir):
+    for candidate in (output_dir / "dump.cs", output_dir / "script" / "dump.cs"):
+        if candidate.exists():
+            return candidate
+    raise FileNotFoundError(f"dump.csが生成されませんでした: {output_dir}")
+
+@instrument.traced()
+def run_dumper(il2cpp_so, global_metadata, output_dir, label="dump", dumper_dir=IL2CPP_DUMPER_DIR):
+    """Il2CppDumperを実行し、標準出力・標準エラーをタイムスタンプ付きで逐次表示する"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    command = dumper_command(dumper_dir) + [str(il2cpp_so), str(global_metadata), str(output_dir)]
+    _disable_key_prompt(dumper_dir)
+    
+    _log(label, "run", " ".join(command))
+    started = time.perf_counter()
+    children_cpu = instrument.children_cpu()
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True, encoding="utf-8", errors="replace", bufsize=1)
+    pumps = [threading.Thread(target=_pump, args=(process.stdout, label, "out"), daemon=True),
+             threading.Thread(target=_pump, args=(process.stderr, label, "err"), daemon=True)]
+    for pump in pumps:
+        pump.start()
+    try:
+        process.stdin.write("1\n")
+        process.stdin.close()
+    except (BrokenPipeError, OSError):
+        pass
+    returncode = process.wait()
+    for pump in pumps:
+        pump.join()
+    instrument.record_subprocess(f"Il2CppDumper [{label}]", command, started, returncode, children_cpu)
+    _log(label, "exit", f"終了コード {returncode}（{time.perf_counter() - started:.2f}秒）")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return _find_dump_cs(output_dir)
+
+@instrument.traced()
 def run_il2cpp_dumper():
     print("Il2CppDumperを実行中...")
     
@@ -16,36 +115,105 @@ def run_il2cpp_dumper():
     if not il2cpp_so.exists() or not global_metadata.exists():
         raise FileNotFoundError(f"必要なファイルが見つかりません: {il2cpp_so} or {global_metadata}")
     
-    dumper_exe = IL2CPP_DUMPER_DIR / "Il2CppDumper.exe"
-    
-    if not dumper_exe.exists():
-        raise FileNotFoundError(f"Il2CppDumper.exeが見つかりません: {dumper_exe}")
+    # 暗号化されたメタデータをダンパーに渡さない（復号できなければここで止める）
+    metadata_guard.ensure_valid_metadata(global_metadata, il2cpp_so)
     
-    result = subprocess.run(
-        [
-            str(dumper_exe),
-            str(il2cpp_so),
-            str(global_metadata),
-            str(OUTPUT_DIR / "dump")
-        ],
-        input="1\n",
-        text=True,
-        check=True,
-        capture_output=True
-    )
+    # ヘッダーの指紋が前回ダンプしたときと同じであれば、ファイル全体のハッシュも取らずにスキップする
+    fingerprint_path = OUTPUT_DIR / il2cpp_inspect.FINGERPRINT_NAME
+    previous = il2cpp_inspect.load_fingerprint(fingerprint_path)
+    info = il2cpp_inspect.check(il2cpp_so, global_metadata, fingerprint_path)
+    if (info and previous and previous["fingerprint"] == info["fingerprint"]
+            and previous.get("dumper") == IL2CPP_DUMPER_VERSION and (OUTPUT_DIR / "dump.cs").exists()):
+        print("前回ダンプしたときと同じ入力のため、Il2CppDumperの実行をスキップします")
+        return
     
-    print(result.stdout)
-    
-    dump_cs_path = OUTPUT_DIR / "dump" / "script" / "dump.cs"
-    if dump_cs_path.exists():
-        shutil.copy(dump_cs_path, OUTPUT_DIR)
-        print(f"dump.csが生成されました: {OUTPUT_DIR / 'dump.cs'}")
+    # 入力が同じであれば前回のdump.csをキャッシュから取り出してダンパーを実行しない
+    store = cache.get_cache()
+    dump_key = cache.cache_key("dump-cs", cache.file_sha256(il2cpp_so),
+                               cache.file_sha256(global_metadata), IL2CPP_DUMPER_VERSION)
+    if store.materialize(dump_key, OUTPUT_DIR / "dump.cs"):
+        print(f"キャッシュ済みのdump.csを使用します: {OUTPUT_DIR / 'dump.cs'}")
     else:
-        raise FileNotFoundError(f"dump.csが生成されませんでした: {dump_cs_path}")
+        dump_cs_path = run_dumper(il2cpp_so, global_metadata, OUTPUT_DIR / "dump")
+        cache.link_or_copy(dump_cs_path, OUTPUT_DIR / "dump.cs")
+        store.put(dump_key, dump_cs_path)
+        print(f"dump.csが生成されました: {OUTPUT_DIR / 'dump.cs'}")
+    if info:
+        il2cpp_inspect.save_fingerprint(dict(info, dumper=IL2CPP_DUMPER_VERSION), fingerprint_path)
+
+def _run_dump_job(job):
+    """1組をダンプして (ラベル, dump.cs) を返す
+
+    libil2cpp.soのハッシュはここで1回だけ計算し、出力ディレクトリのラベルとキャッシュキーの両方に使う。
+    暗号化されたメタデータは元のファイル（ユーザーの保存物）を書き換えず、出力ディレクトリに復号する。
+    """
+    il2cpp_so, global_metadata, output_root, index = job
+    il2cpp_so, global_metadata = Path(il2cpp_so), Path(global_metadata)
+    so_sha256 = cache.file_sha256(il2cpp_so)
+    label = f"{index:02d}-{so_sha256[:12]}"
+    output_dir = Path(output_root) / label
+    output_dir.mkdir(parents=True, exist_ok=True)
+    global_metadata = metadata_guard.ensure_valid_metadata(
+        global_metadata, il2cpp_so, output_path=output_dir / global_metadata.name)
+    store = cache.get_cache()
+    dump_key = cache.cache_key("dump-cs", so_sha256, cache.file_sha256(global_metadata), IL2CPP_DUMPER_VERSION)
+    if store.materialize(dump_key, output_dir / "dump.cs"):
+        print(f"[{label}] キャッシュ済みのdump.csを使用します")
+        return label, output_dir / "dump.cs"
+    dump_cs_path = run_dumper(il2cpp_so, global_metadata, output_dir, label=label)
+    store.put(dump_key, dump_cs_path)
+    return label, dump_cs_path
 
-def main():
+def run_dumps(pairs, workers=DEFAULT_WORKERS, output_root=DUMPS_DIR):
+    """(libil2cpp.so, global-metadata.dat) の組を、それぞれ別の出力ディレクトリで並列にダンプする
+
+    戻り値は入力と同じ順序のdump.csのパス。
+    """
+    pairs = [tuple(pair) for pair in pairs]
+    for il2cpp_so, global_metadata in pairs:
+        if not Path(il2cpp_so).exists() or not Path(global_metadata).exists():
+            raise FileNotFoundError(f"必要なファイルが見つかりません: {il2cpp_so} or {global_metadata}")
+    jobs = [(il2cpp_so, global_metadata, output_root, index)
+            for index, (il2cpp_so, global_metadata) in enumerate(pairs)]
+    
+    workers = max(1, min(workers or DEFAULT_WORKERS, len(jobs) or 1))
+    print(f"{len(jobs)}件のダンプを{workers}並列で実行します...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(instrument.bind(_run_dump_job), jobs))
+    print(f"すべてのダンプが完了しました（{time.perf_counter() - started:.2f}秒）")
+    for (il2cpp_so, _), (label, dump_cs_path) in zip(pairs, results):
+        print(f"  [{label}] {il2cpp_so} → {dump_cs_path}")
+    return [dump_cs_path for _, dump_cs_path in results]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Il2CppDumperでdump.csを生成する")
+    parser.add_argument("--pair", nargs=2, action="append", metavar=("SO", "METADATA"),
+                        help="ダンプするlibil2cpp.soとglobal-metadata.datの組（複数指定で並列実行）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"並列に実行するダンパーの数（既定: {DEFAULT_WORKERS}）")
+    parser.add_argument("--output-root", type=Path, default=DUMPS_DIR,
+                        help="--pair指定時の出力先（組ごとにサブディレクトリを作成）")
+    return parser.parse_args(argv)
+
+@instrument.traced()
+def generate_dump():
+    """dump.csを生成し、シンボルテーブルを更新して前回のバージョンとの差分を出力する"""
     run_il2cpp_dumper()
     print("dump.csの生成が完了しました")
+    db_path, _ = dump_index.update_index(OUTPUT_DIR / "dump.cs", OUTPUT_DIR)
+    symbol_lookup.ensure_symbols(db_path, OUTPUT_DIR / "dump" / "script.json")
+    return OUTPUT_DIR / "dump.cs", db_path
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        if args.pair:
+            run_dumps(args.pair, workers=args.workers, output_root=args.output_root)
+        else:
+            generate_dump()
+    finally:
+        instrument.save("generate_dump")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
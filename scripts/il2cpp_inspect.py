@@ -0,0 +1,312 @@
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+from pathlib import Path
+
+OUTPUT_DIR = Path("../output")
+# 最後にダンプした入力の指紋（次回のダンプのスキップ判定に使う）
+FINGERPRINT_NAME = "il2cpp_fingerprint.json"
+
+METADATA_MAGIC = 0xFAB11BAF
+# Il2CppDumper v6.7.46が扱えるメタデータのバージョン
+SUPPORTED_METADATA_VERSIONS = range(16, 32)
+MAX_METADATA_HEADER_SIZE = 4096
+# ファイル全体をハッシュせず、等間隔に取った数ページだけを指紋に含める
+SAMPLE_PAGES = 16
+SAMPLE_SIZE = 4096
+
+_BASE_SECTIONS = [
+    "stringLiteral", "stringLiteralData", "string", "events", "properties", "methods",
+    "parameterDefaultValues", "fieldDefaultValues", "fieldAndParameterDefaultValueData", "fieldMarshaledSizes",
+    "parameters", "fields", "genericParameters", "genericParameterConstraints", "genericContainers",
+    "nestedTypes", "interfaces", "vtableMethods", "interfaceOffsets", "typeDefinitions",
+]
+# (最小バージョン, 最大バージョン, セクション名) — 同じバージョン番号でもマイナー版で並びが変わるため、数も見て選ぶ
+_METADATA_LAYOUTS = [
+    (24, 24, _BASE_SECTIONS + ["rgctxEntries", "images", "assemblies", "metadataUsageLists", "metadataUsagePairs",
+                               "fieldRefs", "referencedAssemblies", "attributesInfo", "attributeTypes",
+                               "unresolvedVirtualCallParameterTypes", "unresolvedVirtualCallParameterRanges",
+                               "windowsRuntimeTypeNames", "exportedTypeDefinitions"]),
+    (24, 24, _BASE_SECTIONS + ["images", "assemblies", "metadataUsageLists", "metadataUsagePairs",
+                               "fieldRefs", "referencedAssemblies", "attributesInfo", "attributeTypes",
+                               "unresolvedVirtualCallParameterTypes", "unresolvedVirtualCallParameterRanges",
+                               "windowsRuntimeTypeNames", "exportedTypeDefinitions"]),
+    (27, 28, _BASE_SECTIONS + ["images", "assemblies", "fieldRefs", "referencedAssemblies", "attributesInfo",
+                               "attributeTypes", "unresolvedVirtualCallParameterTypes",
+                               "unresolvedVirtualCallParameterRanges", "windowsRuntimeTypeNames",
+                               "windowsRuntimeStrings", "exportedTypeDefinitions"]),
+    (29, 31, _BASE_SECTIONS + ["images", "assemblies", "fieldRefs", "referencedAssemblies", "attributeData",
+                               "attributeDataRange", "unresolvedVirtualCallParameterTypes",
+                               "unresolvedVirtualCallParameterRanges", "windowsRuntimeTypeNames",
+                               "windowsRuntimeStrings", "exportedTypeDefinitions"]),
+]
+
+ELF_MAGIC = b"\x7fELF"
+ELF_MACHINES = {3: "x86", 40: "arm", 62: "x86_64", 183: "aarch64"}
+PT_NOTE = 4
+PROGRAM_TYPES = {0: "NULL", 1: "LOAD", 2: "DYNAMIC", 3: "INTERP", 4: "NOTE", 6: "PHDR", 7: "TLS",
+                 0x6474e550: "GNU_EH_FRAME", 0x6474e551: "GNU_STACK", 0x6474e552: "GNU_RELRO",
+                 0x70000001: "ARM_EXIDX"}
+NT_GNU_BUILD_ID = 3
+SHN_XINDEX = 0xffff
+
+class InspectError(ValueError):
+    pass
+
+class _MappedFile:
+    """ファイルを読み取り専用でmmapし、コピーせずにmemoryviewで参照する"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        self.size = self.path.stat().st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.view = memoryview(self._mmap) if self._mmap is not None else memoryview(b"")
+
+    def unpack(self, fmt, offset):
+        if offset < 0 or offset + struct.calcsize(fmt) > self.size:
+            raise InspectError(f"ファイル終端を超えて読み取ろうとしました: {self.path} (オフセット {offset})")
+        return struct.unpack_from(fmt, self.view, offset)
+
+    def sample_digest(self, pages=SAMPLE_PAGES, size=SAMPLE_SIZE):
+        """先頭・末尾を含む等間隔のページとファイルサイズのハッシュ"""
+        digest = hashlib.sha256(str(self.size).encode())
+        if self.size:
+            step = max(1, (self.size - size) // max(1, pages - 1))
+            for i in range(pages):
+                start = min(i * step, max(0, self.size - size))
+                digest.update(self.view[start:start + size])
+        return digest.hexdigest()
+
+    def close(self):
+        self.view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def metadata_section_names(version, count):
+    for low, high, names in _METADATA_LAYOUTS:
+        if low <= version <= high and len(names) == count:
+            return names
+    return [f"section{i}" for i in range(count)]
+
+def parse_metadata_header(data, file_size):
+    """メタデータ先頭のバイト列（bytes/memoryview）からヘッダーを解釈する
+
+    復号前のデータの検証にも使うため、ファイルではなくバッファを受け取る。
+    """
+    if len(data) < 12:
+        raise InspectError("メタデータが短すぎます")
+    magic, version = struct.unpack_from("<Ii", data, 0)
+    info = {"size": file_size, "magic": f"0x{magic:08X}", "version": version,
+            "valid_magic": magic == METADATA_MAGIC}
+    if magic != METADATA_MAGIC:
+        # 暗号化・難読化されたメタデータはヘッダーを解釈できない
+        info.update({"header_size": None, "sections": {}})
+        return info
+    # ヘッダーの直後から最初のセクション（stringLiteral）が始まるため、その位置がヘッダー長になる
+    header_size = struct.unpack_from("<i", data, 8)[0]
+    if header_size <= 8 or header_size > MAX_METADATA_HEADER_SIZE or (header_size - 8) % 8:
+        raise InspectError(f"メタデータヘッダーの長さが不正です: {header_size}")
+    if header_size > len(data):
+        raise InspectError(f"メタデータヘッダーが途中で切れています: {header_size}")
+    count = (header_size - 8) // 8
+    pairs = struct.unpack_from(f"<{count * 2}i", data, 8)
+    names = metadata_section_names(version, count)
+    sections = {name: {"offset": pairs[i * 2], "size": pairs[i * 2 + 1]} for i, name in enumerate(names)}
+    info.update({
+        "header_size": header_size,
+        "header_sha256": hashlib.sha256(data[:header_size]).hexdigest(),
+        "sections": sections,
+        "out_of_range": [name for name, s in sections.items()
+                         if s["size"] < 0 or (s["size"] and s["offset"] < header_size)
+                         or s["offset"] + s["size"] > file_size],
+    })
+    return info
+
+def inspect_metadata(path):
+    """global-metadata.datのヘッダー（マジック・バージョン・各セクションのオフセットとサイズ）を読む"""
+    with _MappedFile(path) as mf:
+        info = {"path": str(path)}
+        info.update(parse_metadata_header(mf.view[:MAX_METADATA_HEADER_SIZE], mf.size))
+        info["sample_sha256"] = mf.sample_digest()
+        return info
+
+def _elf_build_id(mf, endian, offset, size):
+    """PT_NOTEセグメントからGNUビルドIDを探す"""
+    end = min(offset + size, mf.size)
+    while offset + 12 <= end:
+        namesz, descsz, note_type = mf.unpack(endian + "III", offset)
+        name_start = offset + 12
+        desc_start = name_start + (namesz + 3) // 4 * 4
+        if desc_start + descsz > end:
+            break
+        if note_type == NT_GNU_BUILD_ID and bytes(mf.view[name_start:name_start + namesz]).rstrip(b"\0") == b"GNU":
+            return bytes(mf.view[desc_start:desc_start + descsz]).hex()
+        offset = desc_start + (descsz + 3) // 4 * 4
+    return None
+
+def inspect_elf(path):
+    """libil2cpp.soのELFヘッダー・プログラムヘッダー・セクションヘッダー・ビルドIDを読む"""
+    with _MappedFile(path) as mf:
+        if mf.size < 16 or bytes(mf.view[:4]) != ELF_MAGIC:
+            raise InspectError(f"ELFファイルではありません: {path}")
+        elf_class, data = mf.view[4], mf.view[5]
+        if elf_class not in (1, 2) or data not in (1, 2):
+            raise InspectError(f"未対応のELF形式です: class={elf_class}, data={data}")
+        is64 = elf_class == 2
+        endian = "<" if data == 1 else ">"
+        (e_type, e_machine, _, e_entry, e_phoff, e_shoff, e_flags, _, e_phentsize, e_phnum,
+         e_shentsize, e_shnum, e_shstrndx) = mf.unpack(endian + ("HHIQQQIHHHHHH" if is64 else "HHIIIIIHHHHHH"), 16)
+
+        segments = []
+        build_id = None
+        for i in range(e_phnum):
+            fields = mf.unpack(endian + ("IIQQQQQQ" if is64 else "IIIIIIII"), e_phoff + i * e_phentsize)
+            if is64:
+                p_type, p_flags, p_offset, p_vaddr, _, p_filesz, p_memsz, p_align = fields
+            else:
+                p_type, p_offset, p_vaddr, _, p_filesz, p_memsz, p_flags, p_align = fields
+            segments.append({"type": PROGRAM_TYPES.get(p_type, f"0x{p_type:x}"), "flags": p_flags,
+                             "offset": p_offset, "vaddr": p_vaddr, "filesz": p_filesz, "memsz": p_memsz,
+                             "align": p_align})
+            if p_type == PT_NOTE and build_id is None:
+                build_id = _elf_build_id(mf, endian, p_offset, p_filesz)
+
+        sections = []
+        shdr_format = endian + ("IIQQQQIIQQ" if is64 else "IIIIIIIIII")
+        if e_shoff and e_shentsize:
+            if e_shnum == 0 or e_shstrndx == SHN_XINDEX:
+                # セクション数が多い場合は0番目のセクションヘッダーに実際の値が入っている
+                first = mf.unpack(shdr_format, e_shoff)
+                e_shnum = e_shnum or first[5]
+                e_shstrndx = first[6] if e_shstrndx == SHN_XINDEX else e_shstrndx
+            headers = [mf.unpack(shdr_format, e_shoff + i * e_shentsize) for i in range(e_shnum)]
+            strtab_offset = headers[e_shstrndx][4] if e_shstrndx < len(headers) else None
+            for sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, *_ in headers:
+                name = ""
+                if strtab_offset is not None and strtab_offset + sh_name < mf.size:
+                    start = strtab_offset + sh_name
+                    end = start
+                    while end < mf.size and mf.view[end] != 0:
+                        end += 1
+                    name = bytes(mf.view[start:end]).decode("utf-8", "replace")
+                sections.append({"name": name, "type": sh_type, "addr": sh_addr, "offset": sh_offset,
+                                 "size": sh_size})
+
+        return {"path": str(path), "size": mf.size, "class": 64 if is64 else 32,
+                "endian": "little" if data == 1 else "big", "type": e_type,
+                "machine": ELF_MACHINES.get(e_machine, str(e_machine)), "entry": e_entry, "flags": e_flags,
+                "build_id": build_id, "segments": segments, "sections": sections,
+                "sample_sha256": mf.sample_digest()}
+
+def fingerprint(il2cpp_so, global_metadata):
+    """ファイルをコピー・全体ハッシュせずに、ヘッダーとサンプルページからバージョンの指紋を作る"""
+    metadata = inspect_metadata(global_metadata)
+    elf = inspect_elf(il2cpp_so)
+    # パスは指紋に含めない（別の場所に展開しても同じ指紋になるように）
+    payload = {
+        "metadata": {key: value for key, value in metadata.items() if key != "path"},
+        "elf": {key: value for key, value in elf.items() if key != "path"},
+    }
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+    return {"fingerprint": digest, "metadata": metadata, "elf": elf}
+
+def format_changes(current, previous=None):
+    """ダンパーが失敗しそうな変化（暗号化・未対応バージョン・ヘッダー構成の変化）を警告文のリストで返す"""
+    warnings = []
+    metadata = current["metadata"]
+    if not metadata["valid_magic"]:
+        warnings.append(f"global-metadata.datのマジックが不正です（{metadata['magic']}）。暗号化されている可能性があります")
+    elif metadata["version"] not in SUPPORTED_METADATA_VERSIONS:
+        warnings.append(f"Il2CppDumperが対応していないメタデータのバージョンです: {metadata['version']}")
+    if metadata.get("out_of_range"):
+        warnings.append(f"ファイルの範囲外を指すセクションがあります: {', '.join(metadata['out_of_range'])}")
+    if previous:
+        old_metadata = previous["metadata"]
+        if old_metadata["version"] != metadata["version"]:
+            warnings.append(f"メタデータのバージョンが変わりました: {old_metadata['version']} → {metadata['version']}")
+        elif list(old_metadata.get("sections", {})) != list(metadata.get("sections", {})):
+            warnings.append("メタデータのヘッダー構成（セクション数）が変わりました")
+        if previous["elf"]["machine"] != current["elf"]["machine"]:
+            warnings.append(f"libil2cpp.soのアーキテクチャが変わりました: "
+                            f"{previous['elf']['machine']} → {current['elf']['machine']}")
+    return warnings
+
+def load_fingerprint(path=OUTPUT_DIR / FINGERPRINT_NAME):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_fingerprint(info, path=OUTPUT_DIR / FINGERPRINT_NAME):
+    path = Path(path)
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=2)
+    temp_path.replace(path)
+    return path
+
+def describe(info):
+    metadata, elf = info["metadata"], info["elf"]
+    lines = [
+        f"指紋: {info['fingerprint']}",
+        f"global-metadata.dat: バージョン {metadata['version']}、{metadata['size']}バイト、"
+        f"セクション {len(metadata['sections'])}個",
+        f"libil2cpp.so: ELF{elf['class']} {elf['machine']}、ビルドID {elf['build_id'] or 'なし'}、"
+        f"セグメント {len(elf['segments'])}個、セクション {len(elf['sections'])}個",
+    ]
+    return "\n".join(lines)
+
+def check(il2cpp_so, global_metadata, previous_path=OUTPUT_DIR / FINGERPRINT_NAME):
+    """指紋を計算して概要と警告を表示する（ヘッダーを解釈できない場合は警告してNoneを返す）"""
+    try:
+        info = fingerprint(il2cpp_so, global_metadata)
+    except InspectError as e:
+        print(f"警告: Il2Cppファイルのヘッダーを解釈できません: {e}")
+        return None
+    print(describe(info))
+    for warning in format_changes(info, load_fingerprint(previous_path)):
+        print(f"警告: {warning}")
+    return info
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="libil2cpp.soとglobal-metadata.datのヘッダーからバージョンの指紋を作る")
+    parser.add_argument("il2cpp_so", type=Path, nargs="?", default=OUTPUT_DIR / "libil2cpp.so")
+    parser.add_argument("global_metadata", type=Path, nargs="?", default=OUTPUT_DIR / "global-metadata.dat")
+    parser.add_argument("--compare", type=Path, default=None,
+                        help=f"比較する指紋ファイル（既定: {OUTPUT_DIR / FINGERPRINT_NAME}）")
+    parser.add_argument("--json", action="store_true", help="ヘッダーの内容をJSONで出力する")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        info = fingerprint(args.il2cpp_so, args.global_metadata)
+    except (OSError, InspectError) as e:
+        print(f"エラー: {e}")
+        return 1
+    if args.json:
+        print(json.dumps(info, indent=2, ensure_ascii=False))
+    else:
+        print(describe(info))
+    previous = load_fingerprint(args.compare or OUTPUT_DIR / FINGERPRINT_NAME)
+    if previous:
+        same = previous["fingerprint"] == info["fingerprint"]
+        print("前回のダンプと同じ入力です" if same else "前回のダンプから入力が変わっています")
+    for warning in format_changes(info, previous):
+        print(f"警告: {warning}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,17 +2,37 @@ import os
 import shutil
 import subprocess
 import zipfile
-import requests
 from pathlib import Path
 import sys
 
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import apk_align
+import apktool_daemon
+import cache
+import downloader
+import instrument
+import frida_dex
+import signing
+import splits
+import zip_inject
+
 TEMP_DIR = Path("../temp")
 OUTPUT_DIR = Path("../output")
 TOOLS_DIR = Path("../tools")
-FRIDA_GADGET_URL = "https://github.com/frida/frida/releases/download/16.0.19/frida-gadget-16.0.19-android-arm.so.xz"
+FRIDA_VERSION = "16.0.19"
+FRIDA_GADGET_URL_TEMPLATE = "https://github.com/frida/frida/releases/download/{version}/frida-gadget-{version}-android-{arch}.so.xz"
+# Android ABI → Frida Gadgetのアーキテクチャ名（優先度順）
+GADGET_ARCHS = {"arm64-v8a": "arm64", "armeabi-v7a": "arm", "x86_64": "x86_64", "x86": "x86"}
+DEFAULT_GADGET_ABI = "armeabi-v7a"
+INSTALL_SETS_NAME = "install_sets.json"
 
 APKTOOL_JAR_URL = "https://bitbucket.org/iBotPeaches/apktool/downloads/apktool_2.7.0.jar"
 
+@instrument.traced()
 def ensure_apktool():
     apktool_jar = TOOLS_DIR / "apktool.jar"
     apktool_script = TOOLS_DIR / "apktool.bat" if sys.platform == "win32" else TOOLS_DIR / "apktool"
@@ -23,12 +43,7 @@ def ensure_apktool():
     print("apktoolをセットアップしています...")
     TOOLS_DIR.mkdir(parents=True, exist_ok=True)
     
-    response = requests.get(APKTOOL_JAR_URL, stream=True)
-    response.raise_for_status()
-    
-    with open(apktool_jar, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
+    downloader.download_cached(APKTOOL_JAR_URL, apktool_jar)
     
     if sys.platform == "win32":
         with open(apktool_script, 'w') as f:
@@ -42,37 +57,86 @@ def ensure_apktool():
     print(f"apktoolをセットアップしました: {apktool_script}")
     return apktool_script
 
-def download_frida_gadget():
-    # 既存のコードをそのまま使用
-    print("Frida Gadgetをダウンロード中...")
-    frida_path = TEMP_DIR / "frida-gadget.so.xz"
-    
-    response = requests.get(FRIDA_GADGET_URL, stream=True)
-    response.raise_for_status()
-    
-    with open(frida_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-    
-    # XZファイルの解凍（Windowsでは外部コマンドが必要）
-    try:
-        # xzコマンドがあれば使用
-        subprocess.run(["xz", "-d", str(frida_path)], check=True)
-    except FileNotFoundError:
-        print("xzコマンドが見つかりません。Pythonで解凍を試みます...")
-        try:
-            import lzma
-            with lzma.open(frida_path, 'rb') as f_in:
-                with open(TEMP_DIR / "frida-gadget.so", 'wb') as f_out:
-                    f_out.write(f_in.read())
-        except ImportError:
-            print("lzmaモジュールがインストールされていません。")
-            print("frida-gadget.soを手動で解凍してください。")
-            sys.exit(1)
-    
-    return TEMP_DIR / "frida-gadget.so"
+def gadget_url(abi):
+    return FRIDA_GADGET_URL_TEMPLATE.format(version=FRIDA_VERSION, arch=GADGET_ARCHS[abi])
+
+@instrument.traced()
+def download_frida_gadget(abi=DEFAULT_GADGET_ABI):
+    gadget_url_for_abi = gadget_url(abi)
+    gadget_path = TEMP_DIR / f"frida-gadget-{abi}.so"
+    store = cache.get_cache()
+    gadget_key = cache.cache_key("frida-gadget", gadget_url_for_abi)
+    if store.materialize(gadget_key, gadget_path):
+        print(f"キャッシュ済みのFrida Gadgetを使用します: {gadget_path}")
+        return gadget_path
+    
+    # xzをHTTPストリームから直接展開し、展開後のSHA-256も同時に得る
+    print(f"Frida Gadget ({abi}) をダウンロード中...")
+    gadget_path, gadget_sha256 = downloader.download_decompressed(gadget_url_for_abi, gadget_path)
+    print(f"Frida Gadget ({abi}) のSHA-256: {gadget_sha256}")
+    
+    store.put(gadget_key, gadget_path, sha256=gadget_sha256)
+    return gadget_path
+
+def download_frida_gadgets(abis):
+    """ABIごとのGadgetを並列に取得し、{ABI: パス} を返す"""
+    abis = list(abis)
+    if not abis:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(abis)) as pool:
+        return dict(zip(abis, pool.map(instrument.bind(download_frida_gadget), abis)))
+
+ENGINES = ("apktool", "zip")
+
+def detect_gadget_abi(apk_path):
+    if os.path.exists(os.path.join(os.path.dirname(apk_path), "config.arm64_v8a.apk")):
+        print("ARM64アーキテクチャが検出されました")
+        return "arm64-v8a"
+    return DEFAULT_GADGET_ABI
+
+def detect_abis(split_set, device_abis=None):
+    """ABIスプリットとメインAPKのlib/から（splits.SplitSet）Gadgetが必要なABIを集める
+
+    (優先度順のABIリスト, {ABI: スプリットAPK}) を返す。device_abisを指定すると、
+    端末が使う1つのABI（アプリが対応している最初のもの）だけにする。
+    """
+    abi_splits = {abi: path for abi, path in split_set.abi_splits().items() if abi in GADGET_ARCHS}
+    abis = [abi for abi in GADGET_ARCHS if abi in split_set.supported_abis()] or [DEFAULT_GADGET_ABI]
+    if device_abis:
+        abi = splits.choose_abi(device_abis, abis)
+        abis, abi_splits = [abi], {k: v for k, v in abi_splits.items() if k == abi}
+    return abis, abi_splits
+
+def _default_gadgets(apk_path, gadgets):
+    if gadgets is None:
+        abi = detect_gadget_abi(apk_path)
+        gadgets = {abi: download_frida_gadget(abi)}
+    return gadgets
+
+@instrument.traced()
+def inject_with_zip(apk_path, modified_apk=None, gadgets=None):
+    """apktoolを使わずにZIPレベルでインジェクトする"""
+    modified_apk = modified_apk or OUTPUT_DIR / "injected.apk"
+    return zip_inject.inject_frida_gadget_zip(apk_path, _default_gadgets(apk_path, gadgets), modified_apk)
 
-def inject_frida_gadget(apk_path):
+@instrument.traced()
+def inject_split_gadgets(abi_splits, gadgets):
+    """ABIスプリットAPKに対応するGadgetだけを追加する（マニフェストはメインAPK側で書き換え済み）"""
+    injected = {}
+    for abi, split_apk in abi_splits.items():
+        output_path = OUTPUT_DIR / f"injected-{os.path.basename(split_apk)}"
+        injected[split_apk] = zip_inject.inject_frida_gadget_zip(
+            split_apk, {abi: gadgets[abi]}, output_path, patch_manifest=False)
+    return injected
+
+def inject_frida_gadget(apk_path, engine="apktool", gadgets=None):
+    """メインAPKにGadgetを追加する（署名はスプリットAPKとまとめてsign_outputsで行う）"""
+    if engine == "zip":
+        return inject_with_zip(apk_path, gadgets=gadgets)
+    return inject_with_apktool(apk_path, gadgets=gadgets)
+
+@instrument.traced()
+def inject_with_apktool(apk_path, modified_apk=None, gadgets=None):
     print(f"APKにFrida Gadgetをインジェクト中: {apk_path}")
     
     # apktoolを取得
@@ -89,35 +153,34 @@ def inject_frida_gadget(apk_path):
     
     print("APKの逆コンパイルを開始します（リソーススキップモード）...")
     try:
-        subprocess.run([
-            str(apktool), "d", str(apk_path), 
+        apktool_daemon.run(apktool, [
+            "d", str(apk_path), 
             "-o", str(work_dir), 
             "-f",  # 強制上書き
             "--no-res",  # リソースをデコードしない
             "--no-src",  # ソースコードをデコードしない(必要に応じて削除)
             "-r"   # リソースをデコードしない(古いバージョン互換)
-        ], check=True)
+        ], name="apktool d (標準モード)", check=True)
     except subprocess.CalledProcessError:
         print("警告: 標準モードでの解析に失敗しました。代替モードを試行します...")
         try:
-            subprocess.run([
-                str(apktool), "d", str(apk_path), 
+            apktool_daemon.run(apktool, [
+                "d", str(apk_path), 
                 "-o", str(work_dir), 
                 "-f",
                 "--no-res"
-            ], check=True)
+            ], name="apktool d (代替モード)", check=True)
         except subprocess.CalledProcessError:
             print("警告: 代替モードでも失敗しました。最終モードを試行します...")
-            subprocess.run([
-                str(apktool), "d", str(apk_path), 
+            apktool_daemon.run(apktool, [
+                "d", str(apk_path), 
                 "-o", str(work_dir), 
                 "-f",
                 "--no-res",
                 "--only-main-classes"
-            ], check=True)
+            ], name="apktool d (最終モード)", check=True)
     
     manifest_path = work_dir / "AndroidManifest.xml"
-    smali_dir = work_dir / "smali"
     
     if not manifest_path.exists():
         print("警告: AndroidManifest.xmlが見つかりません。ZIPとして抽出を試みます...")
@@ -127,231 +190,205 @@ def inject_frida_gadget(apk_path):
             except KeyError:
                 raise FileNotFoundError("AndroidManifest.xmlをAPKから抽出できませんでした")
     
-    if not smali_dir.exists():
-        smali_dir.mkdir(parents=True, exist_ok=True)
-    
-    frida_gadget = download_frida_gadget()
-    
-    if os.path.exists(os.path.join(os.path.dirname(apk_path), "config.arm64_v8a.apk")):
-        print("ARM64アーキテクチャが検出されました")
-        lib_dir = work_dir / "lib" / "arm64-v8a"
-    else:
-        lib_dir = work_dir / "lib" / "armeabi-v7a"
-    
-    lib_dir.mkdir(parents=True, exist_ok=True)
-    shutil.copy(frida_gadget, lib_dir / "libfrida-gadget.so")
-    
-    try:
-        with open(manifest_path, "r", encoding="utf-8") as f:
-            manifest = f.read()
-    except UnicodeDecodeError:
-        try:
-            with open(manifest_path, "r", encoding="latin-1") as f:
-                manifest = f.read()
-        except Exception as e:
-            print(f"マニフェストの読み取りエラー: {e}")
-            print("バイナリ形式のマニフェストを処理中...")
-            manifest = """<?xml version="1.0" encoding="utf-8"?>
-<manifest xmlns:android="http://schemas.android.com/apk/res/android">
-    <application android:name="io.frida.FridaApplication">
-    </application>
-</manifest>"""
+    for abi, frida_gadget in _default_gadgets(apk_path, gadgets).items():
+        lib_dir = work_dir / "lib" / abi
+        lib_dir.mkdir(parents=True, exist_ok=True)
+        cache.link_or_copy(frida_gadget, lib_dir / "libfrida-gadget.so")
+    
+    manifest = manifest_path.read_bytes()
+    if manifest.lstrip().startswith(b"<"):
+        # リソースをデコードした場合のテキスト形式マニフェスト
+        manifest = manifest.decode("utf-8")
+        if '<application ' in manifest and 'android:name="io.frida.FridaApplication"' not in manifest:
+            manifest = manifest.replace(
+                '<application ',
+                '<application android:name="io.frida.FridaApplication" '
+            )
             with open(manifest_path, "w", encoding="utf-8") as f:
                 f.write(manifest)
-    
-    # アプリケーションタグを検索して修正（より堅牢に）
-    if '<application ' in manifest and 'android:name="io.frida.FridaApplication"' not in manifest:
-        manifest = manifest.replace(
-            '<application ',
-            '<application android:name="io.frida.FridaApplication" '
-        )
-        with open(manifest_path, "w", encoding="utf-8") as f:
-            f.write(manifest)
+        else:
+            print("マニフェスト内の<application>タグの修正をスキップします")
+        dex = frida_dex.build_frida_application_dex()
     else:
-        print("マニフェスト内の<application>タグの修正をスキップします")
-    
-    # FridaApplicationクラスを作成
-    java_dir = work_dir / "smali" / "io" / "frida"
-    java_dir.mkdir(parents=True, exist_ok=True)
-    
-    frida_app_path = java_dir / "FridaApplication.smali"
-    with open(frida_app_path, "w") as f:
-        f.write("""
-.class public Lio/frida/FridaApplication;
-.super Landroid/app/Application;
-.source "FridaApplication.java"
-
-# direct methods
-.method public constructor <init>()V
-    .locals 0
-    
-    .line 1
-    invoke-direct {p0}, Landroid/app/Application;-><init>()V
-    
-    return-void
-.end method
-
-# virtual methods
-.method public attachBaseContext(Landroid/content/Context;)V
-    .locals 2
-    .param p1, "base"    # Landroid/content/Context;
+        # --no-resではマニフェストがバイナリAXMLのまま残るため、そのまま書き換える
+        # （解析できない場合はスタブで上書きせずにエラーにする）
+        patched_manifest, dex = zip_inject.patch_manifest_for_gadget(manifest)
+        manifest_path.write_bytes(patched_manifest)
     
-    .line 5
-    invoke-super {p0, p1}, Landroid/app/Application;->attachBaseContext(Landroid/content/Context;)V
-    
-    .line 6
-    const-string v0, "frida-gadget"
-    
-    invoke-static {v0}, Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V
-    
-    .line 7
-    return-void
-.end method
-""")
+    # FridaApplicationクラスは追加のclassesN.dexとして配置する
+    # （apktoolはルートのclasses.dexがあるとsmali/を無視するため、smaliでは取り込まれない）
+    with zipfile.ZipFile(apk_path, 'r') as zip_ref:
+        dex_name = zip_inject.next_dex_name(zip_ref.namelist())
+    (work_dir / dex_name).write_bytes(dex)
     
     print("APKの再パッケージ化を開始します...")
     # APKを再構築（エラー処理を強化）
-    modified_apk = OUTPUT_DIR / "injected.apk"
+    modified_apk = modified_apk or OUTPUT_DIR / "injected.apk"
     try:
-        subprocess.run([str(apktool), "b", str(work_dir), "-o", str(modified_apk), "--use-aapt2"], check=True)
+        apktool_daemon.run(apktool, ["b", str(work_dir), "-o", str(modified_apk), "--use-aapt2"],
+                           name="apktool b (AAPT2)", check=True)
     except subprocess.CalledProcessError:
         print("警告: AAPT2での再構築に失敗しました。標準AAPTで再試行します...")
         try:
-            subprocess.run([str(apktool), "b", str(work_dir), "-o", str(modified_apk)], check=True)
+            apktool_daemon.run(apktool, ["b", str(work_dir), "-o", str(modified_apk)],
+                               name="apktool b (AAPT)", check=True)
         except subprocess.CalledProcessError:
             print("エラー: APKの再パッケージ化に失敗しました。手動での確認が必要です。")
-            shutil.copy(apk_path, modified_apk)
+            cache.link_or_copy(apk_path, modified_apk)
             print(f"元のAPKを {modified_apk} にコピーしました。")
     
-    keystore = OUTPUT_DIR / "debug.keystore"
-    if not keystore.exists():
-        try:
-            print("デバッグ用キーストアを生成しています...")
-            subprocess.run([
-                "keytool", "-genkey", "-v", "-keystore", str(keystore),
-                "-storepass", "android", "-alias", "androiddebugkey",
-                "-keypass", "android", "-keyalg", "RSA", "-keysize", "2048",
-                "-validity", "10000", "-dname", "CN=Android Debug,O=Android,C=US"
-            ], check=True)
-        except FileNotFoundError:
-            print("keytoolが見つかりません。署名をスキップします。")
-            return modified_apk
-    
-    try:
-        signed_apk = OUTPUT_DIR / "injected-signed.apk"
-        subprocess.run([
-            "jarsigner", "-sigalg", "SHA1withRSA", "-digestalg", "SHA1",
-            "-keystore", str(keystore), "-storepass", "android",
-            "-keypass", "android", str(modified_apk), "androiddebugkey"
-        ], check=True)
-        
-        shutil.move(modified_apk, signed_apk)
-        
-        print(f"インジェクト済みAPKが生成されました: {signed_apk}")
-        return signed_apk
-    except FileNotFoundError:
-        print("jarsignerが見つかりません。署名されていないAPKを使用します。")
-        print(f"未署名APKが生成されました: {modified_apk}")
-        return modified_apk
+    return modified_apk
 
-def sign_apk(apk_path, output_name=None):
-    """APKファイルに署名する共通関数"""
-    if output_name is None:
-        output_path = OUTPUT_DIR / f"signed-{os.path.basename(apk_path)}"
-    else:
-        output_path = OUTPUT_DIR / output_name
-    
-    print(f"APKに署名中: {apk_path} -> {output_path}")
-    
-    # 入力と出力が同じファイルの場合は一時ファイルを使用
-    same_file = os.path.abspath(apk_path) == os.path.abspath(output_path)
-    if same_file:
-        temp_output = OUTPUT_DIR / f"temp_{os.path.basename(apk_path)}"
-    else:
-        temp_output = output_path
-    
-    # キーストアの確認と生成
-    keystore = OUTPUT_DIR / "debug.keystore"
-    if not keystore.exists():
+def benchmark_injection(apk_path, output_path=None):
+    """apktool経由とZIP直接モードのインジェクト時間を比較する"""
+    results = {}
+    for engine in ENGINES:
+        modified_apk = OUTPUT_DIR / f"benchmark-{engine}.apk"
+        started = time.perf_counter()
         try:
-            print("デバッグ用キーストアを生成しています...")
-            subprocess.run([
-                "keytool", "-genkey", "-v", "-keystore", str(keystore),
-                "-storepass", "android", "-alias", "androiddebugkey",
-                "-keypass", "android", "-keyalg", "RSA", "-keysize", "2048",
-                "-validity", "10000", "-dname", "CN=Android Debug,O=Android,C=US"
-            ], check=True)
-        except FileNotFoundError:
-            print("keytoolが見つかりません。署名をスキップします。")
-            if not same_file:
-                shutil.copy(apk_path, output_path)
-            return output_path
+            if engine == "zip":
+                inject_with_zip(apk_path, modified_apk)
+            else:
+                inject_with_apktool(apk_path, modified_apk)
+        except (subprocess.CalledProcessError, FileNotFoundError, OSError, ValueError) as e:
+            print(f"警告: {engine}モードのベンチマークに失敗しました: {e}")
+            results[engine] = {"error": str(e)}
+            continue
+        results[engine] = {
+            "seconds": time.perf_counter() - started,
+            "output_bytes": os.path.getsize(modified_apk),
+        }
+    
+    print("\nインジェクトのベンチマーク結果:")
+    for engine, result in results.items():
+        if "error" in result:
+            print(f"  {engine:8s}: 失敗 ({result['error']})")
+        else:
+            print(f"  {engine:8s}: {result['seconds']:.2f}秒 ({result['output_bytes']}バイト)")
+    if "seconds" in results.get("apktool", {}) and "seconds" in results.get("zip", {}):
+        print(f"  ZIP直接モードは約{results['apktool']['seconds'] / max(results['zip']['seconds'], 1e-6):.1f}倍高速です")
+    
+    output_path = output_path or OUTPUT_DIR / "injection_benchmark.json"
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({"apk": str(apk_path), "results": results}, f, indent=2)
+    return results
 
-    try:
-        # より安全なアルゴリズムを使用（SHA-256/SHA-384/SHA-512）
-        print("APKに署名を適用しています...")
-        subprocess.run([
-            "jarsigner", "-sigalg", "SHA256withRSA", "-digestalg", "SHA-256",
-            "-keystore", str(keystore), "-storepass", "android",
-            "-keypass", "android", str(apk_path), "androiddebugkey"
-        ], check=True, encoding='utf-8')  # UTF-8エンコーディングを指定
-        
-        # 入力と出力が同じ場合は操作不要、それ以外はコピー
-        if not same_file:
-            shutil.copy(apk_path, output_path)
-        
-        print(f"署名が完了しました: {output_path}")
-        return output_path
-    except FileNotFoundError:
-        print("jarsignerが見つかりません。署名されていないAPKを使用します。")
-        if not same_file:
-            shutil.copy(apk_path, output_path)
-        return output_path
+def write_install_sets(main_apk, split_apks, abis, output_path=None):
+    """ABIごとにインストールするAPKの組み合わせ（メイン + そのABIのスプリット + 共通スプリット）を書き出す
 
-def main():
-    xapk_extracted = TEMP_DIR / "xapk_extracted"
-    
-    manifest_path = xapk_extracted / "manifest.json"
-    if manifest_path.exists():
-        print("XAPKマニフェストを確認中...")
-    
-    # 複数のconfig APKに対応するためリスト形式に変更
-    main_apk = None
-    config_apks = []
-    
-    for root, dirs, files in os.walk(xapk_extracted):
-        for file in files:
-            if file.endswith('.apk'):
-                apk_path = os.path.join(root, file)
-                if 'config' in file.lower():
-                    config_apks.append(apk_path)
-                else:
-                    main_apk = apk_path
-    
-    if not main_apk:
-        raise FileNotFoundError("メインAPKファイルが見つかりませんでした")
-    
-    print(f"メインAPK: {main_apk}")
-    if config_apks:
-        print(f"設定APK: {', '.join(config_apks)}")
-    
-    injected_main_apk = inject_frida_gadget(main_apk)
-    
-    signed_config_apks = []
+    split_apksは (スプリットのABI（ABIスプリット以外はNone）, 署名済みAPK) のリスト。
+    """
+    install_sets = {}
+    for abi in abis:
+        apks = [str(main_apk)]
+        apks += [str(path) for split_abi, path in split_apks if split_abi in (abi, None)]
+        command = "adb install-multiple " if len(apks) > 1 else "adb install "
+        install_sets[abi] = {"apks": apks, "command": command + " ".join(apks)}
+    
+    output_path = output_path or OUTPUT_DIR / INSTALL_SETS_NAME
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({"frida_version": FRIDA_VERSION, "install_sets": install_sets}, f, indent=2)
+    return install_sets
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="APKにFrida Gadgetをインジェクトして署名する")
+    parser.add_argument("--sign-backend", choices=signing.BACKENDS, default=signing.DEFAULT_BACKEND,
+                        help="署名方法（python: JVMを起動せずにv2/v3署名、cryptographyパッケージが必要）")
+    parser.add_argument("--engine", choices=ENGINES, default="apktool",
+                        help="インジェクト方法（zip: apktoolを使わずにZIPエントリを直接コピー）")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="apktool経由とZIP直接モードのインジェクト時間を比較して終了する")
+    parser.add_argument("--sign-workers", type=int, default=None,
+                        help="並列に署名するプロセス数（既定: CPUコア数）")
+    splits.add_device_arguments(parser)
+    return parser.parse_args(argv)
+
+def find_apks(xapk_extracted=TEMP_DIR / "xapk_extracted", device=None):
+    """展開済みXAPKの manifest.json からメインAPKとスプリットAPKの組（splits.SplitSet）を返す
+
+    deviceを指定すると、対象端末に必要なスプリットだけにする（splits.SplitSet.select）。
+    """
+    split_set = splits.load(xapk_extracted, device)
+    print(f"メインAPK: {split_set.base.path}")
+    if split_set.splits:
+        print(f"スプリットAPK（{split_set.describe()}）: {', '.join(split_set.paths())}")
+    return split_set
+
+@instrument.traced()
+def inject_apks(main_apk, gadgets, abi_splits, engine="apktool"):
+    """ABIスプリットがあるABIはスプリット側にGadgetを置き、それ以外はメインAPKに置く"""
+    main_gadgets = {abi: path for abi, path in gadgets.items() if abi not in abi_splits}
+    modified_apk = inject_frida_gadget(main_apk, engine=engine, gadgets=main_gadgets)
+    injected_splits = inject_split_gadgets(abi_splits, gadgets)
+    return modified_apk, injected_splits
+
+@instrument.traced()
+def align_outputs(modified_apk, config_apks, injected_splits):
+    """署名の前に、ネイティブライブラリを無圧縮・16KiB境界、その他の無圧縮エントリを4バイト境界に揃える
+
+    extractNativeLibs="false" はインストールするすべてのAPKに効くため、書き換えていないスプリットも検証し、
+    違反があるもの（Gadget対象外のABIスプリットや.soを含む機能モジュールなど）だけを書き直す。
+    (メインAPK, {スプリットAPK: 署名に使うAPK}) を返す。
+    """
+    aligned_main = apk_align.ensure_aligned(modified_apk, OUTPUT_DIR / f"aligned-{os.path.basename(modified_apk)}")
+    aligned_splits = {}
+    for config_apk in config_apks:
+        aligned_splits[config_apk] = apk_align.ensure_aligned(
+            injected_splits.get(config_apk, config_apk), OUTPUT_DIR / f"aligned-{os.path.basename(config_apk)}")
+    return aligned_main, aligned_splits
+
+@instrument.traced()
+def sign_outputs(modified_apk, config_apks, injected_splits, abis, split_abis=None,
+                 backend=signing.DEFAULT_BACKEND, workers=None):
+    """メインAPKとスプリットAPKを同じキーでまとめて並列に署名し、ABIごとのインストールセットを書き出す
+
+    書き換えていないスプリット（密度・言語・アセットパックなど）は署名だけを行い、署名済みの出力を
+    キャッシュして次回以降はそのまま使う。split_abisは元のスプリットAPK → ABI（splits.SplitSet.split_abis）。
+    """
+    split_abis = split_abis or {}
     if config_apks:
         print("\nスプリットAPKにも同じキーで署名します...")
-        for config_apk in config_apks:
-            config_name = os.path.basename(config_apk)
-            # 一時コピーを作成してから署名
-            temp_config = OUTPUT_DIR / config_name
-            shutil.copy(config_apk, temp_config)
-            signed_config_apk = sign_apk(temp_config, f"signed-{config_name}")
-            signed_config_apks.append(signed_config_apk)
+    # 署名は出力先へのコピーに対して行い、インジェクト結果（未署名）は残しておく
+    injected_main_apk = OUTPUT_DIR / "injected-signed.apk"
+    jobs = [(modified_apk, injected_main_apk)]
+    unchanged = []
+    for config_apk in config_apks:
+        source = injected_splits.get(config_apk, config_apk)
+        jobs.append((source, OUTPUT_DIR / f"signed-{os.path.basename(config_apk)}"))
+        if os.path.abspath(source) == os.path.abspath(config_apk):
+            unchanged.append(source)
+    signed = signing.sign_apks(jobs, backend=backend, workers=workers, reusable=unchanged)
+    print(f"インジェクト済みAPKが生成されました: {injected_main_apk}")
+    
+    install_sets = write_install_sets(
+        injected_main_apk, [(split_abis.get(src), dest) for src, dest in zip(config_apks, signed[1:])], abis)
+    print("\nABIごとのインストールコマンド:")
+    for abi, install_set in install_sets.items():
+        print(f"  [{abi}] {install_set['command']}")
+    print(f"インストールセットを保存しました: {OUTPUT_DIR / INSTALL_SETS_NAME}")
+    return injected_main_apk, signed[1:]
+
+def main(argv=None):
+    args = parse_args(argv)
+    device = splits.device_from_args(args)
+    split_set = find_apks(device=device)
+    main_apk, config_apks = split_set.base.path, split_set.paths()
+    
+    if args.benchmark:
+        benchmark_injection(main_apk)
+        return
     
-    if signed_config_apks:
-        config_paths = " ".join([str(p) for p in signed_config_apks])
-        print("\nインストール時は両方のAPKを指定してください:")
-        print(f"adb install-multiple {injected_main_apk} {config_paths}")
+    try:
+        abis, abi_splits = detect_abis(split_set, device and device["abis"])
+        print(f"対象ABI: {', '.join(abis)}")
+        gadgets = download_frida_gadgets(abis)
+        
+        modified_apk, injected_splits = inject_apks(main_apk, gadgets, abi_splits, engine=args.engine)
+        modified_apk, injected_splits = align_outputs(modified_apk, config_apks, injected_splits)
+        sign_outputs(modified_apk, config_apks, injected_splits, abis, split_set.split_abis(),
+                     backend=args.sign_backend, workers=args.sign_workers)
+    finally:
+        instrument.save("inject_frida")
     
     print("\n処理が完了しました！")
     
@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import functools
+import subprocess
+import contextvars
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+OUTPUT_DIR = Path("../output")
+REPORTS_DIR = OUTPUT_DIR / "reports"
+# 前回より何倍遅くなったら警告するか（compareコマンド）
+DEFAULT_THRESHOLD = 1.5
+# これより短いステップは比較対象にしない（誤検知を避ける）
+MIN_COMPARE_SECONDS = 0.5
+
+def _peak_rss(who):
+    """最大常駐メモリ（バイト）。Linuxはキロバイト、Macはバイト単位で返る"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class Recorder:
+    """ステップ（スパン）ごとの時間・CPU・I/O・メモリ・サブプロセスを記録する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 実行中のスパン（外側から順）。ワーカースレッドへはbind()で引き継ぐ
+        self._active = contextvars.ContextVar(f"instrument_spans_{id(self)}", default=())
+        self.reset()
+
+    def reset(self):
+        """記録を消して計測を始め直す（同じプロセスで複数のビルドを順に処理する場合など）"""
+        with self._lock:
+            self.started = time.perf_counter()
+            self.started_at = time.time()
+            self.records = []
+            self.counters = {}
+
+    def _stack(self):
+        return self._active.get()
+
+    def count(self, key, value):
+        """プロセス全体のカウンターと、呼び出し元で実行中のスパン（外側のスパンを含む）に加算する
+
+        並行して動いている他のスパンの分は含まれない。
+        """
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            for active in self._stack():
+                active.counters[key] = active.counters.get(key, 0) + value
+
+    def add(self, key, value):
+        """呼び出し元で実行中のスパンに値を加算する"""
+        stack = self._stack()
+        if stack:
+            stack[-1].add(key, value)
+
+    def bind(self, func):
+        """スレッドプールなどで実行する関数に、呼び出し元で実行中のスパンを引き継ぐ"""
+        spans = self._stack()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = self._active.set(spans)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._active.reset(token)
+        return wrapper
+
+    def _append(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def span(self, name, category="step", **attrs):
+        return _Span(self, name, category, attrs)
+
+    def run(self, command, name=None, **kwargs):
+        """subprocess.runと同じ引数で実行し、所要時間と終了コードを記録する"""
+        name = name or Path(str(command[0])).name
+        started = time.perf_counter()
+        children_cpu_started = children_cpu()
+        exit_code = None
+        try:
+            result = subprocess.run(command, **kwargs)
+            exit_code = result.returncode
+            return result
+        except subprocess.CalledProcessError as e:
+            exit_code = e.returncode
+            raise
+        except FileNotFoundError:
+            exit_code = 127
+            raise
+        finally:
+            self.record_subprocess(name, command, started, exit_code, children_cpu_started)
+
+    def record_subprocess(self, name, command, started, exit_code, children_cpu_started=None, ended=None):
+        """Popenなどで実行したサブプロセスを記録する（started・endedはperf_counterの値、endedの既定は現在）"""
+        ended = time.perf_counter() if ended is None else ended
+        stack = self._stack()
+        self._append({
+            "name": name,
+            "category": "subprocess",
+            "thread": threading.current_thread().name,
+            "parent": stack[-1].record["name"] if stack else None,
+            "start": started - self.started,
+            "wall_seconds": ended - started,
+            "cpu_seconds": children_cpu() - children_cpu_started if children_cpu_started is not None else None,
+            "children_peak_rss": _peak_rss(resource.RUSAGE_CHILDREN) if resource else None,
+            "exit_code": exit_code,
+            "status": "ok" if exit_code == 0 else "error",
+            "attrs": {"command": [str(c) for c in command]},
+        })
+
+    def summary(self):
+        """同じ名前のステップを合計した表（実行間の比較に使う）"""
+        steps = {}
+        for record in self.records:
+            step = steps.setdefault(record["name"], {"category": record["category"], "count": 0,
+                                                    "wall_seconds": 0.0, "errors": 0})
+            step["count"] += 1
+            step["wall_seconds"] += record["wall_seconds"]
+            step["errors"] += record["status"] != "ok"
+            for key in ("bytes_downloaded", "bytes_written"):
+                value = record["attrs"].get(key) or record.get("counters", {}).get(key)
+                if value:
+                    step[key] = step.get(key, 0) + value
+        return steps
+
+    def report(self, name):
+        with self._lock:
+            records = list(self.records)
+            counters = dict(self.counters)
+        return {
+            "name": name,
+            "started_at": self.started_at,
+            "wall_seconds": time.perf_counter() - self.started,
+            "cpu_seconds": time.process_time(),
+            "peak_rss": _peak_rss(resource.RUSAGE_SELF) if resource else None,
+            "children_peak_rss": _peak_rss(resource.RUSAGE_CHILDREN) if resource else None,
+            "counters": counters,
+            "steps": self.summary(),
+            "records": records,
+        }
+
+    def chrome_trace(self):
+        """chrome://tracing / Perfettoで開けるトレース形式"""
+        threads = {}
+        events = []
+        for record in self.records:
+            tid = threads.setdefault(record["thread"], len(threads) + 1)
+            args = dict(record["attrs"])
+            for key in ("cpu_seconds", "peak_rss", "exit_code", "counters"):
+                if record.get(key) is not None:
+                    args[key] = record[key]
+            events.append({"name": record["name"], "cat": record["category"], "ph": "X",
+                           "ts": int(record["start"] * 1e6), "dur": int(record["wall_seconds"] * 1e6),
+                           "pid": os.getpid(), "tid": tid, "args": args})
+        for thread_name, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                           "args": {"name": thread_name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, name, output_dir=REPORTS_DIR):
+        """<name>.json（集計付きレポート）と <name>.trace.json（Chromeトレース）を書き出す"""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        report_path = output_dir / f"{name}.json"
+        trace_path = output_dir / f"{name}.trace.json"
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(name), f, indent=2, ensure_ascii=False)
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+        print(f"実行レポートを保存しました: {report_path}（トレース: {trace_path}）")
+        return report_path, trace_path
+
+class _Span:
+    def __init__(self, recorder, name, category, attrs):
+        self.recorder = recorder
+        self.record = {"name": name, "category": category, "attrs": dict(attrs)}
+        self.counters = {}
+
+    def __enter__(self):
+        recorder = self.recorder
+        stack = recorder._stack()
+        self.record["parent"] = stack[-1].record["name"] if stack else None
+        self.record["thread"] = threading.current_thread().name
+        self._cpu = time.process_time()
+        self._thread_cpu = time.thread_time()
+        self._started = time.perf_counter()
+        self._token = recorder._active.set(stack + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        recorder = self.recorder
+        ended = time.perf_counter()
+        recorder._active.reset(self._token)
+        with recorder._lock:
+            counters = dict(self.counters)
+        self.record.update({
+            "start": self._started - recorder.started,
+            "wall_seconds": ended - self._started,
+            # 同時に動いている他のスレッドの分も含むプロセス全体のCPU時間
+            "cpu_seconds": time.process_time() - self._cpu,
+            "thread_cpu_seconds": time.thread_time() - self._thread_cpu,
+            "peak_rss": _peak_rss(resource.RUSAGE_SELF) if resource else None,
+            "counters": counters,
+            "status": "ok" if exc_type is None else "error",
+        })
+        if exc is not None:
+            self.record["attrs"]["error"] = f"{exc_type.__name__}: {exc}"
+        recorder._append(self.record)
+        return False
+
+    def add(self, key, value):
+        attrs = self.record["attrs"]
+        attrs[key] = attrs.get(key, 0) + value
+
+recorder = Recorder()
+span = recorder.span
+count = recorder.count
+add = recorder.add
+bind = recorder.bind
+run = recorder.run
+record_subprocess = recorder.record_subprocess
+save = recorder.save
+reset = recorder.reset
+
+def traced(name=None, category="step"):
+    """関数全体をスパンとして記録するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with recorder.span(name or func.__name__, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def compare(old_report, new_report, threshold=DEFAULT_THRESHOLD, min_seconds=MIN_COMPARE_SECONDS):
+    """2つのレポートのステップ別合計時間を比べ、threshold倍以上遅くなったステップを返す"""
+    old_steps = old_report.get("steps", {})
+    regressions = []
+    for name, step in new_report.get("steps", {}).items():
+        old = old_steps.get(name)
+        if old is None or step["wall_seconds"] < min_seconds:
+            continue
+        ratio = step["wall_seconds"] / max(old["wall_seconds"], 1e-6)
+        if ratio >= threshold:
+            regressions.append({"step": name, "old_seconds": old["wall_seconds"],
+                                "new_seconds": step["wall_seconds"], "ratio": ratio})
+    return sorted(regressions, key=lambda r: -r["ratio"])
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="実行レポートの比較（遅くなったステップがあれば終了コード1）")
+    parser.add_argument("old_report", type=Path)
+    parser.add_argument("new_report", type=Path)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--min-seconds", type=float, default=MIN_COMPARE_SECONDS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.old_report, 'r', encoding='utf-8') as f:
+        old_report = json.load(f)
+    with open(args.new_report, 'r', encoding='utf-8') as f:
+        new_report = json.load(f)
+    regressions = compare(old_report, new_report, args.threshold, args.min_seconds)
+    if not regressions:
+        print("遅くなったステップはありません")
+        return 0
+    print(f"{args.threshold}倍以上遅くなったステップ:")
+    for r in regressions:
+        print(f"  {r['step']}: {r['old_seconds']:.2f}秒 → {r['new_seconds']:.2f}秒（{r['ratio']:.1f}倍）")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+import os
+import abc
+import sys
+import mmap
+import math
+import struct
+import argparse
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import il2cpp_inspect
+import instrument
+
+OUTPUT_DIR = Path("../output")
+# 復号前の元ファイルの退避先（global-metadata.dat → global-metadata.encrypted.dat）
+ENCRYPTED_SUFFIX = ".encrypted"
+CHUNK_SIZE = 4 * 1024 * 1024
+# エントロピーの計算に使うサンプル（ファイル全体は読まない）
+ENTROPY_SAMPLE_PAGES = 16
+ENTROPY_SAMPLE_SIZE = 64 * 1024
+# 識別子が並ぶ文字列セクションは平文なら5bit/byte前後、暗号化されていれば8bit/byteに近づく
+MAX_STRING_ENTROPY = 6.5
+MAX_FILE_ENTROPY = 7.9
+STRING_SECTION = "string"
+STRING_SECTION_INDEX = 2
+
+class MetadataError(ValueError):
+    pass
+
+def entropy(data):
+    """バイト列のシャノンエントロピー（bit/byte）"""
+    if not len(data):
+        return 0.0
+    if np is not None:
+        counts = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+        p = counts[counts > 0] / len(data)
+        return float(-(p * np.log2(p)).sum())
+    data = bytes(data)
+    total = len(data)
+    return -sum(c / total * math.log2(c / total) for c in (data.count(bytes([i])) for i in range(256)) if c)
+
+def _sample_entropy(view, start, length, pages=ENTROPY_SAMPLE_PAGES, size=ENTROPY_SAMPLE_SIZE):
+    """[start, start+length) から等間隔に取ったページのエントロピー"""
+    length = max(0, min(length, len(view) - start))
+    if length <= pages * size:
+        return entropy(view[start:start + length])
+    step = (length - size) // (pages - 1)
+    return entropy(b"".join(view[start + i * step:start + i * step + size] for i in range(pages)))
+
+def _string_section(header):
+    sections = header.get("sections") or {}
+    if STRING_SECTION in sections:
+        return sections[STRING_SECTION]
+    values = list(sections.values())
+    return values[STRING_SECTION_INDEX] if len(values) > STRING_SECTION_INDEX else None
+
+def check_header(data, file_size):
+    """ヘッダーのみの検証。(問題点のリスト, ヘッダー情報) を返す"""
+    try:
+        header = il2cpp_inspect.parse_metadata_header(data, file_size)
+    except il2cpp_inspect.InspectError as e:
+        return [str(e)], None
+    problems = []
+    if not header["valid_magic"]:
+        problems.append(f"マジックが不正です（{header['magic']}）")
+    elif header["version"] not in il2cpp_inspect.SUPPORTED_METADATA_VERSIONS:
+        problems.append(f"未対応のバージョンです: {header['version']}")
+    if header.get("out_of_range"):
+        problems.append(f"ファイルの範囲外を指すセクションがあります: {', '.join(header['out_of_range'])}")
+    return problems, header
+
+def validate(path):
+    """mmapでヘッダーとエントロピーを確認し、{"ok", "problems", "header", "entropy", "string_entropy"} を返す"""
+    path = Path(path)
+    size = path.stat().st_size
+    if size == 0:
+        return {"ok": False, "problems": ["空のファイルです"], "header": None, "entropy": 0.0, "string_entropy": None}
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            problems, header = check_header(view[:il2cpp_inspect.MAX_METADATA_HEADER_SIZE], size)
+            file_entropy = _sample_entropy(view, 0, size)
+            string_entropy = None
+            section = _string_section(header) if header and not problems else None
+            if section and section["size"]:
+                string_entropy = _sample_entropy(view, section["offset"], section["size"])
+        finally:
+            view.release()
+    if file_entropy > MAX_FILE_ENTROPY:
+        problems.append(f"ファイル全体のエントロピーが高すぎます（{file_entropy:.2f}bit/byte）")
+    if string_entropy is not None and string_entropy > MAX_STRING_ENTROPY:
+        problems.append(f"文字列セクションのエントロピーが高すぎます（{string_entropy:.2f}bit/byte）。本体が暗号化されている可能性があります")
+    return {"ok": not problems, "problems": problems, "header": header,
+            "entropy": file_entropy, "string_entropy": string_entropy}
+
+# ---- 復号プラグイン ----
+
+class Decryptor(abc.ABC):
+    """復号プラグインの基底クラス
+
+    detectは暗号化されたメタデータの先頭（bytes）・ファイルサイズ・libil2cpp.soのmmap（なければNone）を受け取り、
+    ヘッダーを復号できるパラメータの候補を返す。decrypt_chunkはファイル先頭からoffsetの位置にあるチャンクを復号する。
+    decrypt_chunkを実装していないプラグインはインスタンス化（登録）の時点でTypeErrorになる。
+    """
+
+    name = None
+
+    def detect(self, head, file_size, il2cpp_so):
+        return []
+
+    @abc.abstractmethod
+    def decrypt_chunk(self, chunk, offset, params):
+        """チャンクを復号したbytesを返す"""
+
+DECRYPTORS = []
+
+def register_decryptor(decryptor):
+    """復号プラグインのインスタンスを登録する（先に登録したものから試す）"""
+    if not isinstance(decryptor, Decryptor):
+        raise TypeError(f"復号プラグインはDecryptorを継承したクラスのインスタンスで登録してください: {decryptor!r}")
+    DECRYPTORS.append(decryptor)
+    return decryptor
+
+def _xor(chunk, key, offset):
+    """繰り返し鍵とのXOR。numpyがあればベクトル化、なければ多倍長整数で一括計算する"""
+    phase = offset % len(key)
+    key = key[phase:] + key[:phase]
+    if np is not None:
+        data = np.frombuffer(chunk, dtype=np.uint8)
+        return np.bitwise_xor(data, np.resize(np.frombuffer(key, dtype=np.uint8), len(data))).tobytes()
+    keystream = (key * (len(chunk) // len(key) + 1))[:len(chunk)]
+    return (int.from_bytes(chunk, "little") ^ int.from_bytes(keystream, "little")).to_bytes(len(chunk), "little")
+
+class XorDecryptor(Decryptor):
+    """繰り返し鍵のXOR
+
+    鍵の先頭4バイトはマジックとの差分から決まる。短い鍵はそれだけで、8バイト鍵はバージョンを総当たりで、
+    それより長い鍵はlibil2cpp.soの中から先頭4バイトが一致する位置を探して候補にする。
+    """
+
+    name = "xor"
+    SHORT_KEY_LENGTHS = (1, 2, 4)
+    SO_KEY_LENGTHS = (8, 16, 32, 64, 128, 256)
+    MAX_SO_MATCHES = 256
+
+    def detect(self, head, file_size, il2cpp_so):
+        magic = struct.pack("<I", il2cpp_inspect.METADATA_MAGIC)
+        prefix = bytes(a ^ b for a, b in zip(head[:4], magic))
+        candidates = []
+        for length in self.SHORT_KEY_LENGTHS:
+            key = prefix[:length]
+            if all(prefix[i] == key[i % length] for i in range(4)):
+                candidates.append(key)
+        for version in il2cpp_inspect.SUPPORTED_METADATA_VERSIONS:
+            candidates.append(prefix + bytes(a ^ b for a, b in zip(head[4:8], struct.pack("<i", version))))
+        if il2cpp_so is not None:
+            position = il2cpp_so.find(prefix)
+            matches = 0
+            while position != -1 and matches < self.MAX_SO_MATCHES:
+                for length in self.SO_KEY_LENGTHS:
+                    key = il2cpp_so[position:position + length]
+                    if len(key) == length:
+                        candidates.append(key)
+                matches += 1
+                position = il2cpp_so.find(prefix, position + 1)
+        seen = set()
+        for key in candidates:
+            if key in seen or not any(key):
+                continue
+            seen.add(key)
+            problems, _ = check_header(_xor(head, key, 0), file_size)
+            if not problems:
+                yield {"key": key.hex()}
+
+    def decrypt_chunk(self, chunk, offset, params):
+        return _xor(chunk, bytes.fromhex(params["key"]), offset)
+
+register_decryptor(XorDecryptor())
+
+@instrument.traced()
+def decrypt_file(source, dest, decryptor, params, chunk_size=CHUNK_SIZE):
+    """mmapしたファイルをチャンクごとに復号して書き出す"""
+    with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, open(dest, 'wb') as out:
+        view = memoryview(mm)
+        try:
+            for offset in range(0, len(view), chunk_size):
+                out.write(decryptor.decrypt_chunk(view[offset:offset + chunk_size], offset, params))
+        finally:
+            view.release()
+    instrument.count("bytes_written", os.path.getsize(dest))
+    return Path(dest)
+
+def _find_decryption(global_metadata, il2cpp_so, temp_path=None):
+    """登録済みのプラグインで復号を試し、検証を通った (プラグイン, パラメータ, 一時ファイル) を返す"""
+    global_metadata = Path(global_metadata)
+    size = global_metadata.stat().st_size
+    with open(global_metadata, 'rb') as f:
+        head = f.read(il2cpp_inspect.MAX_METADATA_HEADER_SIZE)
+    temp_path = temp_path or global_metadata.with_name(global_metadata.name + ".decrypted.tmp")
+    so_file = so_map = None
+    if il2cpp_so and Path(il2cpp_so).exists() and Path(il2cpp_so).stat().st_size:
+        so_file = open(il2cpp_so, 'rb')
+        so_map = mmap.mmap(so_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for decryptor in DECRYPTORS:
+            for params in decryptor.detect(head, size, so_map):
+                print(f"復号を試しています: {decryptor.name} {params}")
+                decrypt_file(global_metadata, temp_path, decryptor, params)
+                result = validate(temp_path)
+                if result["ok"]:
+                    return decryptor, params, temp_path
+                print(f"  検証に失敗しました: {'; '.join(result['problems'])}")
+    finally:
+        if so_map is not None:
+            so_map.close()
+            so_file.close()
+    temp_path.unlink(missing_ok=True)
+    return None
+
+@instrument.traced()
+def ensure_valid_metadata(global_metadata, il2cpp_so=None, output_path=None):
+    """ダンプ前の検証。暗号化が疑われる場合は復号プラグインを試し、検証を通ったファイルで置き換える
+
+    元のファイルは global-metadata.encrypted.dat として残す。output_pathを指定すると元のファイルには触れず、
+    復号したものをoutput_pathに書き出す。ダンパーに渡すパスを返す。どのプラグインでも検証を通らなければMetadataError。
+    """
+    global_metadata = Path(global_metadata)
+    result = validate(global_metadata)
+    if result["ok"]:
+        print(f"global-metadata.datの検証に成功しました（エントロピー {result['entropy']:.2f}bit/byte）")
+        return global_metadata
+    print("global-metadata.datが暗号化または難読化されている可能性があります:")
+    for problem in result["problems"]:
+        print(f"  - {problem}")
+
+    temp_path = output_path and Path(output_path).with_name(Path(output_path).name + ".decrypted.tmp")
+    found = _find_decryption(global_metadata, il2cpp_so, temp_path)
+    if found is None:
+        raise MetadataError(f"global-metadata.datを検証・復号できませんでした: {'; '.join(result['problems'])}")
+    decryptor, params, temp_path = found
+    if output_path:
+        os.replace(temp_path, output_path)
+        print(f"{decryptor.name}で復号しました（出力: {output_path}）")
+        return Path(output_path)
+    encrypted_path = global_metadata.with_name(global_metadata.stem + ENCRYPTED_SUFFIX + global_metadata.suffix)
+    os.replace(global_metadata, encrypted_path)
+    os.replace(temp_path, global_metadata)
+    print(f"{decryptor.name}で復号しました（元のファイル: {encrypted_path}）")
+    return global_metadata
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="global-metadata.datの検証と復号")
+    parser.add_argument("global_metadata", type=Path, nargs="?", default=OUTPUT_DIR / "global-metadata.dat")
+    parser.add_argument("--so", type=Path, default=OUTPUT_DIR / "libil2cpp.so", help="鍵を探すlibil2cpp.so")
+    parser.add_argument("--check", action="store_true", help="検証のみ行い、復号しない")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.check:
+        result = validate(args.global_metadata)
+        print(f"エントロピー: {result['entropy']:.2f}bit/byte"
+              + (f"、文字列セクション: {result['string_entropy']:.2f}bit/byte" if result["string_entropy"] else ""))
+        for problem in result["problems"]:
+            print(f"問題: {problem}")
+        print("検証に成功しました" if result["ok"] else "検証に失敗しました")
+        return 0 if result["ok"] else 1
+    try:
+        ensure_valid_metadata(args.global_metadata, args.so)
+    except MetadataError as e:
+        print(f"エラー: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
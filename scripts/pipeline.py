@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+import apk_zip
+import download_and_extract
+import generate_dump
+import inject_frida
+import instrument
+import metadata_guard
+import resolver
+import signing
+import splits
+
+# 各スクリプトは ../temp などの相対パスを使うため、scriptsディレクトリを基準に実行する
+SCRIPTS_DIR = Path(__file__).resolve().parent
+OUTPUT_DIR = Path("../output")
+STATE_NAME = "pipeline_state.json"
+REPORT_NAME = "pipeline_report.json"
+PIPELINE_VERSION = 3
+DEFAULT_WORKERS = 4
+
+class Stage:
+    """パイプラインの1ステージ
+
+    funcは依存ステージの結果（{ステージ名: 結果}）を受け取り、JSONにできる辞書を返す。
+    結果の "files" に挙げたファイルは、次回のスキップ判定と下流ステージの指紋に使われる。
+    """
+
+    def __init__(self, name, func, deps=(), params=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = params or {}
+
+class StageError(Exception):
+    pass
+
+def _file_stats(files):
+    stats = {}
+    for path in files:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            stats[str(path)] = None
+            continue
+        stats[str(path)] = [st.st_size, st.st_mtime_ns]
+    return stats
+
+def _fingerprint(stage, records):
+    """ステージの入力（パラメータと上流の指紋・出力ファイル）から決定的な指紋を作る"""
+    upstream = {dep: [records[dep]["fingerprint"], records[dep]["files"]] for dep in stage.deps}
+    payload = json.dumps({"version": PIPELINE_VERSION, "stage": stage.name,
+                          "params": stage.params, "upstream": upstream}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class Pipeline:
+    """依存関係に従って独立したステージをスレッドプールで並行実行するスケジューラー"""
+
+    def __init__(self, stages, state_path=OUTPUT_DIR / STATE_NAME, workers=DEFAULT_WORKERS):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise StageError(f"{stage.name}の依存ステージが定義されていません: {dep}")
+        self.state_path = Path(state_path)
+        self.workers = workers
+        self._lock = threading.Lock()
+        self.state = self._load_state()
+        self.records = {}
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        temp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(temp_path, self.state_path)
+
+    def select(self, targets):
+        """指定したステージとその上流だけを残す"""
+        selected = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in self.stages:
+                raise StageError(f"不明なステージです: {name}")
+            if name not in selected:
+                selected.add(name)
+                stack.extend(self.stages[name].deps)
+        self.stages = {name: stage for name, stage in self.stages.items() if name in selected}
+
+    def _run_stage(self, stage, force, started_at):
+        with self._lock:
+            fingerprint = _fingerprint(stage, self.records)
+            previous = self.state.get(stage.name)
+        started = time.perf_counter()
+        skipped = (not force and previous is not None and previous.get("fingerprint") == fingerprint
+                   and previous.get("files") == _file_stats(previous.get("files", {})))
+        if skipped:
+            print(f"[pipeline] {stage.name}: 入力に変更がないためスキップします")
+            result = previous["result"]
+        else:
+            print(f"[pipeline] {stage.name}: 開始")
+            with instrument.span(stage.name, category="stage"):
+                result = stage.func({dep: self.records[dep]["result"] for dep in stage.deps})
+        finished = time.perf_counter()
+        record = {
+            "fingerprint": fingerprint,
+            "result": result,
+            "files": _file_stats(result.get("files", [])),
+            "skipped": skipped,
+            "start": started - started_at,
+            "duration": finished - started,
+        }
+        print(f"[pipeline] {stage.name}: {'スキップ' if skipped else '完了'}（{record['duration']:.2f}秒）")
+        return record
+
+    def run(self, force=False):
+        started_at = time.perf_counter()
+        pending = dict(self.stages)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                if error is None:
+                    for name, stage in list(pending.items()):
+                        if all(dep in self.records for dep in stage.deps):
+                            running[pool.submit(instrument.bind(self._run_stage), stage, force, started_at)] = name
+                            del pending[name]
+                if not running:
+                    if error is None and pending:
+                        raise StageError(f"依存関係が循環しています: {', '.join(pending)}")
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        print(f"[pipeline] {name}: 失敗しました: {e}")
+                        error = error or (name, e)
+                        continue
+                    with self._lock:
+                        self.records[name] = record
+                        self.state[name] = {key: record[key] for key in ("fingerprint", "result", "files")}
+                        self._save_state()
+        wall_seconds = time.perf_counter() - started_at
+        report = self.report(wall_seconds)
+        if error:
+            raise StageError(f"ステージ {error[0]} が失敗しました") from error[1]
+        return report
+
+    def critical_path(self):
+        """所要時間の合計が最大になる依存の連鎖（全体の所要時間を決めている経路）"""
+        cost = {}
+        previous = {}
+        for name in self._topological_order():
+            deps = [dep for dep in self.stages[name].deps if dep in cost]
+            longest = max(deps, key=lambda dep: cost[dep], default=None)
+            previous[name] = longest
+            cost[name] = self.records[name]["duration"] + (cost[longest] if longest else 0.0)
+        if not cost:
+            return [], 0.0
+        name = max(cost, key=cost.get)
+        total = cost[name]
+        path = []
+        while name:
+            path.append(name)
+            name = previous[name]
+        return list(reversed(path)), total
+
+    def _topological_order(self):
+        order = []
+        visited = set()
+        def visit(name):
+            if name in visited or name not in self.records:
+                return
+            visited.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            order.append(name)
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def report(self, wall_seconds):
+        path, path_seconds = self.critical_path()
+        stages = {name: {key: self.records[name][key] for key in ("start", "duration", "skipped")}
+                  for name in self._topological_order()}
+        busy_seconds = sum(stage["duration"] for stage in stages.values())
+
+        print("\nパイプラインの実行結果:")
+        print("  ステージ            開始  所要時間  状態")
+        for name, stage in sorted(stages.items(), key=lambda item: item[1]["start"]):
+            mark = "*" if name in path else " "
+            status = "スキップ" if stage["skipped"] else "実行"
+            print(f"{mark} {name:<16}{stage['start']:>7.2f}s{stage['duration']:>9.2f}s  {status}")
+        print(f"クリティカルパス: {' → '.join(path)}（{path_seconds:.2f}秒）")
+        print(f"全体: {wall_seconds:.2f}秒（各ステージの合計 {busy_seconds:.2f}秒）")
+
+        report = {"wall_seconds": wall_seconds, "busy_seconds": busy_seconds,
+                  "critical_path": path, "critical_path_seconds": path_seconds, "stages": stages}
+        with open(self.state_path.with_name(REPORT_NAME), 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        return report
+
+def build_stages(args):
+    """ダウンロードからインジェクト・署名までのステージ定義
+
+    最新のリリースはここで解決し、バージョンが変わっていなければ下流のステージもスキップされる。
+    """
+    release = resolver.resolve(download_and_extract.PACKAGE_NAME, args.source)
+    device = splits.device_from_args(args)
+
+    def download_xapk(_):
+        xapk_path, xapk_sha256 = download_and_extract.fetch_xapk(release, args.source)
+        return {"xapk": str(xapk_path), "sha256": xapk_sha256,
+                "files": [str(xapk_path), str(download_and_extract.TEMP_DIR / "xapk_extracted" / ".xapk-sha256")]}
+
+    def fetch_dumper(_):
+        dumper_dir = download_and_extract.fetch_il2cpp_dumper()
+        return {"dir": str(dumper_dir), "files": [str(p) for p in sorted(dumper_dir.glob("Il2CppDumper.*"))]}
+
+    def fetch_apktool(_):
+        apktool = inject_frida.ensure_apktool()
+        return {"apktool": str(apktool), "files": [str(apktool), str(inject_frida.TOOLS_DIR / "apktool.jar")]}
+
+    def extract_il2cpp(results):
+        xapk = results["download_xapk"]
+        il2cpp_so, global_metadata = download_and_extract.extract_il2cpp(
+            Path(xapk["xapk"]), xapk["sha256"], stream=args.stream)
+        # global-metadata.datはvalidate_metadataで復号後のファイルに置き換わるため、出力として記録するのはvalidate_metadata側
+        return {"xapk": xapk["xapk"], "sha256": xapk["sha256"],
+                "il2cpp_so": str(il2cpp_so), "global_metadata": str(global_metadata), "files": [str(il2cpp_so)]}
+
+    def validate_metadata(results):
+        extracted = results["extract_il2cpp"]
+        il2cpp_so, global_metadata = extracted["il2cpp_so"], extracted["global_metadata"]
+        if not Path(global_metadata).exists():
+            # extract_il2cppがスキップされた後に消された場合はキャッシュから取り出し直す
+            download_and_extract.extract_il2cpp(Path(extracted["xapk"]), extracted["sha256"], stream=args.stream)
+        global_metadata = metadata_guard.ensure_valid_metadata(global_metadata, il2cpp_so)
+        return {"files": [il2cpp_so, str(global_metadata)]}
+
+    def dump(_):
+        dump_cs, db_path = generate_dump.generate_dump()
+        return {"files": [str(dump_cs), str(db_path)]}
+
+    def fetch_gadgets(_):
+        split_set = inject_frida.find_apks(device=device)
+        abis, abi_splits = inject_frida.detect_abis(split_set, device and device["abis"])
+        gadgets = inject_frida.download_frida_gadgets(abis)
+        return {"main_apk": split_set.base.path, "config_apks": split_set.paths(), "split_abis": split_set.split_abis(),
+                "abis": abis, "abi_splits": abi_splits,
+                "gadgets": {abi: str(path) for abi, path in gadgets.items()},
+                "files": [str(path) for path in gadgets.values()]}
+
+    def inject(results):
+        apks = results["fetch_gadgets"]
+        modified_apk, injected_splits = inject_frida.inject_apks(
+            apks["main_apk"], {abi: Path(path) for abi, path in apks["gadgets"].items()},
+            apks["abi_splits"], engine=args.engine)
+        injected_splits = {src: str(dest) for src, dest in injected_splits.items()}
+        return {"modified_apk": str(modified_apk), "injected_splits": injected_splits,
+                "files": [str(modified_apk)] + list(injected_splits.values())}
+
+    def align(results):
+        apks = results["fetch_gadgets"]
+        injected = results["inject"]
+        main_apk, splits = inject_frida.align_outputs(
+            Path(injected["modified_apk"]), apks["config_apks"],
+            {src: Path(dest) for src, dest in injected["injected_splits"].items()})
+        splits = {src: str(dest) for src, dest in splits.items()}
+        return {"modified_apk": str(main_apk), "splits": splits, "files": [str(main_apk)] + list(splits.values())}
+
+    def sign(results):
+        apks = results["fetch_gadgets"]
+        aligned = results["align"]
+        main_apk, split_apks = inject_frida.sign_outputs(
+            Path(aligned["modified_apk"]), apks["config_apks"],
+            {src: Path(dest) for src, dest in aligned["splits"].items()}, apks["abis"], apks["split_abis"],
+            backend=args.sign_backend, workers=args.sign_workers)
+        return {"files": [str(main_apk)] + [str(p) for p in split_apks]
+                         + [str(inject_frida.OUTPUT_DIR / inject_frida.INSTALL_SETS_NAME)]}
+
+    inject_deps = ["fetch_gadgets"] + (["fetch_apktool"] if args.engine == "apktool" else [])
+    stages = [
+        Stage("download_xapk", download_xapk,
+              params={"xapk": resolver.release_cache_key(release), "file": resolver.stable_url(release["url"])}),
+        Stage("fetch_dumper", fetch_dumper,
+              params={"url": download_and_extract.IL2CPP_DUMPER_NET_URL, "win_url": download_and_extract.IL2CPP_DUMPER_URL}),
+        Stage("extract_il2cpp", extract_il2cpp, ["download_xapk"], {"stream": args.stream}),
+        Stage("validate_metadata", validate_metadata, ["extract_il2cpp"],
+              {"decryptors": [decryptor.name for decryptor in metadata_guard.DECRYPTORS]}),
+        Stage("dump", dump, ["validate_metadata", "fetch_dumper"], {"dumper": generate_dump.IL2CPP_DUMPER_VERSION}),
+        Stage("fetch_gadgets", fetch_gadgets, ["download_xapk"], {"frida": inject_frida.FRIDA_VERSION, "device": device}),
+        Stage("inject", inject, inject_deps, {"engine": args.engine}),
+        Stage("align", align, ["inject", "fetch_gadgets"], {"native_lib_alignment": apk_zip.NATIVE_LIB_ALIGNMENT}),
+        Stage("sign", sign, ["align", "fetch_gadgets"], {"backend": args.sign_backend}),
+    ]
+    if args.engine == "apktool":
+        stages.insert(2, Stage("fetch_apktool", fetch_apktool, params={"url": inject_frida.APKTOOL_JAR_URL}))
+    return stages
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ダウンロードからダンプ・インジェクト・署名までを依存関係に従って実行する")
+    parser.add_argument("--target", action="append",
+                        help="実行するステージ（上流も含めて実行、複数指定可。既定はすべて）")
+    parser.add_argument("--force", action="store_true", help="入力に変更がなくてもすべてのステージを実行する")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="同時に実行するステージ数")
+    parser.add_argument("--stream", action="store_true", help="Il2Cppファイルをストリーム抽出する")
+    parser.add_argument("--source", default=None,
+                        help=f"XAPKの取得元（apkcombo またはミラーのURL、既定: {resolver.DEFAULT_SOURCE}）")
+    parser.add_argument("--engine", choices=inject_frida.ENGINES, default="apktool", help="インジェクト方法")
+    parser.add_argument("--sign-backend", choices=signing.BACKENDS, default=signing.DEFAULT_BACKEND, help="署名方法")
+    parser.add_argument("--sign-workers", type=int, default=None, help="並列に署名するプロセス数")
+    splits.add_device_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    os.chdir(SCRIPTS_DIR)
+    args = parse_args(argv)
+
+    download_and_extract.setup_directories()
+    pipeline = Pipeline(build_stages(args), workers=args.workers)
+    if args.target:
+        pipeline.select(args.target)
+    try:
+        pipeline.run(force=args.force)
+    finally:
+        instrument.save("pipeline")
+    print("\nパイプラインが完了しました")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import os
+import re
+import sys
+import json
+import html
+import time
+import argparse
+from pathlib import Path
+from email.utils import formatdate
+from urllib.parse import unquote, urljoin, urlsplit, urlunsplit
+
+import requests
+
+import cache
+import downloader
+import instrument
+
+# 既定の取得元（"apkcombo" またはミラーのベースURL）。環境変数で変更可能
+DEFAULT_SOURCE = os.environ.get("INJECT_XAPK_SOURCE", "apkcombo")
+# パッケージごとの前回の解決結果（ETag・Last-Modifiedなど）。キャッシュと同じ場所に置く
+STATE_NAME = "resolver_state.json"
+APKCOMBO_PAGE_URL = "https://apkcombo.com/app/{package}/download/apk"
+APKCOMBO_LINK = re.compile(r"""href=["']([^"']*?/r2\?u=[^"']+)["']""")
+REQUEST_TIMEOUT = 30
+
+class ResolveError(Exception):
+    pass
+
+def version_from_url(url, package):
+    """署名付きURL（二重にエンコードされていることがある）の .../<パッケージ>/<バージョン>/... からバージョンを取り出す"""
+    decoded = unquote(unquote(url))
+    match = re.search(rf"/{re.escape(package)}/([^/?&]+)/", decoded)
+    return match.group(1) if match else None
+
+def stable_url(url):
+    """署名・有効期限などのクエリを除いた、ファイルを識別するためのURL
+
+    APKComboの /r2?u=... は中のURLを取り出してから、クエリを落とす。
+    """
+    parts = urlsplit(url)
+    match = re.search(r"(?:^|&)u=([^&]+)", parts.query)
+    if parts.path.endswith("/r2") and match:
+        return stable_url(unquote(match.group(1)))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+def release_cache_key(release):
+    return cache.cache_key("xapk", release["package"], release["version"])
+
+def _conditional_headers(validators):
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+def _validators(response):
+    return {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+def _get(http, url, validators, headers=None):
+    """条件付きGET。変更がなければ（304）Noneを返す"""
+    headers = dict(downloader.DEFAULT_HEADERS, **(headers or {}), **_conditional_headers(validators or {}))
+    instrument.count("resolver_requests", 1)
+    try:
+        response = http.get(url, headers=headers, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        raise ResolveError(f"取得に失敗しました: {url}: {e}")
+    if response.status_code == 304:
+        return None
+    if not response.ok:
+        raise ResolveError(f"取得に失敗しました: {url}: HTTP {response.status_code}")
+    return response
+
+# ---- 取得元 ----
+
+class MirrorSource:
+    """<ベースURL>/<パッケージ>.json に {"version", "url", "sha256"(任意)} を置いたミラー
+
+    urlはインデックスからの相対パスでもよい。インデックスは条件付きGETで取得する。
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.name = f"mirror:{self.base_url}"
+
+    def check(self, package, previous, http):
+        index_url = urljoin(self.base_url, f"{package}.json")
+        response = _get(http, index_url, previous and previous.get("index"))
+        if response is None:
+            return None
+        try:
+            entry = response.json()
+        except ValueError:
+            raise ResolveError(f"インデックスがJSONではありません: {index_url}")
+        if not entry.get("version") or not entry.get("url"):
+            raise ResolveError(f"インデックスに version または url がありません: {index_url}")
+        return {"version": str(entry["version"]), "url": urljoin(index_url, entry["url"]),
+                "sha256": entry.get("sha256"), "index": _validators(response)}
+
+class ApkComboSource:
+    """APKComboのダウンロードページからXAPKのリンクを探す
+
+    ページの構造に依存するため、リンクが見つからなければResolveErrorにする。
+    """
+
+    name = "apkcombo"
+
+    def __init__(self, page_url=APKCOMBO_PAGE_URL):
+        self.page_url = page_url
+
+    def check(self, package, previous, http):
+        page_url = self.page_url.format(package=package)
+        response = _get(http, page_url, previous and previous.get("index"), {'Referer': 'https://apkcombo.com/'})
+        if response is None:
+            return None
+        links = [urljoin(response.url, html.unescape(link)) for link in APKCOMBO_LINK.findall(response.text)]
+        # XAPKを優先し、なければAPK
+        links.sort(key=lambda link: "xapk" not in unquote(unquote(link)).lower())
+        for link in links:
+            version = version_from_url(link, package)
+            if version:
+                return {"version": version, "url": link, "sha256": None, "index": _validators(response)}
+        raise ResolveError(f"ダウンロードリンクが見つかりませんでした: {page_url}")
+
+def get_source(spec=None):
+    spec = spec or DEFAULT_SOURCE
+    if spec == ApkComboSource.name:
+        return ApkComboSource()
+    if spec.startswith("mirror:"):
+        spec = spec[len("mirror:"):]
+    if re.match(r"^https?://", spec):
+        return MirrorSource(spec)
+    raise ResolveError(f"不明な取得元です: {spec}（apkcombo またはミラーのURLを指定してください）")
+
+# ---- 解決 ----
+
+def _state_path(state_path=None):
+    return Path(state_path) if state_path else cache.get_cache().root / STATE_NAME
+
+def load_state(state_path=None):
+    try:
+        with open(_state_path(state_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state, state_path=None):
+    path = _state_path(state_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+def _head(http, url, validators):
+    """ダウンロードURLへの条件付きHEAD。(変更があったか, ファイルの検証子, サイズ) を返す"""
+    headers = dict(downloader.DEFAULT_HEADERS, **_conditional_headers(validators or {}))
+    instrument.count("resolver_requests", 1)
+    try:
+        response = http.head(url, headers=headers, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        raise ResolveError(f"ダウンロードURLを確認できませんでした: {url}: {e}")
+    if response.status_code == 304:
+        return False, validators, None
+    if not response.ok:
+        raise ResolveError(f"ダウンロードURLが無効です（期限切れの可能性があります）: {url}: HTTP {response.status_code}")
+    current = _validators(response)
+    changed = not (validators and validators.get("etag") and validators["etag"] == current["etag"])
+    length = response.headers.get("Content-Length")
+    return changed, current, int(length) if length else None
+
+@instrument.traced()
+def resolve(package, source=None, state_path=None, http=None, force=False):
+    """現在のバージョンとダウンロードURLを解決する
+
+    前回から変わっていなければ、インデックス（ページ）への条件付きリクエスト1回で済ませ、
+    前回の結果に "changed": False を付けて返す。forceを指定すると条件を付けずに取得し直す
+    （保存済みの署名付きURLが期限切れの場合など）。
+    """
+    http = http or downloader.session
+    source = source if hasattr(source, "check") else get_source(source)
+    state = load_state(state_path)
+    previous = state.get(package)
+    if previous and previous.get("source") != source.name:
+        previous = None
+
+    found = source.check(package, None if force else previous, http)
+    if found is None:
+        if previous is None:
+            raise ResolveError(f"前回の結果がないのに変更なし（304）が返されました: {package}")
+        release = dict(previous, changed=False)
+    else:
+        release = {"package": package, "source": source.name, **found, "file": None, "size": None}
+        same_version = previous is not None and previous["version"] == release["version"]
+        if same_version and stable_url(previous["url"]) == stable_url(release["url"]):
+            # インデックスだけが更新された場合（署名付きURLの再発行など）はファイルを確認しない
+            changed = False
+            release.update(file=previous.get("file"), size=previous.get("size"))
+        else:
+            file_changed, file_validators, size = _head(http, release["url"], previous and previous.get("file"))
+            changed = not same_version or file_changed
+            release.update(file=file_validators, size=size or (previous and previous.get("size")))
+        release["changed"] = changed
+
+    release["checked_at"] = formatdate(time.time(), usegmt=True)
+    state[package] = {k: v for k, v in release.items() if k != "changed"}
+    save_state(state, state_path)
+    status = "新しいリリース" if release["changed"] else "変更なし"
+    print(f"{package}: {release['version']}（{status}、{source.name}）")
+    return release
+
+def downloadable(release, state_path=None):
+    """変更がなくキャッシュにもないリリースは、保存済みの署名付きURLが期限切れかもしれないので解決し直す"""
+    if release["changed"] or cache.get_cache().lookup(release_cache_key(release)) is not None:
+        return release
+    return resolve(release["package"], release["source"], state_path, force=True)
+
+def to_manifest(releases):
+    """batch.pyのマニフェスト形式に変換する"""
+    return {"builds": [{"package": r["package"], "version": r["version"], "source": r["url"],
+                        **({"sha256": r["sha256"]} if r.get("sha256") else {})} for r in releases]}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="パッケージの現在のバージョンとダウンロードURLを解決する")
+    parser.add_argument("packages", nargs="+", help="パッケージ名")
+    parser.add_argument("--source", default=None, help=f"取得元（apkcombo またはミラーのURL、既定: {DEFAULT_SOURCE}）")
+    parser.add_argument("--state", type=Path, default=None, help="前回の解決結果の保存先")
+    parser.add_argument("--manifest", type=Path, default=None, help="バッチモード用のマニフェストを書き出す")
+    parser.add_argument("--changed-only", action="store_true", help="マニフェストに変更があったものだけを含める")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        releases = [resolve(package, args.source, args.state) for package in args.packages]
+    except ResolveError as e:
+        print(f"エラー: {e}")
+        return 1
+    if args.manifest:
+        selected = [r for r in releases if r["changed"] or not args.changed_only]
+        with open(args.manifest, 'w', encoding='utf-8') as f:
+            json.dump(to_manifest(selected), f, indent=2, ensure_ascii=False)
+        print(f"マニフェストを保存しました: {args.manifest}（{len(selected)}件）")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import os
+import time
+import shutil
+import subprocess
+import threading
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import apk_align
+import apk_zip
+import cache
+import instrument
+
+OUTPUT_DIR = Path("../output")
+KEYSTORE_NAME = "debug.keystore"
+KEYSTORE_PASSWORD = "android"
+KEY_ALIAS = "androiddebugkey"
+# jarsigner: JVMを起動してv1署名, python: JVMを使わずにv2/v3署名
+BACKENDS = ("jarsigner", "python")
+# pythonは出力APKを1回だけ書き込む。jarsignerはコピー・jarsignerの書き直し・アラインメントの揃え直しで最大3回書き込むため、
+# cryptographyパッケージがあればpythonを既定にする
+DEFAULT_BACKEND = "python" if importlib.util.find_spec("cryptography") is not None else "jarsigner"
+
+_keystore_lock = threading.Lock()
+
+def _generate_keystore(keystore):
+    try:
+        print("デバッグ用キーストアを生成しています...")
+        instrument.run([
+            "keytool", "-genkey", "-v", "-keystore", str(keystore),
+            "-storetype", "PKCS12",
+            "-storepass", KEYSTORE_PASSWORD, "-alias", KEY_ALIAS,
+            "-keypass", KEYSTORE_PASSWORD, "-keyalg", "RSA", "-keysize", "2048",
+            "-validity", "10000", "-dname", "CN=Android Debug,O=Android,C=US"
+        ], check=True)
+        return True
+    except FileNotFoundError:
+        pass
+
+    try:
+        import apk_signature
+        key, cert = apk_signature.generate_debug_key()
+    except ImportError:
+        print("keytoolもcryptographyパッケージも見つかりません。署名をスキップします。")
+        return False
+    print("keytoolが見つからないため、Pythonでキーストアを生成します...")
+    apk_signature.write_pkcs12(keystore, key, cert, KEY_ALIAS, KEYSTORE_PASSWORD.encode())
+    return True
+
+def ensure_keystore(output_dir=OUTPUT_DIR):
+    """デバッグ用キーストアを一度だけ生成して返す（生成できない場合はNone）
+
+    一時ファイルに生成してから置き換えるため、書きかけのキーストアが見えることはない。プロセス間の排他は
+    ロックファイルのflockで行う（プロセスが強制終了してもロックは解放される）。
+    """
+    keystore = Path(output_dir) / KEYSTORE_NAME
+    with _keystore_lock:
+        if keystore.exists():
+            return keystore
+        keystore.parent.mkdir(parents=True, exist_ok=True)
+        with open(keystore.with_name(keystore.name + ".lock"), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if keystore.exists():
+                return keystore
+            temp_path = keystore.with_name(f"{keystore.name}.{os.getpid()}.tmp")
+            # keytoolは既存のファイルをキーストアとして開こうとするため、前回の残りは消しておく
+            temp_path.unlink(missing_ok=True)
+            try:
+                if not _generate_keystore(temp_path):
+                    return None
+                os.replace(temp_path, keystore)
+            finally:
+                temp_path.unlink(missing_ok=True)
+    return keystore
+
+def _jarsign(apk_path, keystore, sigalg="SHA256withRSA", digestalg="SHA-256"):
+    subprocess.run([
+        "jarsigner", "-sigalg", sigalg, "-digestalg", digestalg,
+        "-keystore", str(keystore), "-storepass", KEYSTORE_PASSWORD,
+        "-keypass", KEYSTORE_PASSWORD, str(apk_path), KEY_ALIAS
+    ], check=True, encoding='utf-8', stdout=subprocess.DEVNULL)
+
+# ワーカープロセスごとに一度だけ復元される署名鍵
+_worker_signer = None
+
+def _init_worker(key_der, cert_der):
+    global _worker_signer
+    if key_der is None:
+        return
+    from cryptography.hazmat.primitives import serialization
+    import apk_signature
+
+    key = serialization.load_der_private_key(key_der, password=None)
+    _worker_signer = apk_signature.ApkSigner(key, cert_der)
+
+def _sign_job(job):
+    """出力APKを1回だけ書き込んで署名する
+
+    python: reflinkできれば末尾（署名ブロック・中央ディレクトリ）だけを書き直し、
+    できなければ元のAPKを書き写しながらダイジェストを計算する。jarsigner: コピー（reflink優先）に署名し、
+    アラインメントを揃え直す。
+    (出力APK, 開始, 終了, jarsignerの終了コード) を返す。時刻はperf_counterの値で、親プロセスでの記録に使う。
+    """
+    source, dest, backend, keystore = job
+    started = time.perf_counter()
+    same_file = os.path.abspath(source) == os.path.abspath(dest)
+    if not same_file:
+        # 前回キャッシュからハードリンクで配置した出力を書き換えないよう、先に外す
+        Path(dest).unlink(missing_ok=True)
+    if backend == "python":
+        if same_file or cache.clone_file(source, dest):
+            _worker_signer.sign_in_place(dest)
+        else:
+            _worker_signer.sign_copy(source, dest)
+    else:
+        if not same_file:
+            cache.copy_file(source, dest)
+        try:
+            _jarsign(dest, keystore)
+        except subprocess.CalledProcessError as e:
+            return str(dest), started, time.perf_counter(), e.returncode
+        # jarsignerはZIPを書き直してアラインメントを崩すため、v1署名の後に揃え直す（zipalignと同じ順序）
+        apk_align.ensure_aligned(dest)
+    return str(dest), started, time.perf_counter(), 0
+
+def _load_key_material(keystore):
+    """キーストアは親プロセスで一度だけ読み込み、DERでワーカーへ渡す"""
+    from cryptography.hazmat.primitives import serialization
+    import apk_signature
+
+    signer = apk_signature.ApkSigner.from_pkcs12(keystore, KEYSTORE_PASSWORD.encode())
+    key_der = signer.private_key.private_bytes(
+        serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return key_der, signer.certificate_der
+
+def signed_cache_key(source, keystore, backend):
+    """署名済み出力のキャッシュキー（入力APKの内容・署名鍵・バックエンドで決まる）"""
+    import apk_signature
+
+    return cache.cache_key("signed-apk", apk_signature.content_fingerprint(source), cache.file_sha256(keystore),
+                           backend, apk_zip.NATIVE_LIB_ALIGNMENT)
+
+def _reuse_signed(jobs, reusable, keystore, backend):
+    """書き換えていない入力APKは、前回の署名済み出力をキャッシュから配置する
+
+    {出力APK: キャッシュキー} と、署名が必要なジョブのリストを返す。
+    """
+    reusable = {os.path.abspath(p) for p in reusable}
+    store = cache.get_cache()
+    keys = {}
+    pending = []
+    for src, dest in jobs:
+        if os.path.abspath(src) in reusable:
+            try:
+                keys[dest] = signed_cache_key(src, keystore, backend)
+            except (OSError, ValueError):
+                keys[dest] = None
+            if keys[dest] and store.materialize(keys[dest], dest, link=True):
+                print(f"署名済みのAPKを再利用します: {dest}")
+                continue
+        pending.append((src, dest))
+    return keys, pending
+
+@instrument.traced()
+def sign_apks(jobs, backend=DEFAULT_BACKEND, workers=None, output_dir=OUTPUT_DIR, reusable=()):
+    """(入力APK, 出力APK) のリストをプロセスプールで並列に署名する
+
+    reusableに含まれる入力APK（書き換えていないスプリットなど）の署名済み出力はキャッシュに保存し、
+    次回以降は署名せずに配置する。
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"未対応の署名バックエンドです: {backend}")
+    jobs = [(Path(src), Path(dest)) for src, dest in jobs]
+    if not jobs:
+        return []
+
+    keystore = ensure_keystore(output_dir)
+    if keystore is None:
+        for src, dest in jobs:
+            if os.path.abspath(src) != os.path.abspath(dest):
+                cache.link_or_copy(src, dest)
+        return [dest for _, dest in jobs]
+
+    key_der = cert_der = None
+    if backend == "python":
+        try:
+            key_der, cert_der = _load_key_material(keystore)
+        except ImportError:
+            print("cryptographyパッケージが見つかりません。jarsignerで署名します。")
+            backend = "jarsigner"
+    if backend == "jarsigner" and shutil.which("jarsigner") is None:
+        print("jarsignerが見つかりません。署名されていないAPKを使用します。")
+        for src, dest in jobs:
+            if os.path.abspath(src) != os.path.abspath(dest):
+                cache.link_or_copy(src, dest)
+        return [dest for _, dest in jobs]
+
+    keys, pending = _reuse_signed(jobs, reusable, keystore, backend)
+    instrument.count("signed_reused", len(jobs) - len(pending))
+    started = time.perf_counter()
+    if pending:
+        workers = workers or min(len(pending), os.cpu_count() or 1)
+        print(f"{len(pending)}個のAPKを{workers}並列で署名します（バックエンド: {backend}）...")
+        failed = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(key_der, cert_der)) as pool:
+            for dest, job_started, job_ended, returncode in pool.map(
+                    _sign_job, [(src, dest, backend, keystore) for src, dest in pending]):
+                # ワーカープロセス内の処理は記録できないため、ワーカーが測った時刻（perf_counterはプロセス間で共通）を親で記録する
+                instrument.record_subprocess(f"sign ({backend})", [backend, dest], job_started, returncode,
+                                             ended=job_ended)
+                if returncode:
+                    print(f"署名に失敗しました: {dest}（終了コード {returncode}）")
+                    failed.append((dest, returncode))
+                    continue
+                print(f"署名が完了しました: {dest} ({job_ended - job_started:.2f}秒)")
+                key = keys.get(Path(dest))
+                if key:
+                    # 出力はキャッシュへ移してハードリンクで戻す（コピーしない）
+                    store = cache.get_cache()
+                    store.put(key, dest, move=True)
+                    store.materialize(key, dest, link=True)
+        if failed:
+            dest, returncode = failed[0]
+            raise subprocess.CalledProcessError(returncode, ["jarsigner", dest])
+    print(f"署名ステージ完了: {time.perf_counter() - started:.2f}秒")
+    return [dest for _, dest in jobs]
@@ -0,0 +1,252 @@
+import os
+import re
+import sys
+import json
+import zipfile
+import argparse
+from pathlib import Path
+
+TEMP_DIR = Path("../temp")
+XAPK_MANIFEST_NAME = "manifest.json"
+# スプリットAPK名はABIの "-" が "_" になる（config.arm64_v8a.apk）
+SPLIT_ABIS = {"arm64_v8a": "arm64-v8a", "armeabi_v7a": "armeabi-v7a", "armeabi": "armeabi",
+              "x86_64": "x86_64", "x86": "x86"}
+# 密度スプリットのバケット → dpi
+DENSITIES = {"ldpi": 120, "mdpi": 160, "tvdpi": 213, "hdpi": 240, "xhdpi": 320, "xxhdpi": 480, "xxxhdpi": 640}
+LANGUAGE_PATTERN = re.compile(r"^[a-z]{2,3}(?:_[a-z0-9]+)?$", re.IGNORECASE)
+LIB_ABI_PATTERN = re.compile(r"^lib/([^/]+)/[^/]+\.so$")
+DEX_PATTERN = re.compile(r"^classes\d*\.dex$")
+
+KINDS = ("base", "abi", "density", "language", "asset_pack", "feature", "other")
+KIND_LABELS = {"base": "ベース", "abi": "ABI", "density": "密度", "language": "言語",
+               "asset_pack": "アセットパック", "feature": "機能モジュール", "other": "その他"}
+
+class SplitError(Exception):
+    pass
+
+def classify(split_id):
+    """スプリットのIDから (種類, 値) を返す（config.arm64_v8a → ("abi", "arm64-v8a") など）
+
+    config.* 以外のスプリットは中身を見ないと区別できないため ("other", None) を返す。
+    """
+    if split_id == "base":
+        return "base", None
+    if not split_id.startswith("config."):
+        return "other", None
+    config = split_id[len("config."):]
+    if config.lower() in SPLIT_ABIS:
+        return "abi", SPLIT_ABIS[config.lower()]
+    if config.lower() in DENSITIES:
+        return "density", config.lower()
+    if LANGUAGE_PATTERN.match(config):
+        return "language", config.replace("_", "-")
+    return "other", config
+
+def _module_kind(apk_path):
+    """config.* 以外のスプリット：DEXを含めば機能モジュール、含まなければアセットパック"""
+    try:
+        with zipfile.ZipFile(apk_path) as zf:
+            names = zf.namelist()
+    except zipfile.BadZipFile:
+        return "other"
+    if any(DEX_PATTERN.match(name) for name in names):
+        return "feature"
+    return "asset_pack" if any(name.startswith("assets/") for name in names) else "other"
+
+def parse_density(value):
+    """"xxhdpi" または "480" を dpi に変換する"""
+    value = str(value).lower()
+    if value in DENSITIES:
+        return DENSITIES[value]
+    if value.endswith("dpi"):
+        value = value[:-len("dpi")]
+    if not value.isdigit():
+        raise SplitError(f"不明な画面密度です: {value}（{', '.join(DENSITIES)} または dpi の数値）")
+    return int(value)
+
+def choose_abi(device_abis, supported_abis):
+    """端末のABI（優先度順）のうち、アプリが対応している最初のものを返す"""
+    for abi in device_abis:
+        if abi in supported_abis:
+            return abi
+    raise SplitError(f"アプリは指定したABI（{', '.join(device_abis)}）に対応していません"
+                     f"（対応ABI: {', '.join(supported_abis) or 'なし'}）")
+
+class Split:
+    def __init__(self, path, split_id, kind, value=None):
+        self.path = path
+        self.id = split_id
+        self.kind = kind
+        self.value = value
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def __repr__(self):
+        return f"Split({self.id!r}, {self.kind!r}, {self.value!r})"
+
+class SplitSet:
+    """XAPKを構成するベースAPKとスプリットAPKの組"""
+
+    def __init__(self, base, splits, package=None):
+        self.base = base
+        self.splits = list(splits)
+        self.package = package
+
+    @classmethod
+    def from_xapk(cls, xapk_extracted=TEMP_DIR / "xapk_extracted"):
+        """展開済みXAPKの manifest.json（split_apks）から読み込む
+
+        manifest.json がない、またはsplit_apksを含まない場合はAPKファイル名から推定する。
+        """
+        xapk_extracted = Path(xapk_extracted)
+        manifest = {}
+        manifest_path = xapk_extracted / XAPK_MANIFEST_NAME
+        if manifest_path.exists():
+            print("XAPKマニフェストを確認中...")
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        package = manifest.get("package_name")
+
+        entries = []
+        for item in manifest.get("split_apks") or []:
+            path = xapk_extracted / item["file"]
+            if not path.exists():
+                print(f"警告: マニフェストに記載されたAPKが見つかりません: {item['file']}")
+                continue
+            entries.append((str(path), item.get("id") or Path(item["file"]).stem))
+        if not entries:
+            entries = cls._scan(xapk_extracted, package)
+
+        base = None
+        splits = []
+        for path, split_id in entries:
+            kind, value = classify(split_id)
+            if kind == "other" and value is None:
+                kind = _module_kind(path)
+            split = Split(path, split_id, kind, value)
+            if kind == "base":
+                base = split
+            else:
+                splits.append(split)
+        if base is None:
+            raise FileNotFoundError("メインAPKファイルが見つかりませんでした")
+        return cls(base, splits, package)
+
+    @staticmethod
+    def _scan(xapk_extracted, package=None):
+        """マニフェストがない場合：config.* 以外のAPKのうち、base.apk → <パッケージ>.apk → DEXを含むもの をベースとする"""
+        apks = sorted(os.path.join(root, name) for root, _, files in os.walk(xapk_extracted)
+                      for name in files if name.endswith(".apk"))
+        candidates = [p for p in apks if not os.path.basename(p).lower().startswith("config.")]
+        base = None
+        for name in ("base.apk", f"{package}.apk"):
+            base = base or next((p for p in candidates if os.path.basename(p) == name), None)
+        base = base or next((p for p in candidates if _module_kind(p) == "feature"), None)
+        base = base or (candidates[0] if len(candidates) == 1 else None)
+        return [(p, "base" if p == base else Path(p).stem) for p in apks]
+
+    def by_kind(self, kind):
+        return [split for split in self.splits if split.kind == kind]
+
+    def paths(self):
+        return [split.path for split in self.splits]
+
+    def abi_splits(self):
+        return {split.value: split.path for split in self.by_kind("abi")}
+
+    def split_abis(self):
+        """スプリットAPK → ABI（ABIスプリット以外は含まない）"""
+        return {split.path: split.value for split in self.by_kind("abi")}
+
+    def supported_abis(self):
+        """ABIスプリットとベースAPKのlib/から、アプリが対応するABIを集める"""
+        abis = set(self.abi_splits())
+        with zipfile.ZipFile(self.base.path) as zf:
+            for name in zf.namelist():
+                match = LIB_ABI_PATTERN.match(name)
+                if match:
+                    abis.add(match.group(1))
+        order = list(SPLIT_ABIS.values())
+        return sorted(abis, key=lambda abi: order.index(abi) if abi in order else len(order))
+
+    def select(self, abis=None, density=None, languages=None):
+        """端末に必要なスプリットだけを残した SplitSet を返す（指定しなかった種類はすべて残す）
+
+        ABIは端末の優先度順に、アプリが対応している最初の1つ。密度は端末以上で最も近いもの（なければ最大）。
+        言語は指定した言語のもの。アセットパックと機能モジュールは常に残す。
+        """
+        keep = list(self.splits)
+        if abis:
+            abi = choose_abi(abis, self.supported_abis())
+            keep = [s for s in keep if s.kind != "abi" or s.value == abi]
+        density_splits = self.by_kind("density")
+        if density and density_splits:
+            dpi = parse_density(density)
+            ranked = sorted(density_splits, key=lambda s: DENSITIES[s.value])
+            chosen = next((s for s in ranked if DENSITIES[s.value] >= dpi), ranked[-1])
+            keep = [s for s in keep if s.kind != "density" or s is chosen]
+        if languages:
+            wanted = {lang.lower().replace("_", "-").split("-")[0] for lang in languages}
+            keep = [s for s in keep if s.kind != "language" or s.value.lower().split("-")[0] in wanted]
+        return SplitSet(self.base, keep, self.package)
+
+    def describe(self):
+        counts = {}
+        for split in self.splits:
+            counts[split.kind] = counts.get(split.kind, 0) + 1
+        return "、".join(f"{KIND_LABELS[kind]} {counts[kind]}" for kind in KINDS if kind in counts) or "なし"
+
+def add_device_arguments(parser):
+    """対象端末に合わせてスプリットを絞り込むオプション"""
+    parser.add_argument("--abi", action="append", default=None,
+                        help="端末のABI（優先度順、カンマ区切りまたは複数指定。例: arm64-v8a,armeabi-v7a）")
+    parser.add_argument("--density", default=None, help="端末の画面密度（xxhdpi などのバケット名またはdpi）")
+    parser.add_argument("--lang", action="append", default=None,
+                        help="残す言語スプリット（カンマ区切りまたは複数指定。例: ja,en）")
+
+def device_from_args(args):
+    """add_device_argumentsのオプションから select() の引数を作る（指定がなければNone）"""
+    def split_list(values):
+        return [v.strip() for value in values or [] for v in value.split(",") if v.strip()] or None
+
+    device = {"abis": split_list(args.abi), "density": args.density, "languages": split_list(args.lang)}
+    if args.density:
+        parse_density(args.density)
+    return device if any(device.values()) else None
+
+def load(xapk_extracted=TEMP_DIR / "xapk_extracted", device=None):
+    """スプリットの組を読み込み、deviceの指定があれば絞り込む"""
+    split_set = SplitSet.from_xapk(xapk_extracted)
+    if not device:
+        return split_set
+    selected = split_set.select(**device)
+    dropped = [s for s in split_set.splits if s not in selected.splits]
+    if dropped:
+        saved = sum(s.size for s in dropped) / (1024 * 1024)
+        print(f"対象端末に不要なスプリットを除外します: {', '.join(s.id for s in dropped)}（{saved:.1f}MB）")
+    return selected
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="展開済みXAPKのスプリットAPKを分類し、対象端末に必要なものを表示する")
+    parser.add_argument("xapk_extracted", type=Path, nargs="?", default=TEMP_DIR / "xapk_extracted")
+    add_device_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        split_set = load(args.xapk_extracted, device_from_args(args))
+    except SplitError as e:
+        print(f"エラー: {e}")
+        return 1
+    print(f"ベース: {split_set.base.path}（対応ABI: {', '.join(split_set.supported_abis()) or 'なし'}）")
+    for split in split_set.splits:
+        value = f" {split.value}" if split.value else ""
+        print(f"  [{KIND_LABELS[split.kind]}{value}] {split.path} ({split.size / (1024 * 1024):.1f}MB)")
+    print(f"スプリット: {split_set.describe()}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
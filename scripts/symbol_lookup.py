@@ -0,0 +1,346 @@
+import re
+import json
+import time
+import sqlite3
+import difflib
+import argparse
+from pathlib import Path
+
+import dump_index
+
+OUTPUT_DIR = Path("../output")
+SCRIPT_JSON = OUTPUT_DIR / "dump" / "script.json"
+# シンボルテーブル全体をメモリマップで読む（ページキャッシュを共有し、2回目以降は即座に引ける）
+MMAP_SIZE = 1024 ** 3
+JSON_READ_SIZE = 1024 * 1024
+DEFAULT_LIMIT = 20
+GADGET_MODULE = "libil2cpp.so"
+# シンボル表の構成を変えたら上げる（古いdump.dbはシンボル表を作り直す）
+SYMBOLS_VERSION = 2
+# あいまい検索で類似度を計算する候補数の上限（絞り込み方法ごと）
+FUZZY_CANDIDATES = 200
+# 候補の順位付けに使うトライグラムの数（出現数の少ないものから。多いとFTS5の順位付けが遅くなる）
+FUZZY_TRIGRAMS = 8
+
+SYMBOLS_SCHEMA = """
+DROP TABLE IF EXISTS symbols_trigram_vocab;
+DROP TABLE IF EXISTS symbols_trigrams;
+DROP TABLE IF EXISTS symbols;
+CREATE TABLE symbols (
+    key TEXT NOT NULL, short_key TEXT NOT NULL, method_key TEXT NOT NULL,
+    qualified TEXT NOT NULL, type_name TEXT NOT NULL, method TEXT NOT NULL, signature TEXT NOT NULL,
+    rva INTEGER, is_static INTEGER NOT NULL, type_signature TEXT);
+"""
+SYMBOLS_INDEXES = """
+CREATE INDEX symbols_key ON symbols (key);
+CREATE INDEX symbols_short_key ON symbols (short_key);
+CREATE INDEX symbols_method_key ON symbols (method_key);
+"""
+# あいまい検索の候補をSQLite側で絞り込むためのトライグラム索引（FTS5、SQLite 3.34以降）
+SYMBOLS_TRIGRAMS = """
+CREATE VIRTUAL TABLE symbols_trigrams USING fts5(
+    short_key, content='symbols', content_rowid='rowid', tokenize='trigram');
+INSERT INTO symbols_trigrams (symbols_trigrams) VALUES ('rebuild');
+CREATE VIRTUAL TABLE symbols_trigram_vocab USING fts5vocab(symbols_trigrams, 'row');
+"""
+# script.jsonの "Namespace.Class$$Method"
+SCRIPT_METHOD_SEPARATOR = "$$"
+PARAMETERS = re.compile(r"\((.*)\)")
+
+def _iter_json_array(path, key):
+    """巨大なscript.jsonを全体で読み込まず、指定したキーの配列要素を1つずつ返す"""
+    decoder = json.JSONDecoder()
+    marker = f'"{key}"'
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        buffer = ""
+        # 配列の開始位置まで読み進める
+        while True:
+            position = buffer.find(marker)
+            bracket = buffer.find("[", position) if position >= 0 else -1
+            if bracket >= 0:
+                break
+            chunk = f.read(JSON_READ_SIZE)
+            if not chunk:
+                return
+            buffer = (buffer if position >= 0 else buffer[-len(marker):]) + chunk
+        buffer = buffer[bracket + 1:]
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                chunk = f.read(JSON_READ_SIZE)
+                if not chunk:
+                    raise
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+
+def connect(db_path, readonly=True):
+    if readonly:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    return conn
+
+def build_symbols(db_path, script_json=None):
+    """dump.dbに検索用のシンボル表を追加する（script.jsonがあれば型シグネチャも取り込む）"""
+    print(f"シンボル検索用のインデックスを作成中: {db_path}")
+    started = time.perf_counter()
+    conn = connect(db_path, readonly=False)
+    try:
+        conn.executescript(SYMBOLS_SCHEMA)
+        conn.execute("""
+            INSERT INTO symbols
+            SELECT lower(t.full_name || '::' || m.name), lower(t.name || '::' || m.name), lower(m.name),
+                   t.full_name || '::' || m.name, t.full_name, m.name, m.signature, m.rva,
+                   instr(' ' || m.signature || ' ', ' static ') > 0, NULL
+            FROM methods m JOIN types t ON t.id = m.type_id""")
+        conn.executescript(SYMBOLS_INDEXES)
+        try:
+            conn.executescript(SYMBOLS_TRIGRAMS)
+        except sqlite3.OperationalError as e:
+            print(f"警告: トライグラム索引を作成できません（{e}）。あいまい検索は先頭文字での絞り込みのみになります")
+        if script_json and Path(script_json).exists():
+            print(f"script.jsonを取り込み中: {script_json}")
+            conn.execute("CREATE TEMP TABLE script_methods (key TEXT, rva INTEGER, type_signature TEXT)")
+            rows = []
+            for item in _iter_json_array(script_json, "ScriptMethod"):
+                name = item.get("Name", "")
+                if SCRIPT_METHOD_SEPARATOR not in name:
+                    continue
+                type_name, method = name.split(SCRIPT_METHOD_SEPARATOR, 1)
+                rows.append((f"{type_name}::{method}".lower(), item.get("Address"), item.get("TypeSignature")))
+                if len(rows) >= dump_index.INSERT_BATCH_SIZE:
+                    conn.executemany("INSERT INTO script_methods VALUES (?, ?, ?)", rows)
+                    rows.clear()
+            conn.executemany("INSERT INTO script_methods VALUES (?, ?, ?)", rows)
+            conn.execute("CREATE INDEX temp.script_methods_key ON script_methods (key, rva)")
+            conn.execute("""
+                UPDATE symbols SET type_signature = (
+                    SELECT s.type_signature FROM script_methods s
+                    WHERE s.key = symbols.key AND s.rva IS symbols.rva)
+                WHERE rva IS NOT NULL""")
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('symbols_source_sha256', "
+                     "(SELECT value FROM meta WHERE key = 'source_sha256'))")
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('symbols_version', ?)", (str(SYMBOLS_VERSION),))
+        conn.commit()
+        count, = conn.execute("SELECT count(*) FROM symbols").fetchone()
+    finally:
+        conn.close()
+    print(f"{count}件のシンボルを登録しました（{time.perf_counter() - started:.2f}秒）")
+    return count
+
+def ensure_symbols(db_path, script_json=SCRIPT_JSON):
+    """dump.dbが更新されていればシンボル表を作り直す"""
+    meta = dump_index.read_meta(db_path)
+    if not meta:
+        raise FileNotFoundError(f"シンボルテーブルが見つかりません: {db_path}")
+    if (meta.get("symbols_source_sha256") != meta.get("source_sha256")
+            or meta.get("symbols_version") != str(SYMBOLS_VERSION)):
+        build_symbols(db_path, script_json)
+
+def _row_dict(row):
+    qualified, signature, rva, is_static, type_signature = row
+    return {"symbol": qualified, "signature": signature, "rva": dump_index.format_address(rva),
+            "static": bool(is_static), "type_signature": type_signature}
+
+class SymbolIndex:
+    """dump.dbのシンボル表に対する検索（接続は使い回し、ページはメモリマップで読む）"""
+
+    COLUMNS = "qualified, signature, rva, is_static, type_signature"
+
+    def __init__(self, db_path=OUTPUT_DIR / dump_index.INDEX_NAME, script_json=SCRIPT_JSON):
+        self.db_path = Path(db_path)
+        ensure_symbols(self.db_path, script_json)
+        self.conn = connect(self.db_path)
+        self.has_trigrams = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'symbols_trigrams'").fetchone() is not None
+
+    def close(self):
+        self.conn.close()
+
+    def lookup(self, query):
+        """「Class::Method」「Namespace.Class::Method」「Method」で完全一致するシンボルを返す"""
+        key = query.strip().lower()
+        if "(" in key:
+            key = key.split("(", 1)[0].strip()
+        columns = ("key", "short_key") if "::" in key else ("method_key",)
+        for column in columns:
+            rows = self.conn.execute(f"SELECT {self.COLUMNS} FROM symbols WHERE {column} = ?", (key,)).fetchall()
+            if rows:
+                return [_row_dict(row) for row in rows]
+        return []
+
+    def prefix(self, prefix, limit=DEFAULT_LIMIT):
+        """前方一致検索（インデックスの範囲検索なので全件走査しない）"""
+        key = prefix.strip().lower()
+        results = []
+        for column in ("key", "short_key", "method_key"):
+            rows = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM symbols WHERE {column} >= ? AND {column} < ? ORDER BY {column} LIMIT ?",
+                (key, key + "\U0010ffff", limit))
+            results.extend(_row_dict(row) for row in rows)
+            if results:
+                break
+        return results[:limit]
+
+    def _trigram_candidates(self, key):
+        """クエリの珍しいトライグラムを多く含む上位の候補（FTS5の索引で絞り込み、全件走査しない）"""
+        trigrams = sorted({key[i:i + 3] for i in range(len(key) - 2)})
+        if not self.has_trigrams or not trigrams:
+            return []
+        counts = dict(self.conn.execute(
+            f"SELECT term, doc FROM symbols_trigram_vocab WHERE term IN ({', '.join('?' * len(trigrams))})", trigrams))
+        trigrams = sorted(counts, key=counts.get)[:FUZZY_TRIGRAMS]
+        if not trigrams:
+            return []
+        match = " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in trigrams)
+        return self.conn.execute(
+            f"SELECT short_key, {self.COLUMNS} FROM symbols WHERE rowid IN ("
+            "SELECT rowid FROM symbols_trigrams WHERE symbols_trigrams MATCH ? ORDER BY rank LIMIT ?)",
+            (match, FUZZY_CANDIDATES)).fetchall()
+
+    def _subsequence_candidates(self, key):
+        """先頭文字が同じで、クエリの文字を順番に含む候補（略記向け。short_keyの索引の範囲内だけを調べる）"""
+        pattern = "%".join(ch.replace("%", r"\%").replace("_", r"\_") for ch in key) + "%"
+        return self.conn.execute(
+            f"SELECT short_key, {self.COLUMNS} FROM symbols "
+            "WHERE short_key >= ? AND short_key < ? AND short_key LIKE ? ESCAPE '\\' LIMIT ?",
+            (key[0], chr(ord(key[0]) + 1), pattern, FUZZY_CANDIDATES)).fetchall()
+
+    def fuzzy(self, query, limit=DEFAULT_LIMIT):
+        """候補をSQLite側で絞り込んでから（各方法でFUZZY_CANDIDATES件まで）、類似度の高い順に返す"""
+        key = query.strip().lower()
+        if not key:
+            return []
+        candidates = dict.fromkeys(self._trigram_candidates(key) + self._subsequence_candidates(key))
+        scored = []
+        for row in candidates:
+            score = difflib.SequenceMatcher(None, key, row[0]).ratio()
+            scored.append((score, row[1:]))
+        scored.sort(key=lambda item: (-item[0], item[1][0]))
+        return [dict(_row_dict(row), score=round(score, 3)) for score, row in scored[:limit]]
+
+    def frida_hooks(self, queries):
+        """複数のシグネチャからFridaのフックスクリプトを生成する（見つからないものはコメントで残す）"""
+        hooks = []
+        missing = []
+        for query in queries:
+            matches = [m for m in self.lookup(query) if m["rva"] is not None]
+            if not matches:
+                missing.append(query)
+            hooks.extend(matches)
+        return render_frida_script(hooks, missing)
+
+def _argument_count(symbol):
+    if symbol.get("type_signature"):
+        # 先頭は戻り値、残りが引数（インスタンスメソッドはthisを含み、末尾にMethodInfo*が付く）
+        return max(0, len(symbol["type_signature"]) - 2)
+    match = PARAMETERS.search(symbol["signature"])
+    params = [p for p in match.group(1).split(",") if p.strip()] if match else []
+    return len(params) + (0 if symbol["static"] else 1)
+
+def render_frida_script(symbols, missing=(), module=GADGET_MODULE):
+    lines = [
+        "// 自動生成: symbol_lookup.py",
+        f'const MODULE_NAME = "{module}";',
+        "",
+        "function installHooks(base) {",
+    ]
+    for symbol in symbols:
+        args = ", ".join(f"args[{i}]" for i in range(_argument_count(symbol)))
+        lines += [
+            f"    // {symbol['signature']}",
+            f"    Interceptor.attach(base.add({symbol['rva']}), {{",
+            "        onEnter(args) {",
+            f"            console.log(\"[+] {symbol['symbol']}\"{', ' + args if args else ''});",
+            "        },",
+            "        onLeave(retval) {",
+            f"            console.log(\"[-] {symbol['symbol']} =>\", retval);",
+            "        }",
+            "    });",
+        ]
+    for query in missing:
+        lines.append(f"    // 見つかりませんでした: {query}")
+    lines += [
+        "}",
+        "",
+        "const timer = setInterval(() => {",
+        "    const base = Module.findBaseAddress(MODULE_NAME);",
+        "    if (base !== null) {",
+        "        clearInterval(timer);",
+        "        installHooks(base);",
+        "    }",
+        "}, 100);",
+        "",
+    ]
+    return "\n".join(lines)
+
+def _print_results(results):
+    if not results:
+        print("見つかりませんでした")
+    for result in results:
+        score = f" ({result['score']})" if "score" in result else ""
+        print(f"{result['rva'] or '-':>12}  {result['symbol']}{score}")
+        print(f"{'':>12}  {result['signature']}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="dump.csのシンボル検索とFridaフックの生成")
+    parser.add_argument("--db", type=Path, default=OUTPUT_DIR / dump_index.INDEX_NAME)
+    parser.add_argument("--script-json", type=Path, default=SCRIPT_JSON)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rva = subparsers.add_parser("rva", help="Class::MethodのRVAを表示する")
+    rva.add_argument("queries", nargs="+")
+    search = subparsers.add_parser("search", help="前方一致で検索する")
+    search.add_argument("prefix")
+    search.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    fuzzy = subparsers.add_parser("fuzzy", help="あいまい検索する")
+    fuzzy.add_argument("query")
+    fuzzy.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    hooks = subparsers.add_parser("hooks", help="Fridaのフックスクリプトを生成する")
+    hooks.add_argument("queries", nargs="*")
+    hooks.add_argument("-f", "--file", type=Path, help="1行に1つシグネチャを書いたファイル")
+    hooks.add_argument("-o", "--output", type=Path, help="出力先（省略時は標準出力）")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    index = SymbolIndex(args.db, args.script_json)
+    try:
+        if args.command == "hooks":
+            queries = list(args.queries)
+            if args.file:
+                queries += [line.strip() for line in args.file.read_text(encoding="utf-8").splitlines() if line.strip()]
+            script = index.frida_hooks(queries)
+            if args.output:
+                args.output.write_text(script, encoding="utf-8")
+                print(f"Fridaスクリプトを生成しました: {args.output}")
+            else:
+                print(script)
+            return
+        started = time.perf_counter()
+        if args.command == "rva":
+            results = [result for query in args.queries for result in index.lookup(query)]
+        elif args.command == "search":
+            results = index.prefix(args.prefix, args.limit)
+        else:
+            results = index.fuzzy(args.query, args.limit)
+        elapsed = time.perf_counter() - started
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        else:
+            _print_results(results)
+            print(f"（{len(results)}件、{elapsed * 1000:.1f}ミリ秒）")
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import re
+import zipfile
+from pathlib import Path
+
+import apk_zip
+import axml
+import frida_dex
+
+MANIFEST_ENTRY = "AndroidManifest.xml"
+GADGET_ENTRY = "lib/{abi}/libfrida-gadget.so"
+# 元の署名ファイルはマニフェスト変更で無効になるため取り除く
+SIGNATURE_ENTRY = re.compile(r"^META-INF/([^/]+\.(SF|RSA|DSA|EC)|MANIFEST\.MF)$", re.IGNORECASE)
+DEX_ENTRY = re.compile(r"^classes(\d*)\.dex$")
+# ネイティブライブラリは署名前に無圧縮・16KiB境界へ揃える（inject_frida.align_outputs）ため、
+# インストール時に展開させずAPKから直接読み込ませる。あわせてデバッグ可能にする
+EXTRACT_NATIVE_LIBS = False
+DEBUGGABLE = True
+
+def next_dex_name(names):
+    numbers = [1]
+    for name in names:
+        match = DEX_ENTRY.match(name)
+        if match:
+            numbers.append(int(match.group(1) or 1))
+    return f"classes{max(numbers) + 1}.dex"
+
+def patch_manifest_for_gadget(manifest):
+    """バイナリマニフェストをFridaApplication用に書き換え、(新しいマニフェスト, 生成するDEX) を返す"""
+    patched_manifest, original_application = axml.patch_manifest(
+        manifest, frida_dex.FRIDA_APPLICATION_CLASS,
+        extract_native_libs=EXTRACT_NATIVE_LIBS, debuggable=DEBUGGABLE)
+    if original_application:
+        print(f"既存のApplicationクラスを継承します: {original_application}")
+    return patched_manifest, frida_dex.build_frida_application_dex(original_application)
+
+def inject_frida_gadget_zip(apk_path, gadgets, output_path, patch_manifest=True):
+    """apktoolを使わず、ZIPエントリを再圧縮せずにコピーしてGadget・DEX・マニフェストを差し替える
+
+    gadgetsは {ABI: Gadgetのパス}。patch_manifest=Falseの場合はGadgetの追加のみ行う（ABIスプリットAPK用）。
+    """
+    apk_path = Path(apk_path)
+    output_path = Path(output_path)
+    print(f"ZIP直接モードでインジェクト中: {apk_path} ({', '.join(gadgets) or 'Gadgetなし'})")
+
+    patched_manifest = dex = None
+    if patch_manifest:
+        with zipfile.ZipFile(apk_path, 'r') as zip_ref:
+            try:
+                manifest = zip_ref.read(MANIFEST_ENTRY)
+            except KeyError:
+                raise FileNotFoundError("AndroidManifest.xmlをAPKから抽出できませんでした")
+        patched_manifest, dex = patch_manifest_for_gadget(manifest)
+
+    gadget_entries = {GADGET_ENTRY.format(abi=abi): path for abi, path in gadgets.items()}
+    temp_output = output_path.with_name(output_path.name + ".tmp")
+    with open(apk_path, 'rb') as src, open(temp_output, 'wb') as dst:
+        entries = apk_zip.read_entries(src)
+        writer = apk_zip.RawZipWriter(dst)
+        for entry in entries:
+            name = entry.filename
+            if SIGNATURE_ENTRY.match(name) or name in gadget_entries:
+                continue
+            if name == MANIFEST_ENTRY and patched_manifest is not None:
+                writer.add_bytes(name, patched_manifest, compress=entry.method != apk_zip.STORED)
+            elif apk_zip.NATIVE_LIB_ENTRY.match(name):
+                writer.copy_entry(src, entry, alignment=apk_zip.NATIVE_LIB_ALIGNMENT)
+            else:
+                writer.copy_entry(src, entry)
+        if dex is not None:
+            writer.add_bytes(next_dex_name(e.filename for e in entries), dex, compress=True)
+        for entry_name in sorted(gadget_entries):
+            writer.add_file(entry_name, gadget_entries[entry_name], compress=False, alignment=apk_zip.NATIVE_LIB_ALIGNMENT)
+        writer.close()
+    os.replace(temp_output, output_path)
+    print(f"ZIP直接モードでのインジェクトが完了しました: {output_path}")
+    return output_path